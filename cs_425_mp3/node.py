@@ -8,6 +8,7 @@ import datetime
 import logging
 import argparse
 import hashlib
+import bisect
 import base64
 import paramiko
 
@@ -34,6 +35,11 @@ Introducor = 'fa23-cs425-5601.cs.illinois.edu'
 HEARTBEAT_PORT_NUM = 12360
 MESSAGE_PORT_NUM = 12361
 
+# Every node is placed at VIRTUAL_NODES points of the consistent hashing ring, a file is stored on
+# the first REPLICA_COUNT distinct nodes clockwise from its hash.
+VIRTUAL_NODES = 100
+REPLICA_COUNT = 4
+
 # Configure logging for the script. This sets up a logging system that records debug information
 # to the 'output.log' file, including timestamps and log levels.
 logging.basicConfig(level=logging.DEBUG,
@@ -42,6 +48,30 @@ logging.basicConfig(level=logging.DEBUG,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+def hash_key(key):
+    return int(hashlib.md5(key.encode()).hexdigest(), 16)
+
+# Consistent hashing ring built from the live nodes. With virtual nodes the files are spread evenly,
+# and a node joining or leaving only moves the files next to its points, about 1/N of all files.
+class HashRing:
+    def __init__(self, nodes, virtual_nodes = VIRTUAL_NODES):
+        self.nodes = frozenset(nodes)
+        points = sorted((hash_key(f"{node}#{v}"), node) for node in self.nodes for v in range(virtual_nodes))
+        self.hashes = [point for point, _ in points]
+        self.owners = [node for _, node in points]
+
+    # Distinct nodes clockwise from the position of key on the ring
+    def get_nodes(self, key, count):
+        locations = []
+        start = bisect.bisect(self.hashes, hash_key(key))
+        for ix in range(len(self.owners)):
+            node = self.owners[(start + ix) % len(self.owners)]
+            if node not in locations:
+                locations.append(node)
+                if len(locations) == min(count, len(self.nodes)):
+                    break
+        return locations
+
 # The `Server` class represents a node in a distributed system.
 class Server:
     def __init__(self,args):
@@ -88,6 +118,10 @@ class Server:
         self.gossipS = False
         self.writing_lock = threading.RLock()
         self.writing_locks_dict = {}
+        # Hash ring of the live nodes, rebuilt when the membership changes
+        self.ring = None
+        # Every node seen in the membership list, failed nodes are the ones that left it
+        self.known_nodes = set()
 
     def get_info(self):
         try:
@@ -187,12 +221,14 @@ class Server:
                         elif data_list[file_key]['heartbeat'] >= self.file_info[file_key]['heartbeat']:
                             failed_nodes, healthy_nodes = self.get_failed_nodes()
                             new_locations = self.file_info[file_key]["locations"]
-                            for replica in self.file_info[file_key]["locations"]:
-                                available_locations = healthy_nodes - set(new_locations)
+                            # Failed replicas are replaced by the next live nodes clockwise on the ring
+                            ring_order = self.get_ring().get_nodes(file_key, len(healthy_nodes))
+                            for replica in list(self.file_info[file_key]["locations"]):
+                                available_locations = [node for node in ring_order if node not in new_locations]
                                 if replica in failed_nodes:
                                     new_locations.remove(replica)
                                     if (len(available_locations) > 0):
-                                        new_locations.append(random.sample(available_locations, 1)[0])
+                                        new_locations.append(available_locations[0])
                             # If fixing broken replicas, update heartbeat
                             if (new_locations != self.file_info[file_key]["locations"] and 
                                 self.file_info[file_key]['heartbeat'] == data_list[file_key]['heartbeat']):
@@ -320,8 +356,9 @@ class Server:
         healthy_nodes = list(self.membership_list.keys())
         healthy_nodes = [self.ip_to_machine_id(key) for key in healthy_nodes]
         healthy_nodes = set(healthy_nodes)
-        all_nodes = set(range(1, 11))
-        return all_nodes - healthy_nodes, healthy_nodes
+        self.known_nodes |= healthy_nodes
+        self.known_nodes |= set(self.ip_to_machine_id(key) for key in list(self.failed_nodes.keys()))
+        return self.known_nodes - healthy_nodes, healthy_nodes
 
     def print_membership_list(self):
         # Method to print the membership list to the log file and return it as a string.
@@ -420,17 +457,21 @@ class Server:
         with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
             s.sendto(json.dumps(update_finish).encode(), (target_machine, MESSAGE_PORT_NUM))
 
+    # Ring of the current live nodes, only rebuilt when the set of live nodes changed
+    def get_ring(self):
+        with self.membership_lock:
+            _, healthy_nodes = self.get_failed_nodes()
+            if self.ring is None or self.ring.nodes != healthy_nodes:
+                self.ring = HashRing(healthy_nodes)
+            return self.ring
+
     def get_original_location(self, file_name):
-        # Get hash for file
-        hash_obj = hashlib.md5(file_name.encode())
-        hash_hex = hash_obj.hexdigest()
-        hash_int = int(hash_hex, 16)
-        return (hash_int % 10) + 1
+        # First live node clockwise from the file's hash
+        return self.get_file_locations(file_name)[0]
 
     # Return list of all nodes at which file is stored
     def get_file_locations(self, file_name):
-        original_location = self.get_original_location(file_name)
-        return [(original_location + ix) % 10 + 1 for ix in range(4)]
+        return self.get_ring().get_nodes(file_name, REPLICA_COUNT)
 
     def upload_file(self, target_machine_ix, local_file_name, sdfs_file_name):
         """
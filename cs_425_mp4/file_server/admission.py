@@ -0,0 +1,89 @@
+import time
+import threading
+from collections import Counter
+
+#########hard code area
+max_outstanding = 1000          # user requests the leader accepted and has not acked yet
+max_per_client = 200            # of those, from one client
+class_shares = {'interactive': 1.0, 'job': 0.7, 'rereplication': 0.3}    # share of max_outstanding a class may fill
+default_class = 'interactive'
+retry_base = 0.5                # seconds a rejected client waits before it retries, grows with the overload
+request_ttl = 600               # seconds after which an outstanding request that was never acked stops counting
+#########
+
+
+class AdmissionControl():
+    """
+        Leader side limits on outstanding requests, those accepted and not finish_acked yet.
+        A request is admitted while the total is below its class share of max_outstanding and its
+        client has fewer than max_per_client outstanding. Lower classes (maple/juice jobs,
+        replica moves) hit their share first, so interactive requests always find room and the
+        queue, and with it tail latency, stays bounded. A rejected client is told to retry after
+        a delay that grows with the overload.
+    """
+
+    def __init__(self, max_outstanding = max_outstanding, max_per_client = max_per_client, class_shares = class_shares):
+        self.lock = threading.Lock()
+        self.max_outstanding = max_outstanding
+        self.max_per_client = max_per_client
+        self.class_shares = class_shares
+        self.outstanding = {}           # task_id: (client, class, admitted time)
+        self.per_client = Counter()
+        self.per_class = Counter()
+        self.rejected = Counter()       # class: requests turned away
+
+    def _expire(self):
+        # caller holds self.lock; requests whose ack got lost must not hold a slot forever
+        now = time.time()
+        for task_id, (client, priority, admitted) in list(self.outstanding.items()):
+            if now - admitted < request_ttl:
+                break
+            self._release(task_id)
+
+    def _release(self, task_id):
+        # caller holds self.lock
+        client, priority, admitted = self.outstanding.pop(task_id)
+        self.per_client[client] -= 1
+        if self.per_client[client] <= 0:
+            del self.per_client[client]
+        self.per_class[priority] -= 1
+
+    def limit(self, priority):
+        return int(self.max_outstanding * self.class_shares.get(priority, self.class_shares[default_class]))
+
+    def has_room(self, priority):
+        with self.lock:
+            self._expire()
+            return len(self.outstanding) < self.limit(priority)
+
+    def admit(self, task_id, client, priority = default_class, force = False):
+        """
+            Count a new request. Returns None if it is admitted, else the seconds the client
+            should wait before it retries. force admits it anyway (requests a new leader resumes).
+        """
+        with self.lock:
+            self._expire()
+            if task_id in self.outstanding:
+                return None
+            total = len(self.outstanding)
+            if not force:
+                if total >= self.limit(priority):
+                    self.rejected[priority] += 1
+                    return retry_base * (1 + total / max(1, self.limit(priority)))
+                if self.per_client[client] >= self.max_per_client:
+                    self.rejected[priority] += 1
+                    return retry_base * (1 + self.per_client[client] / self.max_per_client)
+            self.outstanding[task_id] = (client, priority, time.time())
+            self.per_client[client] += 1
+            self.per_class[priority] += 1
+            return None
+
+    def release(self, task_id):
+        with self.lock:
+            if task_id in self.outstanding:
+                self._release(task_id)
+
+    def stats(self):
+        with self.lock:
+            return {'outstanding': len(self.outstanding), 'per_class': dict(self.per_class),
+                    'clients': len(self.per_client), 'rejected': dict(self.rejected)}
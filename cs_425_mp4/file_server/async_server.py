@@ -0,0 +1,123 @@
+import os
+import time
+import json
+import asyncio
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from framing import frame_header, max_json_length, chunk_size, msg_format
+
+#########hard code area
+max_connections = 64        # connections served at the same time, further ones wait until one closes
+max_workers = 16            # threads running blocking request handlers (disk, scp, subprocess)
+max_pending = 256           # requests accepted but not finished, reading stops above it
+#########
+
+
+async def recv_message(reader, spool_dir):
+    """
+        asyncio version of framing.recv_message, the payload is streamed into a spool file
+        in chunks. Returns None when the connection is closed.
+    """
+    try:
+        header = await reader.readexactly(frame_header.size)
+    except asyncio.IncompleteReadError:
+        return None
+    json_length, payload_length = frame_header.unpack(header)
+    if json_length > max_json_length:
+        raise ValueError(f"frame json length {json_length} too large")
+
+    try:
+        body = await reader.readexactly(json_length)
+    except asyncio.IncompleteReadError:
+        return None
+    http_packet = json.loads(body.decode(msg_format))
+
+    if payload_length > 0:
+        fd, path = tempfile.mkstemp(dir = spool_dir, prefix = 'payload_')
+        start = time.time()
+        try:
+            with os.fdopen(fd, 'wb') as spool:
+                remaining = payload_length
+                while remaining > 0:
+                    chunk = await reader.read(min(remaining, chunk_size))
+                    if not chunk:
+                        raise ConnectionError("connection closed in the middle of a payload")
+                    spool.write(chunk)
+                    remaining -= len(chunk)
+        except BaseException:
+            os.remove(path)
+            raise
+        http_packet['payload_path'] = path
+        # receiving side throughput of the payload, e.g. for peer_stats
+        http_packet['payload_bytes'] = payload_length
+        http_packet['payload_seconds'] = time.time() - start
+    return http_packet
+
+
+class AsyncServer():
+    """
+        Framed request server on one event loop thread. The loop only reads frames; handlers
+        block on disk, scp and subprocesses, so they run in a bounded thread pool. At most
+        max_connections connections are read at once and at most max_pending requests are in
+        flight, above that reading pauses and TCP pushes back on the senders. An idle server
+        sleeps in the selector.
+        ordered=True handles the requests of one connection one after the other in arrival
+        order (leader: scheduling order), otherwise they run in parallel.
+        inline(http_packet) is offered every request first on the loop thread and returns True
+        if it handled it; it must not block. Replies that a blocked worker waits for go there,
+        so they are delivered even when every worker is busy.
+    """
+
+    def __init__(self, sock, handle, spool_dir, ordered = False, max_connections = max_connections, max_workers = max_workers, max_pending = max_pending, on_error = print, inline = None):
+        self.sock = sock
+        self.handle = handle
+        self.inline = inline
+        self.spool_dir = spool_dir
+        self.ordered = ordered
+        self.max_connections = max_connections
+        self.max_pending = max_pending
+        self.on_error = on_error
+        self.executor = ThreadPoolExecutor(max_workers = max_workers)
+
+    def run(self):
+        """
+            Serve forever on the calling thread, with its own event loop
+        """
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.sock.listen()
+        loop.run_until_complete(self.start())
+        loop.run_forever()
+
+    async def start(self):
+        # created inside the loop, python 3.6 binds them to the running loop
+        self.connections = asyncio.Semaphore(self.max_connections)
+        self.pending = asyncio.Semaphore(self.max_pending)
+        self.server = await asyncio.start_server(self.serve, sock = self.sock)
+
+    async def serve(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        async with self.connections:
+            try:
+                while True:
+                    http_packet = await recv_message(reader, self.spool_dir)
+                    if http_packet is None:
+                        break
+                    if self.inline is not None and self.inline(http_packet):
+                        continue
+                    await self.pending.acquire()
+                    task = asyncio.ensure_future(self.run_handler(http_packet))
+                    if self.ordered:
+                        await task
+            except Exception as e:
+                self.on_error(f"Connection from {str(peer)} error: {str(e)}")
+            finally:
+                writer.close()
+
+    async def run_handler(self, http_packet):
+        try:
+            await asyncio.get_event_loop().run_in_executor(self.executor, self.handle, http_packet)
+        except Exception as e:
+            self.on_error(f"Request {http_packet.get('task_id')} error: {str(e)}")
+        finally:
+            self.pending.release()
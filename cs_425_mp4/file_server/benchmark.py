@@ -0,0 +1,328 @@
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import argparse
+import tempfile
+import datetime
+import threading
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from async_server import AsyncServer
+from connection_pool import ConnectionPool
+from relay import receive_relayed
+from framing import store_payload
+
+#########hard code area
+mp4_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))   # fileserver.py runs from here
+client_name = 'bench'
+base_port = 6100                # node i uses base_port + 3i (receiver), +1 (leader), +2 (metrics), the client the port after the last node
+startup_timeout = 60            # seconds the servers get to elect a leader and take a first put
+request_timeout = 120           # seconds one request may take before it counts as an error
+default_sizes = [4 << 10, 1 << 20, 16 << 20]
+default_concurrency = [1, 4, 16]
+default_workloads = ['put', 'get', 'delete', 'multiread', 'multiwrite']
+#########
+
+
+def percentile(samples, q):
+    """
+        Nearest rank percentile of a sorted list
+    """
+    if len(samples) == 0:
+        return None
+    return samples[min(len(samples) - 1, max(0, int(round(q * len(samples) + 0.5)) - 1))]
+
+
+class Cluster():
+    """
+        N fileservers on loopback, each with its own ports and data directory under root. They
+        share the filesystem, so files move with cp (SDFS_TRANSFER=local), and the membership is
+        fixed (SDFS_MEMBERS) instead of gossiped, the gossip ports are the same on every server.
+    """
+
+    def __init__(self, root, nodes, base_port = base_port):
+        self.root = root
+        self.names = [f'node{index:02d}' for index in range(nodes)]
+        self.ports = {name: (base_port + 3 * index, base_port + 3 * index + 1, base_port + 3 * index + 2) for index, name in enumerate(self.names)}
+        self.client_port = base_port + 3 * nodes
+        self.processes = {}
+
+    def addresses(self):
+        addresses = [f'{name}=127.0.0.1:{ports[0]}:{ports[1]}' for name, ports in self.ports.items()]
+        addresses.append(f'{client_name}=127.0.0.1:{self.client_port}:{self.client_port}')
+        return ','.join(addresses)
+
+    def start(self):
+        for name in self.names:
+            node_root = os.path.join(self.root, name)
+            os.makedirs(node_root, exist_ok = True)
+            env = dict(os.environ)
+            env['SDFS_NODE'] = name
+            env['SDFS_ROOT'] = node_root
+            env['SDFS_MP4_PATH'] = os.path.join(node_root, 'mp4')
+            env['SDFS_TRANSFER'] = 'local'
+            env['SDFS_NODES'] = self.addresses()
+            env['SDFS_MEMBERS'] = ','.join(self.names)
+            env['SDFS_RECEIVER_PORT'], env['SDFS_LEADER_PORT'], env['SDFS_METRICS_PORT'] = [str(port) for port in self.ports[name]]
+            env['PYTHONUNBUFFERED'] = '1'
+            log = open(os.path.join(self.root, name + '.log'), 'w')
+            self.processes[name] = subprocess.Popen([sys.executable, 'file_server/fileserver.py'], cwd = mp4_dir, env = env,
+                                                    stdin = subprocess.DEVNULL, stdout = log, stderr = subprocess.STDOUT)
+            log.close()
+
+    def stats(self):
+        """
+            Metrics snapshot of every server (see metrics.py)
+        """
+        stats = {}
+        for name in self.names:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{self.ports[name][2]}/metrics', timeout = 5) as response:
+                    stats[name] = json.loads(response.read().decode('utf-8'))
+            except Exception as e:
+                stats[name] = str(e)
+        return stats
+
+    def stop(self):
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            try:
+                process.wait(timeout = 10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+class BenchClient():
+    """
+        SDFS client that is not a member: requests go to the leader port of the leader, which
+        answers with a finish_ack on the client's own receiver port, or with not_leader. Replicas
+        send the data of gets there too.
+        request() blocks until the answer and returns (seconds, ok).
+    """
+
+    def __init__(self, cluster, spool_dir):
+        self.cluster = cluster
+        self.spool_dir = spool_dir
+        self.leader = cluster.names[0]
+        self.lock = threading.Lock()
+        self.pending = {}           # task_id: {'done': Event, 'failed': bool}
+        self.count = 0
+        self.connection_pool = ConnectionPool()
+
+    def start(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(('127.0.0.1', self.cluster.client_port))
+        server = AsyncServer(sock, self.handle, self.spool_dir, on_error = lambda error: None)
+        threading.Thread(target = server.run, daemon = True).start()
+
+    def send(self, leader, http_packet):
+        try:
+            self.connection_pool.send('127.0.0.1', self.cluster.ports[leader][1], http_packet)
+            return True
+        except OSError:
+            return False
+
+    def forward(self, dest, http_packet, path):
+        try:
+            self.connection_pool.send('127.0.0.1', self.cluster.ports[dest][0], http_packet, path)
+            return True
+        except OSError:
+            return False
+
+    def handle(self, http_packet):
+        if http_packet['request_type'] == 'file_data':
+            # the data of a get, the client stores it, relays it on and acks the leader like a fileserver does
+            self.send(self.leader, receive_relayed(http_packet, client_name, lambda path: store_payload(http_packet, path), self.forward))
+        if 'payload_path' in http_packet:
+            os.remove(http_packet['payload_path'])
+        if http_packet['request_type'] == 'not_leader':
+            request = http_packet['request']
+            if http_packet['leader'] in self.cluster.ports:
+                self.leader = http_packet['leader']
+            # an election is running, give it time to finish
+            time.sleep(0.2)
+            self.send(self.leader, request)
+        elif http_packet['request_type'] == 'retry_later':
+            # the leader is overloaded, the wait counts into the request's latency
+            threading.Timer(http_packet['retry_after'], self.send, args = (self.leader, http_packet['request'])).start()
+        elif http_packet['request_type'] == 'finish_ack':
+            with self.lock:
+                waiting = self.pending.get(http_packet['task_id'])
+            if waiting is not None:
+                waiting['failed'] = len(http_packet.get('failed') or []) > 0
+                waiting['done'].set()
+
+    def request(self, request_type, sdfs_filename, local_filename = None, timeout = request_timeout):
+        with self.lock:
+            self.count += 1
+            task_id = f'{client_name}_{self.count}_{datetime.datetime.now()}'
+            waiting = {'done': threading.Event(), 'failed': False}
+            self.pending[task_id] = waiting
+        http_packet = {}
+        http_packet['task_id'] = task_id
+        http_packet['sdfs_filename'] = sdfs_filename
+        http_packet['local_filename'] = local_filename
+        http_packet['request_type'] = request_type
+        http_packet['request_source'] = client_name
+        if request_type == 'put':
+            http_packet['size'] = os.path.getsize(local_filename)
+
+        start = time.time()
+        sent = self.send(self.leader, http_packet)
+        done = sent and waiting['done'].wait(timeout)
+        seconds = time.time() - start
+        with self.lock:
+            del self.pending[task_id]
+        return seconds, done and not waiting['failed']
+
+    def wait_ready(self, local_filename, timeout = startup_timeout):
+        """
+            Retry a small put until the leader takes it
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.request('put', 'bench_warmup', local_filename, timeout = 5)[1]:
+                self.request('delete', 'bench_warmup', timeout = 5)
+                return
+            time.sleep(1)
+        raise TimeoutError(f"no leader answered within {timeout} seconds")
+
+
+class Benchmark():
+    """
+        Workloads, each run once per file size and concurrency level with ops requests in total:
+            put         every request puts a new file
+            get         every request reads one of the files the put run wrote
+            delete      every request deletes one of those files
+            multiread   all requests read the same file
+            multiwrite  all requests put the same file, the leader runs them one after the other
+        Latency is measured at the client from sending the request to its finish_ack.
+    """
+
+    def __init__(self, client, work_dir, ops):
+        self.client = client
+        self.work_dir = work_dir
+        self.ops = ops
+        self.sources = {}
+
+    def source(self, size):
+        if size not in self.sources:
+            path = os.path.join(self.work_dir, f'source_{size}')
+            with open(path, 'wb') as fd:
+                remaining = size
+                while remaining > 0:
+                    chunk = os.urandom(min(remaining, 1 << 20))
+                    fd.write(chunk)
+                    remaining -= len(chunk)
+            self.sources[size] = path
+        return self.sources[size]
+
+    def get_path(self, name):
+        return os.path.join(self.work_dir, 'get_' + name)
+
+    def run_requests(self, requests, concurrency):
+        """
+            Run (request_type, sdfs_filename, local_filename) requests on concurrency client threads
+        """
+        def run(request):
+            seconds, ok = self.client.request(*request)
+            if request[0] == 'get' and os.path.exists(request[2]):
+                os.remove(request[2])
+            return seconds, ok
+
+        start = time.time()
+        with ThreadPoolExecutor(max_workers = concurrency) as executor:
+            results = list(executor.map(run, requests))
+        return results, time.time() - start
+
+    def workload(self, name, size, concurrency):
+        prefix = f'bench_{size}_{concurrency}'
+        source = self.source(size)
+        if name == 'put':
+            requests = [('put', f'{prefix}_{index}', source) for index in range(self.ops)]
+        elif name == 'get':
+            requests = [('get', f'{prefix}_{index}', self.get_path(f'{prefix}_{index}')) for index in range(self.ops)]
+        elif name == 'delete':
+            requests = [('delete', f'{prefix}_{index}', None) for index in range(self.ops)]
+        elif name == 'multiread':
+            self.client.request('put', f'{prefix}_multi', source)
+            requests = [('get', f'{prefix}_multi', self.get_path(f'{prefix}_multi_{index}')) for index in range(self.ops)]
+        elif name == 'multiwrite':
+            requests = [('put', f'{prefix}_multi', source) for index in range(self.ops)]
+        else:
+            raise ValueError(f"unknown workload {name}")
+
+        results, seconds = self.run_requests(requests, concurrency)
+        latencies = sorted(latency for latency, ok in results if ok)
+        moved = size * len(latencies) if name != 'delete' else 0
+        return {'workload': name, 'size': size, 'concurrency': concurrency, 'ops': len(results),
+                'errors': len(results) - len(latencies), 'seconds': seconds,
+                'ops_per_s': len(latencies) / seconds, 'mb_per_s': moved / seconds / (1 << 20),
+                'p50': percentile(latencies, 0.5), 'p99': percentile(latencies, 0.99),
+                'mean': sum(latencies) / len(latencies) if latencies else None}
+
+    def run(self, workloads, sizes, concurrency_levels):
+        results = []
+        for size in sizes:
+            for concurrency in concurrency_levels:
+                # put, get and delete work on the same files, so they run in this order
+                for name in [name for name in default_workloads if name in workloads]:
+                    result = self.workload(name, size, concurrency)
+                    print(f"{name} size {size} concurrency {concurrency}: {result['ops_per_s']:.1f} ops/s, p50 {result['p50']}, p99 {result['p99']}, {result['errors']} errors", file = sys.stderr)
+                    results.append(result)
+                if 'multiread' in workloads or 'multiwrite' in workloads:
+                    self.client.request('delete', f'bench_{size}_{concurrency}_multi')
+        return results
+
+
+def int_list(value):
+    return [int(item) for item in value.split(',') if item]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Start an SDFS cluster on this machine and measure its throughput and latency.')
+    parser.add_argument('-n', '--nodes', type=int, default=4, help='Number of fileservers, at least 2')
+    parser.add_argument('-s', '--sizes', type=int_list, default=default_sizes, help='Comma separated file sizes in bytes')
+    parser.add_argument('-c', '--concurrency', type=int_list, default=default_concurrency, help='Comma separated numbers of requests in flight')
+    parser.add_argument('-w', '--workloads', type=str, default=','.join(default_workloads), help='Comma separated subset of ' + ','.join(default_workloads))
+    parser.add_argument('--ops', type=int, default=32, help='Requests per workload, size and concurrency level')
+    parser.add_argument('--port', type=int, default=base_port, help='First port, 3 per server and 1 for the client are used')
+    parser.add_argument('--root', type=str, default=None, help='Directory for server data and logs, a temporary one by default')
+    parser.add_argument('--keep', action='store_true', help='Keep the root directory (server logs) after the run')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Write the json report here instead of stdout')
+    args = parser.parse_args()
+    if args.nodes < 2:
+        parser.error('the leader election needs at least 2 servers')
+
+    root = args.root or tempfile.mkdtemp(prefix = 'sdfs_bench_')
+    work_dir = os.path.join(root, client_name)
+    os.makedirs(work_dir, exist_ok = True)
+    cluster = Cluster(root, args.nodes, args.port)
+    client = BenchClient(cluster, work_dir)
+    try:
+        client.start()
+        cluster.start()
+        benchmark = Benchmark(client, work_dir, args.ops)
+        client.wait_ready(benchmark.source(1 << 10))
+        started = time.time()
+        results = benchmark.run(args.workloads.split(','), args.sizes, args.concurrency)
+        report = {'config': {'nodes': args.nodes, 'sizes': args.sizes, 'concurrency': args.concurrency, 'ops': args.ops,
+                             'workloads': args.workloads.split(','), 'started': datetime.datetime.fromtimestamp(started).isoformat(),
+                             'host': socket.gethostname()},
+                  'results': results,
+                  'servers': cluster.stats()}
+        if args.output:
+            with open(args.output, 'w') as fd:
+                json.dump(report, fd, indent = 2)
+        else:
+            print(json.dumps(report, indent = 2))
+    finally:
+        cluster.stop()
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors = True)
@@ -0,0 +1,136 @@
+import socket
+import select
+import threading
+from framing import send_message
+
+#########hard code area
+connect_timeout = 3
+keepalive_idle = 10                 # seconds idle before the first keepalive probe
+keepalive_interval = 5
+keepalive_count = 3
+max_data_connections = 4            # connections per destination for messages with a payload, next to its control connection
+#########
+
+
+class PooledConnection():
+    def __init__(self):
+        self.sock = None
+        self.lock = threading.Lock()   # one writer at a time keeps frames from interleaving
+        self.dropped = False
+
+
+class ConnectionPool():
+    """
+        Persistent TCP connections to other fileservers, keyed by (host, port).
+        Any number of threads share one connection per destination, every message is one
+        frame (see framing.py) so they are multiplexed on the stream and demultiplexed by task_id on the
+        other side. Messages with a payload (file transfers) go on separate data connections, up
+        to max_data_connections per destination, so leases, acks and metadata pulls never wait
+        behind a bulk transfer on the control connection.
+        Broken or dropped connections are re-established on the next send.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = {}           # (host, port): control connection
+        self.data_connections = {}      # (host, port): [data connection, ...]
+        self.next_data = 0
+
+    def _connect(self, host, port):
+        sock = socket.create_connection((host, port), timeout = connect_timeout)
+        sock.settimeout(None)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, keepalive_idle)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, keepalive_interval)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, keepalive_count)
+        return sock
+
+    def _is_closed(self, sock):
+        # peers never write on pooled connections, so readable means EOF or reset
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            return len(readable) > 0 and sock.recv(1, socket.MSG_PEEK) == b''
+        except OSError:
+            return True
+
+    def _acquire(self, host, port, bulk):
+        """
+            The connection a message goes on, locked for the caller: the control connection, or
+            for bulk data an idle data connection, a new one while there are fewer than
+            max_data_connections, else the next one in turn
+        """
+        with self.lock:
+            if not bulk:
+                conn = self.connections.get((host, port))
+                if conn is None:
+                    conn = PooledConnection()
+                    self.connections[(host, port)] = conn
+            else:
+                data = self.data_connections.setdefault((host, port), [])
+                for conn in data:
+                    if conn.lock.acquire(blocking = False):
+                        return conn
+                if len(data) < max_data_connections:
+                    conn = PooledConnection()
+                    conn.lock.acquire()
+                    data.append(conn)
+                    return conn
+                conn = data[self.next_data % len(data)]
+                self.next_data += 1
+        conn.lock.acquire()
+        return conn
+
+    def send(self, host, port, http_packet, payload = None):
+        """
+            Send one framed message, reconnecting once if the pooled connection is broken
+        """
+        conn = self._acquire(host, port, payload is not None)
+        try:
+            for attempt in range(2):
+                if conn.sock is not None and self._is_closed(conn.sock):
+                    self._close(conn)
+                try:
+                    if conn.sock is None:
+                        conn.sock = self._connect(host, port)
+                    send_message(conn.sock, http_packet, payload)
+                    if conn.dropped:
+                        self._close(conn)
+                    return
+                except OSError:
+                    self._close(conn)
+                    if attempt == 1:
+                        raise
+        finally:
+            conn.lock.release()
+
+    def drop(self, host):
+        """
+            Forget every connection to host, e.g. when the failure detector reports it
+            failed or back after a failure. The next send opens a fresh connection.
+        """
+        with self.lock:
+            dropped = [conn for (dest, port), conn in self.connections.items() if dest == host]
+            dropped += [conn for (dest, port), data in self.data_connections.items() if dest == host for conn in data]
+            self.connections = {key: conn for key, conn in self.connections.items() if key[0] != host}
+            self.data_connections = {key: data for key, data in self.data_connections.items() if key[0] != host}
+        for conn in dropped:
+            conn.dropped = True
+            if conn.lock.acquire(blocking = False):
+                self._close(conn)
+                conn.lock.release()
+            elif conn.sock is not None:
+                # shutdown wakes up a sender blocked on the dead connection, it closes the socket itself
+                try:
+                    conn.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def _close(self, conn):
+        if conn.sock is not None:
+            try:
+                conn.sock.close()
+            except OSError:
+                pass
+        conn.sock = None
@@ -0,0 +1,192 @@
+import time
+import queue
+import threading
+import datetime
+
+#########hard code area
+lease_duration = 3          # seconds a lease granted by a member lasts
+renew_interval = 1          # seconds between two lease renewals of the leader, or two tries of a candidate
+grant_timeout = 0.5         # seconds a candidate waits for the grants of one round
+clock_margin = 0.2          # seconds the leader gives its lease up early, covers message delay and clock drift
+#########
+
+
+class LeaderElection():
+    """
+        Lease based leader election. The candidate is the smallest member id, as before, but it
+        only acts as leader while a majority of the voters, the fixed set of configured servers,
+        granted it a lease. A member grants one lease at a time and grants a new candidate only
+        after the previous lease ran out, so leases never overlap, and two majorities of the same
+        voters always share a member, so at most one node acts as leader, even while members
+        disagree about the membership. The leader renews every renew_interval and steps down when
+        a renewal fails or a smaller member joins.
+        The holder of the lease a member granted last is its cached leader. The election thread
+        wakes up on membership events and lease timers only; a follower sleeps until membership changes.
+        Lease messages are handled by handle() without blocking, on the receiving event loop:
+        grants are answered by a sender thread of their own, so a busy server still renews leases.
+        Without configured voters (voters None) the voters are the members seen since startup:
+        they grow as servers join and do not shrink when one fails, so a failure does not lower
+        the majority, but members that never saw each other's joins can disagree about them.
+    """
+
+    def __init__(self, host, members, send, voters):
+        self.host = host
+        self.members = members              # callable, current member ids
+        self.send = send                    # send(dest, http_packet), returns False on failure
+        self.learn_voters = voters is None
+        self.voters = set(voters or [])     # configured servers, a lease needs a majority of them
+        self.replies = queue.Queue()        # (dest, http_packet) lease grants to send
+        self.cond = threading.Condition()
+        self.granted_to = None              # lease this member granted
+        self.granted_until = 0
+        self.lease_until = 0                # end of our own lease while we are leader
+        self.acting = False
+        self.round = 0
+        self.grants = set()                 # members that granted the current round
+        self.changed = False
+
+    def notify(self, *args):
+        """
+            Membership callback, must not block
+        """
+        with self.cond:
+            self.changed = True
+            self.cond.notify_all()
+
+    def is_leader(self):
+        return time.monotonic() < self.lease_until
+
+    def leader(self):
+        """
+            Cached leader: us while we hold the lease, else the lease holder we granted, else the smallest member
+        """
+        now = time.monotonic()
+        with self.cond:
+            if now < self.lease_until:
+                return self.host
+            if self.granted_to is not None and now < self.granted_until:
+                return self.granted_to
+        members = self.members()
+        return min(members) if len(members) > 0 else None
+
+    def wait_role(self, leader):
+        """
+            Block until we become leader (leader = True) or step down (leader = False)
+        """
+        with self.cond:
+            while self.acting != leader:
+                self.cond.wait()
+
+    def grant(self, candidate):
+        """
+            Grant candidate the lease unless another node holds one that is still valid.
+            Returns (granted, current holder).
+        """
+        with self.cond:
+            now = time.monotonic()
+            if self.granted_to in [None, candidate] or now >= self.granted_until:
+                self.granted_to = candidate
+                self.granted_until = now + lease_duration
+                return True, candidate
+            return False, self.granted_to
+
+    def quorum(self):
+        return len(self.voters) // 2 + 1
+
+    def observe(self, members):
+        # without configured voters every member seen so far votes
+        if self.learn_voters:
+            with self.cond:
+                self.voters |= set(members)
+
+    def handle(self, http_packet):
+        """
+            lease_request from a candidate and lease_grant answers to our own requests, must not block
+        """
+        if http_packet['request_type'] == 'lease_request':
+            granted, holder = self.grant(http_packet['request_source'])
+            reply_packet = {}
+            reply_packet['task_id'] = http_packet['task_id']
+            reply_packet['request_type'] = 'lease_grant'
+            reply_packet['request_source'] = self.host
+            reply_packet['round'] = http_packet['round']
+            reply_packet['granted'] = granted
+            reply_packet['holder'] = holder
+            self.replies.put((http_packet['request_source'], reply_packet))
+        elif http_packet['request_type'] == 'lease_grant':
+            with self.cond:
+                if http_packet['granted'] and http_packet['round'] == self.round and http_packet['request_source'] in self.voters:
+                    self.grants.add(http_packet['request_source'])
+                    self.cond.notify_all()
+
+    def send_replies(self):
+        while True:
+            dest, reply_packet = self.replies.get()
+            self.send(dest, reply_packet)
+
+    def campaign(self, members):
+        """
+            One round of lease requests to the voters among members, we lead while a majority of
+            all voters granted
+        """
+        self.observe(members)
+        with self.cond:
+            self.round += 1
+            self.grants = set()
+            current_round = self.round
+        start = time.monotonic()
+        if self.host in self.voters and self.grant(self.host)[0]:
+            with self.cond:
+                self.grants.add(self.host)
+
+        http_packet = {}
+        http_packet['task_id'] = self.host + '_lease_' + str(datetime.datetime.now())
+        http_packet['request_type'] = 'lease_request'
+        http_packet['request_source'] = self.host
+        http_packet['round'] = current_round
+        for member in members:
+            if member != self.host and member in self.voters:
+                self.send(member, http_packet)
+
+        with self.cond:
+            deadline = start + grant_timeout
+            while len(self.grants) < self.quorum() and time.monotonic() < deadline:
+                self.cond.wait(deadline - time.monotonic())
+            if len(self.grants) >= self.quorum():
+                # members start their lease when the request arrives, so ours ends first
+                self.lease_until = start + lease_duration - clock_margin
+                self._set_acting(True)
+
+    def step_down(self):
+        with self.cond:
+            self.lease_until = 0
+            self._set_acting(False)
+
+    def _set_acting(self, acting):
+        # caller holds self.cond
+        if self.acting != acting:
+            self.acting = acting
+            print(f"{self.host} {'is now' if acting else 'is no longer'} the leader")
+            self.cond.notify_all()
+
+    def run(self):
+        threading.Thread(target = self.send_replies, daemon = True).start()
+        while True:
+            members = self.members()
+            self.observe(members)
+            if len(members) > 1 and min(members) == self.host:
+                self.campaign(members)
+                timeout = renew_interval
+            else:
+                if self.acting:
+                    self.step_down()
+                timeout = None
+            with self.cond:
+                if self.acting and not self.is_leader():
+                    # the renewal did not reach a majority in time
+                    self._set_acting(False)
+                # grants also notify the condition, only membership changes cut the wait short
+                deadline = None if timeout is None else time.monotonic() + timeout
+                while not self.changed and (deadline is None or time.monotonic() < deadline):
+                    self.cond.wait(None if deadline is None else deadline - time.monotonic())
+                self.changed = False
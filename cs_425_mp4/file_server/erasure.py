@@ -0,0 +1,183 @@
+import os
+import numpy as np
+
+#########hard code area
+default_k = 6               # data fragments
+default_m = 3               # parity fragments, any default_k of the k+m fragments rebuild the file
+stripe_size = 1 << 20       # bytes of every fragment that are coded at a time
+gf_poly = 0x11d             # x^8 + x^4 + x^3 + x^2 + 1
+#########
+
+
+def build_tables():
+    """
+        exp/log tables of GF(256) and the full 256x256 multiplication table,
+        so multiplying a whole block by a constant is one numpy lookup
+    """
+    exp = np.zeros(512, dtype = np.uint8)
+    log = np.zeros(256, dtype = np.int32)
+    x = 1
+    for i in range(255):
+        exp[i] = x
+        log[x] = i
+        x <<= 1
+        if x & 0x100:
+            x ^= gf_poly
+    exp[255:510] = exp[0:255]
+
+    mul = np.zeros((256, 256), dtype = np.uint8)
+    nonzero = np.arange(1, 256)
+    mul[1:, 1:] = exp[log[nonzero][:, None] + log[nonzero][None, :]]
+    return exp, log, mul
+
+gf_exp, gf_log, gf_mul = build_tables()
+
+
+def gf_inv(a):
+    return int(gf_exp[255 - gf_log[a]])
+
+
+def gf_matmul(matrix, blocks):
+    """
+        matrix (r x k) times blocks (k x length) over GF(256)
+    """
+    out = np.zeros((matrix.shape[0], blocks.shape[1]), dtype = np.uint8)
+    for i in range(matrix.shape[0]):
+        for j in range(matrix.shape[1]):
+            c = int(matrix[i, j])
+            if c == 1:
+                out[i] ^= blocks[j]
+            elif c != 0:
+                out[i] ^= gf_mul[c][blocks[j]]
+    return out
+
+
+def gf_invert(matrix):
+    """
+        Gauss-Jordan inverse of a square matrix over GF(256)
+    """
+    n = len(matrix)
+    work = np.concatenate([matrix.astype(np.uint8), np.eye(n, dtype = np.uint8)], axis = 1)
+    for col in range(n):
+        pivot = next((row for row in range(col, n) if work[row, col] != 0), None)
+        if pivot is None:
+            raise ValueError("singular coding matrix")
+        work[[col, pivot]] = work[[pivot, col]]
+        work[col] = gf_mul[gf_inv(int(work[col, col]))][work[col]]
+        for row in range(n):
+            if row != col and work[row, col] != 0:
+                work[row] ^= gf_mul[int(work[row, col])][work[col]]
+    return work[:, n:]
+
+
+def coding_matrix(k, m):
+    """
+        (k+m) x k systematic Reed-Solomon matrix: identity on top of a Cauchy matrix.
+        Every k rows of it are invertible, so any k fragments rebuild the data, and
+        the first k fragments are the data itself.
+    """
+    if k < 1 or m < 0 or k + m > 256:
+        raise ValueError(f"invalid erasure code {k}+{m}")
+    matrix = np.zeros((k + m, k), dtype = np.uint8)
+    matrix[:k] = np.eye(k, dtype = np.uint8)
+    for i in range(m):
+        for j in range(k):
+            matrix[k + i, j] = gf_inv((k + i) ^ j)
+    return matrix
+
+
+def fragment_path(prefix, index):
+    return f'{prefix}.{index}'
+
+
+def stripe_lengths(size, k):
+    """
+        Bytes of every fragment in each stripe of a file of size bytes
+    """
+    while size > 0:
+        length = min(stripe_size, -(-size // k))
+        yield length
+        size -= min(size, k * length)
+
+
+def read_blocks(fds, length):
+    blocks = np.empty((len(fds), length), dtype = np.uint8)
+    for i, fd in enumerate(fds):
+        data = fd.read(length)
+        if len(data) != length:
+            raise ValueError("fragment is shorter than expected")
+        blocks[i] = np.frombuffer(data, dtype = np.uint8)
+    return blocks
+
+
+def encode_file(path, prefix, k = default_k, m = default_m):
+    """
+        Split the file at path into k data and m parity fragments written to
+        fragment_path(prefix, 0..k+m-1). Returns the file size, needed to decode.
+    """
+    size = os.path.getsize(path)
+    parity_matrix = coding_matrix(k, m)[k:]
+    outs = [open(fragment_path(prefix, i), 'wb') for i in range(k + m)]
+    try:
+        with open(path, 'rb') as fd:
+            for length in stripe_lengths(size, k):
+                data = fd.read(k * length)
+                blocks = np.zeros(k * length, dtype = np.uint8)
+                blocks[:len(data)] = np.frombuffer(data, dtype = np.uint8)
+                blocks = blocks.reshape(k, length)
+                parity = gf_matmul(parity_matrix, blocks)
+                for i in range(k):
+                    outs[i].write(blocks[i].tobytes())
+                for i in range(m):
+                    outs[k + i].write(parity[i].tobytes())
+    finally:
+        for out in outs:
+            out.close()
+    return size
+
+
+def decoding_rows(fragments, k, m, rows):
+    """
+        Pick k of the available fragments ({index: path}) and return (indexes, matrix) where
+        matrix turns the stripes of those fragments into the given rows of the coding matrix
+    """
+    indexes = sorted(fragments)[:k]
+    if len(indexes) < k:
+        raise ValueError(f"only {len(indexes)} of the {k} fragments needed are available")
+    matrix = coding_matrix(k, m)
+    return indexes, gf_matmul(matrix[rows], gf_invert(matrix[indexes]))
+
+
+def decode_file(fragments, size, out_path, k = default_k, m = default_m):
+    """
+        Rebuild the original file from any k fragments, fragments = {index: path}
+    """
+    indexes, matrix = decoding_rows(fragments, k, m, list(range(k)))
+    systematic = indexes == list(range(k))
+    ins = [open(fragments[i], 'rb') for i in indexes]
+    try:
+        with open(out_path, 'wb') as out:
+            remaining = size
+            for length in stripe_lengths(size, k):
+                blocks = read_blocks(ins, length)
+                data = blocks if systematic else gf_matmul(matrix, blocks)
+                out.write(data.reshape(-1)[:min(remaining, k * length)].tobytes())
+                remaining -= min(remaining, k * length)
+    finally:
+        for fd in ins:
+            fd.close()
+
+
+def rebuild_fragment(fragments, size, index, out_path, k = default_k, m = default_m):
+    """
+        Regenerate only fragment index from any k other fragments, fragments = {index: path}
+    """
+    indexes, matrix = decoding_rows(fragments, k, m, [index])
+    ins = [open(fragments[i], 'rb') for i in indexes]
+    try:
+        with open(out_path, 'wb') as out:
+            for length in stripe_lengths(size, k):
+                out.write(gf_matmul(matrix, read_blocks(ins, length))[0].tobytes())
+    finally:
+        for fd in ins:
+            fd.close()
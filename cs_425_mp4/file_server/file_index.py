@@ -0,0 +1,114 @@
+import bisect
+import threading
+from collections import defaultdict
+
+
+class FileTable(dict):
+    """
+        File location table {sdfs_filename: [replica hosts]} that also keeps the file names in a
+        sorted list and a reverse index {host: {sdfs_filename}}. Prefix and range listings are a
+        bisect plus the k names returned, a host's files are found without scanning the table.
+        Replica lists are replaced, never changed in place, so the indexes stay in sync.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.lock = threading.RLock()
+        self.sorted_names = []
+        self.host_files = defaultdict(set)
+        self.update(*args, **kwargs)
+
+    def __setitem__(self, sdfs_filename, ips):
+        with self.lock:
+            if sdfs_filename in self:
+                self._unlink(sdfs_filename)
+            else:
+                bisect.insort(self.sorted_names, sdfs_filename)
+            self._link(sdfs_filename, ips)
+
+    def __delitem__(self, sdfs_filename):
+        with self.lock:
+            self._unlink(sdfs_filename)
+            super().__delitem__(sdfs_filename)
+            del self.sorted_names[bisect.bisect_left(self.sorted_names, sdfs_filename)]
+
+    def pop(self, sdfs_filename, *default):
+        with self.lock:
+            if sdfs_filename not in self:
+                if default:
+                    return default[0]
+                raise KeyError(sdfs_filename)
+            ips = self[sdfs_filename]
+            del self[sdfs_filename]
+            return ips
+
+    def popitem(self):
+        with self.lock:
+            sdfs_filename = next(iter(self))
+            return sdfs_filename, self.pop(sdfs_filename)
+
+    def setdefault(self, sdfs_filename, ips = None):
+        with self.lock:
+            if sdfs_filename not in self:
+                self[sdfs_filename] = ips
+            return self[sdfs_filename]
+
+    def clear(self):
+        with self.lock:
+            super().clear()
+            self.sorted_names = []
+            self.host_files.clear()
+
+    def update(self, *args, **kwargs):
+        """
+            Bulk load (e.g. a metadata snapshot): new names are sorted once instead of inserted one by one
+        """
+        with self.lock:
+            new_names = []
+            for sdfs_filename, ips in dict(*args, **kwargs).items():
+                if sdfs_filename in self:
+                    self._unlink(sdfs_filename)
+                else:
+                    new_names.append(sdfs_filename)
+                self._link(sdfs_filename, ips)
+            if len(new_names) > 0:
+                self.sorted_names.extend(new_names)
+                self.sorted_names.sort()
+
+    def _link(self, sdfs_filename, ips):
+        super().__setitem__(sdfs_filename, ips)
+        for ip in ips or []:
+            self.host_files[ip].add(sdfs_filename)
+
+    def _unlink(self, sdfs_filename):
+        for ip in dict.__getitem__(self, sdfs_filename) or []:
+            files = self.host_files.get(ip)
+            if files is not None:
+                files.discard(sdfs_filename)
+                if len(files) == 0:
+                    del self.host_files[ip]
+
+    def prefix(self, prefix):
+        """
+            Sorted names that start with prefix
+        """
+        with self.lock:
+            names = self.sorted_names
+            start = end = bisect.bisect_left(names, prefix)
+            while end < len(names) and names[end].startswith(prefix):
+                end += 1
+            return names[start:end]
+
+    def range(self, start, end):
+        """
+            Sorted names in [start, end)
+        """
+        with self.lock:
+            return self.sorted_names[bisect.bisect_left(self.sorted_names, start):bisect.bisect_left(self.sorted_names, end)]
+
+    def files_on(self, host):
+        """
+            Sorted names of the files host holds a replica or fragment of
+        """
+        with self.lock:
+            return sorted(self.host_files.get(host, ()))
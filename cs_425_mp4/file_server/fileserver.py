@@ -5,12 +5,32 @@ import socket
 import sys
 import random
 import json
-from collections import Counter, deque, defaultdict
+import copy
+from collections import Counter, deque, defaultdict, OrderedDict
 import os
 import subprocess
+import time
+import shutil
+import tempfile
 import numpy as np
 sys.path.insert(0, './server')
 from server import FailDetector
+from metadata_log import MetadataLog, apply_entry, decode_snapshot
+from scheduler import RequestScheduler, request_files
+from relay import receive_relayed
+from framing import store_payload
+from connection_pool import ConnectionPool
+from rereplication import RereplicationPlanner
+from file_index import FileTable
+from placement import NodeLoad
+from peer_stats import PeerStats, probe_interval
+from erasure import encode_file, decode_file, rebuild_fragment, fragment_path, default_k, default_m
+from async_server import AsyncServer
+from metrics import Metrics
+from election import LeaderElection, renew_interval
+from pack_store import PackStore, compact_interval
+from admission import AdmissionControl, default_class
+from prefetch import Prefetcher
 
 #########hard code area
 server_nums = [i for i in range(1, 11)]
@@ -18,23 +38,101 @@ host_name = 'fa23-cs425-56{}.cs.illinois.edu'
 machine_2_ip = {i: 'fa23-cs425-56{}.cs.illinois.edu'.format('0'+str(i)) for i in range(1, 10)}  #host domain names of machnine 1~9
 machine_2_ip[10] = 'fa23-cs425-5610.cs.illinois.edu'                                            #host domain name of machine 10
 msg_format = 'utf-8'                #data encoding format of socket programming
-filelocation_list = {} # sdfs_filename: [ips which have this file]
+filelocation_list = FileTable() # sdfs_filename: [ips which have this file], sorted by name and indexed by host
+file_attrs = {}        # sdfs_filename: {'version', 'size', 'erasure': {'k', 'm', 'size'} for erasure coded files}, fragment i lives on filelocation_list[sdfs_filename][i]
 maple_queue = {}
 juice_queue = {}
-host_domain_name = socket.gethostname() 
-machine_id = int(host_domain_name[13:15])
+# every setting below can be overridden from the environment, e.g. to run several servers on one machine (see benchmark.py)
+host_domain_name = os.environ.get('SDFS_NODE', socket.gethostname())
+machine_id = int(host_domain_name[13:15]) if host_domain_name.startswith('fa23-cs425-56') else host_domain_name
 file_sender_port = 5007
-file_receiver_port = 5008
-file_leader_port = 5009
+file_receiver_port = int(os.environ.get('SDFS_RECEIVER_PORT', 5008))
+file_leader_port = int(os.environ.get('SDFS_LEADER_PORT', 5009))
+metrics_port = int(os.environ.get('SDFS_METRICS_PORT', 5010))
 file_sockets = {}
-leader_queue = list()
-schedule_counter = defaultdict(lambda : [0,0,0,0]) # schedule_counter = {'sdfsfilename':[R_count, W_count, R_pre, W_pre]}
-mp3_log_path = '/home/aaghosh2/MP3_log'
-put_ack = defaultdict(list)
+sdfs_root = os.environ.get('SDFS_ROOT', '/home/aaghosh2')
+mp3_file_path = os.path.join(sdfs_root, 'MP3_FILE')     # sdfs files stored on this server
+mp3_local_path = os.path.join(sdfs_root, 'MP3_LOCAL')   # files fetched from the sdfs
+mp3_log_path = os.path.join(sdfs_root, 'MP3_log')
+mp3_meta_path = os.path.join(sdfs_root, 'MP3_META') # leader metadata wal and snapshots, kept across restarts
+mp3_spool_path = os.path.join(sdfs_root, 'MP3_SPOOL') # message payloads are streamed here instead of into memory
+mp4_path = os.environ.get('SDFS_MP4_PATH', os.path.join(sdfs_root, 'CS_425/cs_425_mp4'))   # maple/juice working files
+scp_user = os.environ.get('SDFS_USER', 'aaghosh2')
+transfer_mode = os.environ.get('SDFS_TRANSFER', 'scp')  # 'local': all servers share one filesystem and copy with cp
+# SDFS_NODES="name=host:receiver_port:leader_port,..." gives the address of servers that do not run on the default ports
+node_addresses = {name: address.split(':') for name, address in (node.split('=') for node in os.environ.get('SDFS_NODES', '').split(',') if node)}
+# SDFS_MEMBERS="name,..." fixes the membership instead of running the gossip failure detector
+static_members = [name for name in os.environ.get('SDFS_MEMBERS', '').split(',') if name]
+# SDFS_VOTERS="name,..." the fixed set of servers a leader needs a lease majority of, by default the configured servers,
+# or without SDFS_MEMBERS/SDFS_NODES the members seen since startup (not all VMs, a cluster of a few VMs still elects a leader)
+voters = [name for name in os.environ.get('SDFS_VOTERS', '').split(',') if name] or static_members or list(node_addresses) or None
+write_acks = {}                  # task_id: state of a running put, see start_write
+read_state = {}                  # task_id: state of a running get, see send_get
+fresh_replicas = {}              # sdfs_filename: replicas known to hold the latest version
+write_quorum = 3                 # replica acks a put waits for before the user is acked
+read_quorum = 1                  # replicas whose version stamps a get compares before reading
+replica_versions = {}            # sdfs_filename: version stamp of the copy stored on this server
+replica_lock = threading.Lock()
+stored_sizes = {}                # sdfs_filename: bytes of the copy stored here as a file of its own, see track_stored
+stored_bytes = 0                 # sum of stored_sizes
+stored_lock = threading.Lock()
+append_ack = defaultdict(list)   # sdfs_filename: [(replica_ip, ok, size), ...] of the running append
 delete_ack = defaultdict(list)
+ack_lock = threading.Lock()
+mapreduce_lock = threading.Lock()
+metadata_version = 0          # last metadata version applied on this member
+metadata_leader = None        # leader which metadata_version belongs to
+metadata_lock = threading.Lock()
+metadata_pull_interval = 0.5  # seconds between two metadata pulls from the leader
+metadata_pull_limit = 5000    # max entries the leader sends back for one pull
+# ssh connections are kept open and shared by every scp to the same host, so the files of a batch
+# do not pay one ssh handshake each
+scp_options = '-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o ControlMaster=auto -o ControlPath=/tmp/sdfs_ssh_%r@%h:%p -o ControlPersist=60'
+batch_requests = ['batch_put', 'batch_get', 'batch_delete']
+replication_factor = 4        # full copies of a replicated file
+rereplicate_bandwidth = 400000  # Kbit/s cap of one re-replication transfer (scp -l), 0 = no cap
+rereplicate_timeout = 300     # seconds to wait for a re-replication transfer to be acked
+rereplicate_attempts = 3      # destinations tried for one lost copy
+local_cleanup = {}            # task_id: local erasure fragments to remove once the put finished
+lost_fragment = '(lost)'      # holder of an erasure fragment whose write failed, until it is rebuilt on a member
+batch_acks = {}               # task_id: {'http_packet': batch request, 'pending': replicas that have not acked, 'failed': [...]}
+transfer_requests = ['put', 'get', 'fetch', 'append', 'batch_put', 'batch_get', 'ec_get', 'ec_rebuild']
+active_transfers = 0          # transfer requests this member is running, reported to the leader
+transfer_lock = threading.Lock()
+balance_interval = 10         # seconds between two rounds of the replica balancer
+balance_moves = 2             # replicas the balancer moves off overfull members per round
+standby_interval = 0.1        # seconds between two syncs of the leader to its standby
+standby_stale = 10            # seconds after which a standby's copy of the open requests is not resumed
+open_requests = OrderedDict() # task_id: copy of a request the leader accepted and has not acked yet
+open_changes = {'opened': [], 'closed': []}   # open_requests changes the standby has not been sent
+open_lock = threading.Lock()
+member_versions = {}          # member: metadata version of its last pull
+standby_state = {'leader': None, 'time': 0, 'requests': OrderedDict()}    # standby: the leader's open requests
+standby_lock = threading.Lock()
+leader_ready = threading.Event()  # set once this leader recovered its state and accepts requests
+max_redirects = 5             # times a client follows 'not_leader' answers before the request fails
+max_retries = 8               # times a client retries a request the leader answered with 'retry_later'
+max_retry_wait = 30           # seconds, cap of the client's backoff between two retries
+fetch_waiters = {}            # task_id: {'done': Event, 'packet'} of a fetch waiting for its file_data, see fetch_file
+fetch_timeout = 60            # seconds a fetch waits for the replica to send the file
+download_lock = threading.Lock()
+downloads = {}                # (sdfs_filename, version): Event set when the download in progress finishes, see downloadFile
+input_users = {}              # sdfs_filename: juice tasks on this server that still need its download, see use_inputs
+pack_store = PackStore(os.path.join(mp3_file_path, '.segments'))   # small sdfs files stored here, packed into segments
 #########
 
 fail_detector = FailDetector()
+metadata_log = MetadataLog(mp3_meta_path, file_attrs)
+connection_pool = ConnectionPool()
+node_load = NodeLoad()
+peer_stats = PeerStats()
+metrics = Metrics()
+timed_requests = ['put', 'get', 'delete', 'append', 'batch_put', 'batch_get', 'batch_delete']
+# a failed or returning member gets fresh connections instead of stale pooled ones
+fail_detector.membership_callbacks.append(lambda event, domain_name: connection_pool.drop(domain_name))
+election = LeaderElection(host_domain_name, lambda : list(fail_detector.membership_list.keys()),
+                          lambda dest, http_packet: send_packet(dest, http_packet, file_receiver_port, http_packet['request_type']), voters)
+fail_detector.membership_callbacks.append(election.notify)
 
 class logging():
     def __init__(self):
@@ -59,15 +157,13 @@ logger = logging()
 SUCCESS = True
 FAILURE = False
 
-def send_packet(dest, http_packet, port, request_type = None):
+def send_packet(dest, http_packet, port, request_type = None, payload = None):
     """
-        This function sends the http_packet to the destinations
+        This function sends the http_packet to the destinations over a pooled connection,
+        payload is optional raw data (bytes or a file path) streamed after the packet
     """
     try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)         
-        sock.connect((dest, port))
-        sock.send(http_packet)
-        sock.close()
+        connection_pool.send(*node_address(dest, port), http_packet, payload)
         print(f"Send_Packet success from {str(host_domain_name)} to {str(dest)}")
         return True
    
@@ -81,35 +177,32 @@ def send(http_packet, request_type, to_leader, replica_ips=None):
     """
         This function handles sends based on different request types/number of destinations
     """
-    http_packet_bytes = json.dumps(http_packet)
-    http_packet_bytes = http_packet_bytes.encode(msg_format)
-
     if not to_leader:
 
-        if request_type in ['put', 'delete']:
+        if request_type in ['put', 'append', 'delete']:
             for dest in replica_ips:
-                send_packet(dest, http_packet_bytes, file_receiver_port, request_type)
+                send_packet(dest, http_packet, file_receiver_port, request_type)
 
         elif request_type == 'rereplicate':
             for dest in replica_ips:
-                return send_packet(dest, http_packet_bytes, file_receiver_port, request_type)
+                return send_packet(dest, http_packet, file_receiver_port, request_type)
         
-        elif request_type in ['get', 'finish_ack']:
+        elif request_type in ['get', 'finish_ack', 'metadata']:
             # only need to fetch first one
-            send_packet(replica_ips[0], http_packet_bytes, file_receiver_port, request_type)
+            if request_type == 'finish_ack':
+                close_request(http_packet['task_id'])
+                metrics.stop(('leader', http_packet['task_id']))
+                if http_packet.get('failed'):
+                    metrics.count('leader.failed')
+            send_packet(replica_ips[0], http_packet, file_receiver_port, request_type)
         
-        # request_type == 'update'
-        elif request_type == 'update':
-            for dest in dict(fail_detector.membership_list).keys():
-                if dest != host_domain_name:
-                    send_packet(dest, http_packet_bytes, file_receiver_port, request_type)
         else:
             print(f"REQUEST TYPE WRONG IN SEND ERROR!! {str(request_type)}")
     
     # send from user to leader
     else:
-        leader_id = min(fail_detector.membership_list.keys())
-        send_packet(leader_id, http_packet_bytes, file_leader_port, request_type)
+        leader_id = election.leader()
+        send_packet(leader_id, http_packet, file_leader_port, request_type)
     
 
 def put_file(http_packet):
@@ -119,55 +212,402 @@ def put_file(http_packet):
     local = http_packet['local_filename']
     sdfs = http_packet['sdfs_filename']
     source = http_packet['request_source']
+    if 'fragment' in http_packet:
+        # erasure coded put, this server stores one fragment of the file
+        local = fragment_path(http_packet['fragment_prefix'], http_packet['fragment'])
     print(f"From {str(source)} to {str(host_domain_name)} for {str(sdfs)}")
+    # re-replication transfers are capped so they do not starve user requests
     
+    incoming = incoming_path()
+    ok = False
     try:
-        cmd = f'scp -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null aaghosh2@{source}:{local} /home/aaghosh2/MP3_FILE/{sdfs}'
-        result = subprocess.check_output(cmd, shell=True)
+        if http_packet.get('rereplicate') and pack_store.fits(http_packet.get('size')):
+            # the source may have the file packed in a segment, which scp cannot read
+            fetch_file(source, sdfs, incoming)
+        else:
+            timed_copy(source, local, incoming, http_packet.get('bandwidth', 0))
         # logger.info(f"Complete {str(http_packet)} ")
-        return_packet = {}
-        return_packet['task_id'] = http_packet['task_id']
-        return_packet['request_type'] = 'put_ack'
-        return_packet['request_source'] = http_packet['request_source']
-        return_packet['sdfs_filename'] = http_packet['sdfs_filename']
-        return_packet['replica_ip'] = host_domain_name
-        send(return_packet, 'put_ack', True)
+        # a copy older than the one stored here is dropped, which fails the ack
+        ok = install_copy(incoming, sdfs, http_packet.get('version'), pack = 'fragment' not in http_packet)
+    except Exception as e:
+        logger.error(f"Copy of {local} from {source}, Error: {str(e)}")
+    finally:
+        remove_spool_file(incoming)
+
+    if http_packet.get('rereplicate'):
+        send_rereplicate_ack(http_packet, ok)
+        return
+    return_packet = {}
+    return_packet['task_id'] = http_packet['task_id']
+    return_packet['request_type'] = 'put_ack'
+    return_packet['request_source'] = http_packet['request_source']
+    return_packet['sdfs_filename'] = http_packet['sdfs_filename']
+    return_packet['replica_ip'] = host_domain_name
+    return_packet['ok'] = ok
+    send(return_packet, 'put_ack', True)
+
+def copy_cmd(source_host, source_path, dest_host, dest_path, bandwidth = 0):
+    """
+        scp command that copies source_path on source_host to dest_path on dest_host, one of
+        them is this server. bandwidth caps scp in Kbit/s, 0 = no cap.
+    """
+    limit = f'-l {bandwidth} ' if bandwidth else ''
+    source = source_path if source_host == host_domain_name else f'{scp_user}@{node_host(source_host)}:{source_path}'
+    dest = dest_path if dest_host == host_domain_name else f'{scp_user}@{node_host(dest_host)}:{dest_path}'
+    return f'scp {scp_options} {limit}{source} {dest}'
+
+def copy_file(source_host, source_path, dest_host, dest_path, bandwidth = 0):
+    """
+        Copy source_path on source_host to dest_path on dest_host, one of them is this server.
+        Servers that share one filesystem copy in process: forking a shell and cp for every
+        transfer costs more cpu than copying a small file.
+    """
+    if transfer_mode == 'local' or source_host == dest_host:
+        shutil.copyfile(source_path, dest_path)
+    else:
+        subprocess.check_output(copy_cmd(source_host, source_path, dest_host, dest_path, bandwidth), shell=True)
+
+def node_host(name):
+    return node_addresses[name][0] if name in node_addresses else name
+
+def node_address(name, port):
+    """
+        (host, port) of the receiver (port = file_receiver_port) or leader (file_leader_port) of a server
+    """
+    if name not in node_addresses:
+        return name, port
+    host, receiver_port, leader_port = node_addresses[name]
+    return host, int(leader_port if port == file_leader_port else receiver_port)
+
+def timed_copy(peer, source_path, path, bandwidth = 0):
+    """
+        Copy source_path on peer to path on this server and feed the throughput to peer_stats.
+        Returns the seconds the copy took.
+    """
+    start = time.time()
+    copy_file(peer, source_path, host_domain_name, path, bandwidth)
+    seconds = time.time() - start
+    size = os.path.getsize(path)
+    peer_stats.record_transfer(peer, size, seconds)
+    metrics.observe('transfer.seconds', seconds)
+    metrics.count('transfer.bytes', size)
+    metrics.count('transfer.count')
+    return seconds
+
+def probe_peers():
+    """
+        Keep the rtt estimates current with a timed connect to one random member every probe_interval
+    """
+    while True:
+        time.sleep(probe_interval)
+        peers = [ip for ip in fail_detector.membership_list.keys() if ip != host_domain_name]
+        if len(peers) > 0:
+            peer = random.choice(peers)
+            peer_stats.probe(peer, node_address(peer, file_receiver_port))
+
+def incoming_path():
+    """
+        Temporary file next to the sdfs files, a copy is received here and renamed in place when complete
+    """
+    fd, path = tempfile.mkstemp(dir = mp3_file_path, prefix = '.incoming_')
+    os.close(fd)
+    return path
+
+def install_copy(incoming, sdfs, version, pack = True):
+    """
+        Move a completely received copy in place and stamp it with its version. A slow transfer of
+        an older version is dropped instead, so a lagging write never overwrites a later one.
+        Small files are packed into a segment of pack_store unless pack is False (erasure fragments).
+    """
+    with replica_lock:
+        if version is not None and version < replica_versions.get(sdfs, 0):
+            logger.info(f"Dropped version {version} of {sdfs}, version {replica_versions[sdfs]} is stored")
+            return False
+        if pack and pack_store.fits(os.path.getsize(incoming)):
+            pack_store.put(sdfs, incoming)
+            remove_spool_file(f'{mp3_file_path}/{sdfs}')
+        else:
+            os.replace(incoming, f'{mp3_file_path}/{sdfs}')
+            pack_store.delete(sdfs)
+        track_stored(sdfs)
+        if version is not None:
+            replica_versions[sdfs] = version
+        return True
+
+def track_stored(sdfs):
+    """
+        Keep stored_bytes up to date after the file of sdfs was written or removed, so local_load
+        does not have to walk the sdfs directory
+    """
+    global stored_bytes
+    path = f'{mp3_file_path}/{sdfs}'
+    with stored_lock:
+        size = os.path.getsize(path) if os.path.isfile(path) else None
+        stored_bytes -= stored_sizes.pop(sdfs, 0)
+        if size is not None:
+            stored_sizes[sdfs] = size
+            stored_bytes += size
+
+def is_stored(sdfs):
+    return sdfs in pack_store or os.path.exists(f'{mp3_file_path}/{sdfs}')
+
+def remove_stored(sdfs):
+    """
+        Remove the copy of sdfs stored here, packed or not. Raises FileNotFoundError if there is none.
+    """
+    if not pack_store.delete(sdfs):
+        os.remove(f'{mp3_file_path}/{sdfs}')
+        track_stored(sdfs)
+
+def unpack(sdfs):
+    """
+        Turn a packed copy back into a file of its own, before it is changed in place
+    """
+    with replica_lock:
+        if pack_store.extract(sdfs, f'{mp3_file_path}/{sdfs}'):
+            pack_store.delete(sdfs)
+            track_stored(sdfs)
+
+def compact_segments():
+    """
+        Reclaim the space of deleted and overwritten packed files every compact_interval
+    """
+    while True:
+        time.sleep(compact_interval)
+        try:
+            reclaimed = pack_store.compact()
+            if reclaimed > 0:
+                metrics.count('pack.reclaimed_bytes', reclaimed)
+                logger.info(f"Compaction reclaimed {reclaimed} bytes")
+        except Exception as e:
+            logger.error(f"Compaction error: {str(e)}")
+
+def stamp_version(sdfs, version):
+    with replica_lock:
+        if version is not None:
+            replica_versions[sdfs] = max(version, replica_versions.get(sdfs, 0))
 
+def append_file(http_packet):
+    """
+        Append only the new bytes to this replica. The leader tells the offset the append starts at,
+        leftovers of an earlier failed append past it are cut off so retries do not duplicate data.
+    """
+    sdfs = http_packet['sdfs_filename']
+    path = f'{mp3_file_path}/{sdfs}'
+    offset = http_packet['offset']
+    spool_path = new_spool_file()
+    ok = False
+    try:
+        unpack(sdfs)
+        current = os.path.getsize(path) if os.path.exists(path) else 0
+        if offset is not None and current < offset:
+            raise ValueError(f"replica of {sdfs} has {current} bytes, append starts at {offset}")
+        copy_file(http_packet['request_source'], http_packet['local_filename'], host_domain_name, spool_path)
+        with open(path, 'ab') as fd:
+            if offset is not None:
+                fd.truncate(offset)
+            with open(spool_path, 'rb') as new_bytes:
+                shutil.copyfileobj(new_bytes, fd)
+        stamp_version(sdfs, http_packet.get('version'))
+        ok = True
     except Exception as e:
-        logger.error(f"Command: {cmd}, Error: {str(e)}")
+        logger.error(f"Append to {sdfs} error: {str(e)}")
+    finally:
+        remove_spool_file(spool_path)
+        track_stored(sdfs)
+
+    return_packet = {}
+    return_packet['task_id'] = http_packet['task_id']
+    return_packet['request_type'] = 'append_ack'
+    return_packet['request_source'] = http_packet['request_source']
+    return_packet['sdfs_filename'] = sdfs
+    return_packet['replica_ip'] = host_domain_name
+    return_packet['ok'] = ok
+    return_packet['size'] = os.path.getsize(path) if ok else None
+    send(return_packet, 'append_ack', True)
+
+def send_rereplicate_ack(http_packet, ok):
+    """
+        Tell the leader's re-replication planner whether a new copy is in place
+    """
+    return_packet = {}
+    return_packet['task_id'] = http_packet['task_id']
+    return_packet['request_type'] = 'rereplicate_ack'
+    return_packet['request_source'] = host_domain_name
+    return_packet['sdfs_filename'] = http_packet['sdfs_filename']
+    return_packet['ok'] = ok
+    send(return_packet, 'rereplicate_ack', True)
 
 
 def get_file(http_packet):
     """
-    Server receieve get request, need to send file back to local
-    Request need to have local, sdfs_file stored at {sdfs}
+    Server receieve get request (from the leader) or fetch request (from a member), need to send
+    the file, or the byte range offset/length of it, back to the requester. It goes out as the
+    payload of a file_data frame with sendfile, from the page cache to the socket without a copy
+    through python, and the requester stores it at local_filename.
     """
-    local = http_packet['local_filename']
     sdfs = http_packet['sdfs_filename']
     source = http_packet['request_source']
-    cmd = f'scp -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null /home/aaghosh2/MP3_FILE/{sdfs} aaghosh2@{source}:{local}'
-    try:
-        result = subprocess.check_output(cmd, shell=True)
-        # logger.info(f"Complete {str(http_packet)} ")
+    path = f'{mp3_file_path}/{sdfs}'
+    behind = replica_versions.get(sdfs, 0) < (http_packet.get('version') or 0)
+    if http_packet['request_type'] == 'get' and (behind or not is_stored(sdfs)):
+        # this copy is behind the version the leader committed, the leader tries another replica
         return_packet = {}
         return_packet['task_id'] = http_packet['task_id']
-        return_packet['request_type'] = 'get_ack'
+        return_packet['request_type'] = 'get_stale'
         return_packet['request_source'] = http_packet['request_source']
-        return_packet['sdfs_filename'] = http_packet['sdfs_filename']
+        return_packet['sdfs_filename'] = sdfs
         return_packet['replica_ip'] = host_domain_name
+        send(return_packet, 'get_stale', True)
+        return
+
+    data_packet = {}
+    data_packet['task_id'] = http_packet['task_id']
+    data_packet['request_type'] = 'file_data'
+    data_packet['request'] = http_packet['request_type']
+    data_packet['request_source'] = source
+    data_packet['sdfs_filename'] = sdfs
+    data_packet['local_filename'] = http_packet['local_filename']
+    data_packet['replica_ip'] = host_domain_name
+    if 'relay' in http_packet:
+        data_packet['relay'] = http_packet['relay']
+        data_packet['waiters'] = http_packet['waiters']
+        data_packet['relay_index'] = 0
+    with pack_store.reading(sdfs) as packed:
+        # a packed file is a range of its segment
+        path, base, size = packed if packed is not None else (path, 0, None)
+        try:
+            size = os.path.getsize(path) if size is None else size
+            offset = min(http_packet.get('offset') or 0, size)
+            length = size - offset if http_packet.get('length') is None else min(http_packet['length'], size - offset)
+        except OSError as e:
+            data_packet['error'] = str(e)
+            length = None
+        if length is None:
+            sent = send_packet(source, data_packet, file_receiver_port, 'file_data')
+        else:
+            data_packet['offset'] = offset
+            data_packet['version'] = replica_versions.get(sdfs, 0)
+            start = time.time()
+            sent = send_packet(source, data_packet, file_receiver_port, 'file_data', (path, base + offset, length))
+    if not sent and http_packet['request_type'] == 'get':
+        # the requester never got the file, so it can not ack: fail it, the leader schedules the
+        # other destinations of a joined get again
+        relay = http_packet.get('relay', [source])
+        return_packet = {}
+        return_packet['task_id'] = http_packet['task_id']
+        return_packet['request_type'] = 'get_ack'
+        return_packet['request_source'] = source
+        return_packet['dest'] = relay[0]
+        return_packet['sdfs_filename'] = sdfs
+        return_packet['replica_ip'] = host_domain_name
+        return_packet['failed'] = True
+        return_packet['relay_failed'] = relay[1:]
         send(return_packet, 'get_ack', True)
-    except Exception as e:
-        logger.error(f"Command: {cmd}, Error: {str(e)}")
+    elif sent and length is not None:
+        seconds = time.time() - start
+        peer_stats.record_transfer(source, length, seconds)
+        metrics.observe('transfer.seconds', seconds)
+        metrics.count('transfer.bytes', length)
+        metrics.count('transfer.count')
+
+def receive_file(http_packet):
+    """
+    Requester side of get_file: store the file a replica sent at local_filename, relay it on for
+    joined gets (see relay.receive_relayed). The leader is acked from here, once the file is in
+    place, so finish_ack never arrives before the data; it is acked even if storing failed.
+    """
+    if http_packet['request'] != 'get':
+        # a fetch that gave up waiting, see fetch_file
+        return
+    forward = lambda dest, child_packet, path: send_packet(dest, child_packet, file_receiver_port, 'file_data', path)
+    return_packet = receive_relayed(http_packet, host_domain_name, lambda path: store_payload(http_packet, path), forward, peer_stats.record_transfer)
+    if 'error' in return_packet:
+        logger.info(f"Get of {http_packet['sdfs_filename']} failed: {return_packet['error']}")
+    send(return_packet, 'get_ack', True)
+
+def deliver_inline(http_packet):
+    """
+    Requests the receiver handles on its event loop, before the worker pool: lease traffic, so
+    renewals do not queue behind busy workers, and the file_data of fetches
+    """
+    if http_packet['request_type'] in ['lease_request', 'lease_grant']:
+        election.handle(http_packet)
+        return True
+    return deliver_fetch(http_packet)
+
+def deliver_fetch(http_packet):
+    """
+    Runs on the receiver's event loop, must not block: hand the file_data of a fetch to the thread
+    waiting for it. Those threads are receiver workers themselves, so waiting for a worker to
+    deliver it could stall once all of them fetch.
+    """
+    if http_packet['request_type'] != 'file_data':
+        return False
+    waiter = fetch_waiters.get(http_packet['task_id'])
+    if waiter is None:
+        return False
+    waiter['packet'] = http_packet
+    waiter['done'].set()
+    return True
+
+def fetch_file(replica, sdfs_filename, local_filename, offset = 0, length = None, timeout = fetch_timeout):
+    """
+    Read sdfs_filename, or a byte range of it, straight from replica into local_filename, without
+    the leader. Raises if the replica does not have it or does not answer within timeout.
+    """
+    http_packet = {}
+    http_packet['task_id'] = host_domain_name + '_fetch_' + str(datetime.datetime.now())
+    http_packet['request_type'] = 'fetch'
+    http_packet['request_source'] = host_domain_name
+    http_packet['sdfs_filename'] = sdfs_filename
+    http_packet['local_filename'] = local_filename
+    http_packet['offset'] = offset
+    http_packet['length'] = length
+    waiter = {'done': threading.Event(), 'packet': None}
+    fetch_waiters[http_packet['task_id']] = waiter
+    start = time.time()
+    try:
+        if not send_packet(replica, http_packet, file_receiver_port, 'fetch') or not waiter['done'].wait(timeout):
+            raise TimeoutError(f"{replica} did not send {sdfs_filename}")
+    finally:
+        del fetch_waiters[http_packet['task_id']]
+    data_packet = waiter['packet']
+    try:
+        if 'error' in data_packet:
+            raise FileNotFoundError(f"{replica} could not send {sdfs_filename}: {data_packet['error']}")
+        store_payload(data_packet, local_filename)
+        peer_stats.record_transfer(replica, os.path.getsize(local_filename), time.time() - start)
+    finally:
+        if 'payload_path' in data_packet:
+            remove_spool_file(data_packet['payload_path'])
+
+def version_query(http_packet):
+    """
+        Tell the leader the version stamp of the copy stored here, for reads with a quorum above one
+    """
+    return_packet = {}
+    return_packet['task_id'] = http_packet['task_id']
+    return_packet['request_type'] = 'version_ack'
+    return_packet['request_source'] = http_packet['request_source']
+    return_packet['sdfs_filename'] = http_packet['sdfs_filename']
+    return_packet['replica_ip'] = host_domain_name
+    # a tombstone of a deleted copy is no version of the file
+    return_packet['version'] = replica_versions.get(http_packet['sdfs_filename'], 0) if is_stored(http_packet['sdfs_filename']) else 0
+    send(return_packet, 'version_ack', True)
 
 def delete_file(http_packet):
     """
         This function deletes the file at current SDFS folder (4 servers executed)
     """
     sdfs = http_packet['sdfs_filename']
-    cmd = f'rm /home/aaghosh2/MP3_FILE/{sdfs}'
     try:
-        result = subprocess.check_output(cmd, shell=True)
+        delete_copy(sdfs, http_packet.get('version'))
         # logger.info(f"Complete {str(http_packet)} ")
+    except Exception as e:
+        logger.error(f"Delete of {sdfs} error: {str(e)}")
+    finally:
+        # the leader waits for every live replica, so the ack is always sent
         return_packet = {}
         return_packet['task_id'] = http_packet['task_id']
         return_packet['request_type'] = 'delete_ack'
@@ -176,45 +616,310 @@ def delete_file(http_packet):
         return_packet['replica_ip'] = host_domain_name
         send(return_packet, 'get_ack', True)
 
+def delete_copy(sdfs, version):
+    """
+        Remove the copy of sdfs stored here. The delete's version stays in replica_versions as a
+        tombstone: a put of the deleted file that is still on its way is dropped by install_copy
+        instead of bringing the file back. A copy that never arrived counts as deleted.
+    """
+    with replica_lock:
+        if version is not None:
+            replica_versions[sdfs] = max(version, replica_versions.get(sdfs, 0))
+        else:
+            replica_versions.pop(sdfs, None)
+        try:
+            remove_stored(sdfs)
+        except FileNotFoundError:
+            pass
+
+def batch_files(http_packet):
+    """
+        Replica side of a batch request: put, get or delete all files of the batch that live
+        on this server and answer the leader with one batch_ack
+    """
+    source = http_packet['request_source']
+    failed = []
+    for item in http_packet['files']:
+        sdfs = item['sdfs_filename']
+        try:
+            if http_packet['request_type'] == 'batch_put':
+                incoming = incoming_path()
+                try:
+                    copy_file(source, item['local_filename'], host_domain_name, incoming)
+                    install_copy(incoming, sdfs, item.get('version'))
+                finally:
+                    remove_spool_file(incoming)
+            elif http_packet['request_type'] == 'batch_get':
+                path = f'{mp3_file_path}/{sdfs}'
+                if sdfs in pack_store:
+                    path = new_spool_file()
+                    pack_store.extract(sdfs, path)
+                try:
+                    copy_file(host_domain_name, path, source, item['local_filename'])
+                finally:
+                    if path.startswith(mp3_spool_path):
+                        remove_spool_file(path)
+            else:
+                delete_copy(sdfs, item.get('version'))
+        except Exception as e:
+            logger.error(f"Batch {http_packet['request_type']} of {sdfs} error: {str(e)}")
+            failed.append(sdfs)
+
+    return_packet = {}
+    return_packet['task_id'] = http_packet['task_id']
+    return_packet['request_type'] = 'batch_ack'
+    return_packet['request_source'] = http_packet['request_source']
+    return_packet['replica_ip'] = host_domain_name
+    return_packet['failed'] = failed
+    send(return_packet, 'batch_ack', True)
+
+def erasure_of(sdfs_filename):
+    return file_attrs.get(sdfs_filename, {}).get('erasure')
+
+def fetch_fragments(sdfs_filename, sources, k, fragment_dir, bandwidth = 0):
+    """
+        Copy k fragments of an erasure coded file into fragment_dir, sources = [[index, host], ...].
+        Data fragments come first in sources so a complete set needs no decoding.
+        Returns {index: path} of the fragments fetched.
+    """
+    fragments = {}
+    def fetch(index, host):
+        path = fragment_path(os.path.join(fragment_dir, 'fragment'), index)
+        try:
+            timed_copy(host, f'{mp3_file_path}/{sdfs_filename}', path, bandwidth)
+            fragments[index] = path
+        except Exception as e:
+            logger.error(f"Copy of fragment {index} of {sdfs_filename} from {host}, Error: {str(e)}")
+
+    # fetch k fragments in parallel, on failures try the remaining ones
+    pending = sorted(sources)
+    while len(fragments) < k and len(pending) > 0:
+        wave, pending = pending[:k - len(fragments)], pending[k - len(fragments):]
+        threads = [threading.Thread(target = fetch, args = source) for source in wave]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return fragments
+
+def fetch_erasure_file(sdfs_filename, hosts, erasure, local_path):
+    """
+        Rebuild an erasure coded file into local_path from any k fragments held by live hosts
+    """
+    members = set(fail_detector.membership_list.keys())
+    sources = [[index, host] for index, host in enumerate(hosts) if host in members]
+    fragment_dir = tempfile.mkdtemp(dir = mp3_spool_path)
+    try:
+        fragments = fetch_fragments(sdfs_filename, sources, erasure['k'], fragment_dir)
+        decode_file(fragments, erasure['size'], local_path, erasure['k'], erasure['m'])
+    finally:
+        shutil.rmtree(fragment_dir, ignore_errors = True)
+
+def cut_range(path, offset, length = None):
+    """
+        Keep only the length bytes at offset of the file at path (to the end if length is None)
+    """
+    with open(path, 'r+b') as fd:
+        fd.seek(offset)
+        data = fd.read() if length is None else fd.read(length)
+        fd.seek(0)
+        fd.write(data)
+        fd.truncate()
+
+def ec_get_file(http_packet):
+    """
+        The requester of a get on an erasure coded file reads the fragments itself and acks the leader
+    """
+    failed = True
+    try:
+        fetch_erasure_file(http_packet['sdfs_filename'], http_packet['hosts'], http_packet['erasure'], http_packet['local_filename'])
+        if http_packet.get('offset') or http_packet.get('length') is not None:
+            # a byte range of a coded file is cut out of the decoded file
+            cut_range(http_packet['local_filename'], http_packet.get('offset') or 0, http_packet.get('length'))
+        failed = False
     except Exception as e:
-        logger.error(f"Command: {cmd}, Error: {str(e)}")
+        logger.error(f"Erasure get of {http_packet['sdfs_filename']} error: {str(e)}")
+    finally:
+        return_packet = {}
+        return_packet['task_id'] = http_packet['task_id']
+        return_packet['request_type'] = 'get_ack'
+        return_packet['request_source'] = http_packet['request_source']
+        return_packet['sdfs_filename'] = http_packet['sdfs_filename']
+        return_packet['replica_ip'] = host_domain_name
+        return_packet['failed'] = failed
+        send(return_packet, 'get_ack', True)
+
+def ec_rebuild_file(http_packet):
+    """
+        Regenerate the one fragment of an erasure coded file that was lost with a failed server
+    """
+    sdfs = http_packet['sdfs_filename']
+    erasure = http_packet['erasure']
+    fragment_dir = tempfile.mkdtemp(dir = mp3_spool_path)
+    ok = False
+    try:
+        fragments = fetch_fragments(sdfs, http_packet['sources'], erasure['k'], fragment_dir, http_packet.get('bandwidth', 0))
+        rebuild_fragment(fragments, erasure['size'], http_packet['fragment'], f'{mp3_file_path}/{sdfs}', erasure['k'], erasure['m'])
+        track_stored(sdfs)
+        stamp_version(sdfs, http_packet.get('version'))
+        logger.info(f"Rebuilt fragment {http_packet['fragment']} of {sdfs}")
+        ok = True
+    except Exception as e:
+        logger.error(f"Rebuild of {sdfs} fragment {http_packet['fragment']} error: {str(e)}")
+    finally:
+        shutil.rmtree(fragment_dir, ignore_errors = True)
+        send_rereplicate_ack(http_packet, ok)
+
+def discard_file(http_packet):
+    """
+        Drop a copy that is no longer part of the file's placement, no ack needed
+    """
+    replica_versions.pop(http_packet['sdfs_filename'], None)
+    try:
+        remove_stored(http_packet['sdfs_filename'])
+    except OSError:
+        pass
 
 def update_file(http_packet):
     """
-        This function updates the file table for put/delete commands
+        This function applies a metadata delta or snapshot pulled from the leader to the file table
     """
+    global metadata_version, metadata_leader
+    pull_again = False
     try:
-        if 'payload' in http_packet:
-            new_file_location = http_packet['payload']
-            filelocation_list.update(new_file_location) # {"machine1.log":[1,2,3]} -> {"machine1.log":[1,2,3], "machine2.log":[]}
-            # logger.info(f"File location list update {str(new_file_location)}")
-        else:
-            del_sdfs = http_packet['sdfs_filename']
-            del filelocation_list[del_sdfs]
-            # logger.info(f"Delete {str(del_sdfs)} Success")
+        with metadata_lock:
+            if http_packet['request_type'] == 'metadata_snapshot':
+                filelocation_list.clear()
+                filelocation_list.update(decode_snapshot(http_packet['payload']))
+                file_attrs.clear()
+                file_attrs.update(http_packet['payload'].get('attrs', {}))
+                metadata_version = http_packet['version']
+                metadata_leader = http_packet['leader']
+            elif http_packet['leader'] == metadata_leader and http_packet['entries'][0]['version'] <= metadata_version + 1:
+                # pull replies and the standby stream can overlap, entries already applied are skipped
+                for entry in http_packet['entries']:
+                    if entry['version'] > metadata_version:
+                        apply_entry(filelocation_list, entry, file_attrs)
+                metadata_version = max(metadata_version, http_packet['entries'][-1]['version'])
+                pull_again = metadata_version < http_packet['version']
+            # otherwise it is an out of date reply, the next pull fixes it
     except Exception as e:
         logger.error(f'Error {str(e)}')
-    
+    if pull_again:
+        request_metadata()
 
-def handle_request(clientsocket, ip):
+def request_metadata():
     """
-    These function handles are requests that are from the leader.
+        This function asks the leader for the metadata entries after our last seen version
+    """
+    http_packet = {}
+    http_packet['task_id'] = host_domain_name + '_'+str(datetime.datetime.now())
+    http_packet['request_type'] = 'metadata_pull'
+    http_packet['request_source'] = host_domain_name
+    with metadata_lock:
+        http_packet['version'] = metadata_version
+        http_packet['leader'] = metadata_leader
+    http_packet['load'] = local_load()
+    send(http_packet, 'metadata_pull', True)
+
+def local_load():
+    """
+        Free disk, bytes stored in sdfs and running transfers of this member, piggybacked on metadata pulls
+    """
+    stored = stored_bytes + pack_store.stats()['bytes']
+    return {'free': shutil.disk_usage(mp3_file_path).free, 'stored': stored, 'transfers': active_transfers}
+
+def pull_metadata():
+    """
+        Members keep their file table up to date by pulling from the leader
     """
-    query = clientsocket.recv(4096)
+    while True:
+        time.sleep(metadata_pull_interval)
+        members = list(fail_detector.membership_list.keys())
+        if len(members) > 1 and election.leader() != host_domain_name:
+            request_metadata()
+
+def serve_metadata_pull(http_packet):
+    """
+        Leader answers a member pull with the entries after its version, or with a
+        compact snapshot if the member is too far behind or followed another leader
+    """
+    if 'load' in http_packet:
+        node_load.update(http_packet['request_source'], http_packet['load'])
+    entries = None
+    if http_packet['leader'] == host_domain_name:
+        member_versions[http_packet['request_source']] = http_packet['version']
+        entries = metadata_log.entries_since(http_packet['version'], metadata_pull_limit)
+        if entries == []:
+            return
+
+    reply_packet = {}
+    reply_packet['task_id'] = http_packet['task_id']
+    reply_packet['leader'] = host_domain_name
+    if entries is None:
+        version, snapshot = metadata_log.snapshot(filelocation_list)
+        reply_packet['request_type'] = 'metadata_snapshot'
+        reply_packet['version'] = version
+        reply_packet['payload'] = snapshot
+    else:
+        reply_packet['request_type'] = 'metadata_delta'
+        reply_packet['version'] = metadata_log.version
+        reply_packet['entries'] = entries
+    send(reply_packet, 'metadata', False, [http_packet['request_source']])
     
-    http_packet = query.decode(msg_format)
-    http_packet = json.loads(http_packet)
 
-    logger.info(f"Received Task {str(http_packet)}")
+def handle_request(http_packet):
+    """
+    These function handles are requests that are from the leader.
+    """
+    global active_transfers
+    transfer = http_packet['request_type'] in transfer_requests
+    if transfer:
+        with transfer_lock:
+            active_transfers += 1
+    start = time.time()
+    try:
+        dispatch_request(http_packet)
+    finally:
+        metrics.observe('member.' + http_packet['request_type'], time.time() - start)
+        if transfer:
+            with transfer_lock:
+                active_transfers -= 1
+        if 'payload_path' in http_packet:
+            remove_spool_file(http_packet['payload_path'])
+
+def dispatch_request(http_packet):
+    # not the whole packet: snapshots, metadata deltas and standby syncs would flood the log
+    logger.info(f"Received Task {http_packet['request_type']} {http_packet.get('task_id')} from {http_packet.get('request_source')}, payload {http_packet.get('payload_bytes', 0)} bytes")
     # each of request_type might send x
     if http_packet['request_type'] == 'put':
         put_file(http_packet)
-    elif http_packet['request_type'] == 'get':
+    elif http_packet['request_type'] in ['get', 'fetch']:
         get_file(http_packet)
+    elif http_packet['request_type'] == 'file_data':
+        receive_file(http_packet)
     elif http_packet['request_type'] == 'delete':
         delete_file(http_packet)
-    elif http_packet['request_type'] == 'update':
+    elif http_packet['request_type'] == 'append':
+        append_file(http_packet)
+    elif http_packet['request_type'] == 'version_query':
+        version_query(http_packet)
+    elif http_packet['request_type'] in batch_requests:
+        batch_files(http_packet)
+    elif http_packet['request_type'] == 'ec_get':
+        ec_get_file(http_packet)
+    elif http_packet['request_type'] == 'ec_rebuild':
+        ec_rebuild_file(http_packet)
+    elif http_packet['request_type'] == 'discard':
+        discard_file(http_packet)
+    elif http_packet['request_type'] in ['metadata_delta', 'metadata_snapshot']:
         update_file(http_packet)
+    elif http_packet['request_type'] == 'standby_sync':
+        standby_sync(http_packet)
+    elif http_packet['request_type'] == 'not_leader':
+        follow_redirect(http_packet)
+    elif http_packet['request_type'] == 'retry_later':
+        retry_request(http_packet)
     elif http_packet['request_type'] == 'maple':
         handleMapleRequest(http_packet)
     elif http_packet['request_type'] == 'juice':
@@ -225,290 +930,1089 @@ def handle_request(clientsocket, ip):
         handleJuiceResponse(http_packet)
     elif http_packet['request_type'] == 'finish_ack':
         task_id = http_packet['task_id']
+        metrics.stop(('client', task_id))
         print(f"Task {task_id} finished from all servers")
+        if 'version' in http_packet:
+            print(f"{http_packet['sdfs_filename']} is at version {http_packet['version']}, {http_packet['size']} bytes")
+        if http_packet.get('superseded'):
+            print(f"{http_packet['sdfs_filename']} was overwritten by a later put before this one ran")
+        for path in local_cleanup.pop(task_id, []):
+            remove_spool_file(path)
+        if http_packet.get('failed'):
+            print(f"Task {task_id} failed for {str(http_packet['failed'])}")
 
 def receiver():
+    """
+    Serve framed requests from pooled connections on an event loop. Requests of one connection
+    run in parallel on a bounded pool of worker threads, so a long transfer does not block the stream.
+    """
     logger.info("listening and dealing with requests")
-    thread_pool = {}
-            
-    file_sockets['reciever'].listen()                 
+    AsyncServer(file_sockets['reciever'], handle_request, mp3_spool_path, on_error = logger.error, inline = deliver_inline).run()
 
+def send2Member(http_packet):
+    """
+    This function is from the leader to prepare the http_packet to the members.
+    It is called by the leader scheduler once the request is allowed to start on its file.
+    """
+    try:
+        if http_packet['request_type'] in batch_requests:
+            send_batch(http_packet)
+            return
+
+        sdfs_filename = http_packet['sdfs_filename']
+        if http_packet['request_type'] in ['get', 'delete'] and sdfs_filename not in filelocation_list:
+            raise FileNotFoundError(f"{sdfs_filename} is not stored in the sdfs")
+        #WRITE
+        if http_packet['request_type'] == 'put':
+            # select to do job
+            members = list(fail_detector.membership_list.keys())
+            print("Members: ",members)
+            members.remove(host_domain_name)
+
+            erasure = http_packet.get('erasure')
+            if erasure is not None and len(members) >= erasure['k'] + erasure['m']:
+                send_erasure_put(http_packet, members)
+                return
+            http_packet.pop('erasure', None)
+
+            if sdfs_filename in filelocation_list and erasure_of(sdfs_filename) is not None:
+                # erasure coded before, keep full copies on the first live fragment holders
+                replica_ips = [ip for ip in filelocation_list[sdfs_filename] if ip in members][:replication_factor]
+            elif sdfs_filename in filelocation_list:
+                replica_ips = filelocation_list[sdfs_filename]
+            else:
+                replica_ips = node_load.choose(members, replication_factor, http_packet.get('size'))
+
+            print("Replica_ips ", replica_ips)
+            start_write(http_packet, replica_ips, http_packet.get('quorum', write_quorum), next_attrs(sdfs_filename, http_packet.get('size')))
+            # add counter after a job is exectued
+            send(http_packet, 'put', False, replica_ips)
+
+        elif http_packet['request_type'] == 'append':
+            send_append(http_packet)
+
+        elif http_packet['request_type'] == 'rebalance':
+            finish_rebalance(http_packet)
+
+        #READ
+        elif http_packet['request_type'] == 'get':
+            # this should be chnaged, we need to get from a server and delete all file on servers
+            # should also consider the mechnism of maintaining file table
+            loc = filelocation_list[sdfs_filename]
+            erasure = erasure_of(sdfs_filename)
+            if erasure is not None:
+                # the requester fetches any k fragments and decodes them itself
+                ec_packet = dict(http_packet)
+                ec_packet['request_type'] = 'ec_get'
+                fresh = fresh_replicas.get(sdfs_filename)
+                # fragments of a put that are still in flight are not read
+                ec_packet['hosts'] = [ip if not fresh or ip in fresh else lost_fragment for ip in loc]
+                ec_packet['erasure'] = erasure
+                if not send_packet(http_packet['request_source'], ec_packet, file_receiver_port, 'ec_get'):
+                    raise ConnectionError(f"requester {http_packet['request_source']} unreachable")
+            else:
+                send_get(http_packet)
 
-    while True:
-        '''
-        listening query (accept each connection), trigger working thread per query
-        '''
-        clientsocket, clientip = file_sockets['reciever'].accept()     
-        '''
-        multithreading programming: label each thread with query's timestamp and client ip
-        end_tasks: record task_id of finished threads
-        thread_pool: dictionary, key: task_id, value:working thread
-        '''
-
-        task_id = str(clientip)+'_'+str(datetime.datetime.now())
-        end_tasks = []
-        thread_pool[task_id] = threading.Thread(target=handle_request, args=[clientsocket, clientip])
-        thread_pool[task_id].start()
-        '''
-        multithreading programming: join finished threads. since dictionary can't be modified during iteration
-        , add the finished tasks into end_tasks, then join those thread with end_tasks
-        '''
-        for task in thread_pool:
-            if not thread_pool[task].is_alive():
-                end_tasks.append(task)
-        for task in end_tasks:
-            thread_pool[task_id].join()
-            del thread_pool[task]
-            logger.info("Finish task:[{}]".format(task))
-
-def send2Member():
-    """
-    This function is from the leader to prepare the http_packet to the members
-    """
-    global leader_queue
+        elif http_packet['request_type'] == 'delete':
+            # Do Delete task here
+            http_packet['version'] = next_attrs(sdfs_filename, None)['version']
+            send(http_packet, 'delete', False, filelocation_list[sdfs_filename])
 
-    while True:
+        else:
+            print(f"INVALID request_type {http_packet['request_type']}")
 
-        remove_task = []
-        waiting_write = defaultdict(lambda: False) 
-        waiting_read = defaultdict(lambda: False) 
-        for i in range(len(leader_queue)):
+    except Exception as e:
+        # release the file so requests queued behind this one are not blocked forever
+        logger.error(f"Error {str(e)}")
+        with ack_lock:
+            batch_acks.pop(http_packet['task_id'], None)
+            write_acks.pop(http_packet['task_id'], None)
+            read_state.pop(http_packet['task_id'], None)
+        leader_scheduler.finish_request(http_packet)
+        # the users are told, gets that joined this one fail with it
+        for request in [http_packet] + http_packet.get('joined', []):
+            if request['request_type'] not in timed_requests:
+                # leader work such as a rebalance has no user waiting for it
+                close_request(request['task_id'])
+                continue
+            ack_packet = {}
+            ack_packet['request_type'] = 'finish_ack'
+            ack_packet['task_id'] = request['task_id']
+            ack_packet['failed'] = request_files(request)
+            send(ack_packet, 'finish_ack', False, [request['request_source']])
+
+def next_attrs(sdfs_filename, size, **attrs):
+    """
+    Attributes of the next version of a file, readers see its version and length.
+    Versions also grow across a delete, so a file put again outranks the tombstones the
+    delete left on its replicas, see delete_copy.
+    """
+    attrs['version'] = max(file_attrs.get(sdfs_filename, {}).get('version', 0), metadata_log.version) + 1
+    attrs['size'] = size
+    return attrs
 
-            http_packet = leader_queue[i]
+def send_append(http_packet):
+    """
+    Appends are scheduled as writes, so appends to one file are applied one at a time in the
+    order the leader received them. Every replica gets only the new bytes and the offset they go to.
+    A file that does not exist yet is created by its first append.
+    """
+    sdfs_filename = http_packet['sdfs_filename']
+    if erasure_of(sdfs_filename) is not None:
+        raise ValueError(f"{sdfs_filename} is erasure coded, append needs a replicated file")
 
-            location_packet = {}
-            #schedule_counter = {'sdfsfilename':[R_count, W_count, R_pre, W_pre]} 
-            #WRITE
-            if http_packet['request_type'] == 'put': 
-                if schedule_counter[http_packet['sdfs_filename']][0]>0 or schedule_counter[http_packet['sdfs_filename']][1]>0 \
-                    or schedule_counter[http_packet['sdfs_filename']][3]>=4:
-                    waiting_write[http_packet['sdfs_filename']] = True
-                    continue
-                else:
-                    waiting_read[http_packet['sdfs_filename']] = waiting_read[http_packet['sdfs_filename']]
-                    schedule_counter[http_packet['sdfs_filename']][3] = 1
-                    schedule_counter[http_packet['sdfs_filename']][2] = 0
-                    schedule_counter[http_packet['sdfs_filename']][1] = 1
-                remove_task.append(i)
-
-                # select to do job
-                members = list(fail_detector.membership_list.keys())
-                print("Members: ",members)
-                members.remove(host_domain_name)
-
-                sdfs_filename = http_packet['sdfs_filename']
-                if sdfs_filename in filelocation_list:
-                    replica_ips = filelocation_list[sdfs_filename]
-                else:
-                    if len(members) >= 4:
-                        replica_ips = random.sample(members, 4)
-                    else:
-                        replica_ips = random.sample(members, len(members))
-
-                print("Replica_ips ", replica_ips)
-                filelocation_list[sdfs_filename] = replica_ips
-                # add counter after a job is exectued
-                send(http_packet, 'put', False, replica_ips)
-                location_packet['task_id'] = host_domain_name + '_'+str(datetime.datetime.now())  
-                location_packet['request_type'] = 'update'
-                location_packet['sdfs_filename'] = sdfs_filename
-                location_packet['payload'] = {sdfs_filename:replica_ips}
-                send(location_packet, 'update', False)
-
-            #READ
-            elif http_packet['request_type'] == 'get':
-
-                if schedule_counter[http_packet['sdfs_filename']][0]>1 or schedule_counter[http_packet['sdfs_filename']][1]>0 \
-                    or schedule_counter[http_packet['sdfs_filename']][2]>=4:
-                    waiting_read[http_packet['sdfs_filename']] = True
-                    continue
-                else:
-                    waiting_write[http_packet['sdfs_filename']] = waiting_write[http_packet['sdfs_filename']]
-                    schedule_counter[http_packet['sdfs_filename']][3] = 0
-                    schedule_counter[http_packet['sdfs_filename']][2] += 1
-                    schedule_counter[http_packet['sdfs_filename']][0] += 1
-                remove_task.append(i)
-                
-                # this should be chnaged, we need to get from a server and delete all file on servers
-                # should also consider the mechnism of maintaining file table
-                
-                sdfs_filename = http_packet['sdfs_filename']
-                loc = filelocation_list[sdfs_filename]
-                send(http_packet, 'get', False, loc)
-
-            elif http_packet['request_type'] == 'delete':
-                # Re-schedule Counter
-                if schedule_counter[http_packet['sdfs_filename']][0]>0 or schedule_counter[http_packet['sdfs_filename']][1]>0 \
-                    or schedule_counter[http_packet['sdfs_filename']][3]>=4:
-                    waiting_write[http_packet['sdfs_filename']] = True
-                    continue
-                else:
-                    waiting_read[http_packet['sdfs_filename']] = waiting_read[http_packet['sdfs_filename']]
-                    schedule_counter[http_packet['sdfs_filename']][3] = 1
-                    schedule_counter[http_packet['sdfs_filename']][2] = 0
-                    schedule_counter[http_packet['sdfs_filename']][1] = 1
-                remove_task.append(i)
+    if sdfs_filename in filelocation_list:
+        replica_ips = filelocation_list[sdfs_filename]
+        offset = file_attrs.get(sdfs_filename, {}).get('size')
+    else:
+        members = [ip for ip in fail_detector.membership_list.keys() if ip != host_domain_name]
+        replica_ips = node_load.choose(members, replication_factor, http_packet.get('size'))
+        metadata_log.record(filelocation_list, 'put', sdfs_filename, replica_ips, next_attrs(sdfs_filename, 0))
+        offset = 0
+
+    append_packet = dict(http_packet)
+    append_packet['offset'] = offset
+    append_packet['version'] = file_attrs.get(sdfs_filename, {}).get('version', 0) + 1
+    append_ack[sdfs_filename] = []
+    send(append_packet, 'append', False, replica_ips)
+
+def start_write(http_packet, replica_ips, quorum, attrs):
+    """
+    Track the acks of a put. The put is stamped with the file's new version, so replicas keep
+    the newest copy whatever order transfers finish in. The version and placement are only
+    recorded once quorum replicas have the bytes, see commit_write.
+    """
+    http_packet['version'] = attrs['version']
+    with ack_lock:
+        write_acks[http_packet['task_id']] = {'http_packet': http_packet, 'replicas': list(replica_ips), 'quorum': quorum, 'attrs': attrs,
+                                              'acked': set(), 'failed': set(), 'released': False, 'committed': False}
 
-                # Do Delete task here
-                try:
-                    sdfs_filename = http_packet['sdfs_filename']
-                    send(http_packet, request_type, False, filelocation_list[sdfs_filename])
-                    location_packet['task_id'] = host_domain_name + '_'+str(datetime.datetime.now())  
-                    location_packet['request_type'] = 'update'
-                    location_packet['sdfs_filename'] = sdfs_filename
-                    send(location_packet, 'update', False)
-                except Exception as e:
-                    logger.error(f"Error {str(e)}")
-
-            elif http_packet['request_type'] =='put_ack':
-                global put_ack
-                source = http_packet['request_source']
-                sdfs_filename = http_packet['sdfs_filename']
-                replica_ip = http_packet['replica_ip']
-                put_ack[sdfs_filename].append(replica_ip)
-                print("Checking file location list:", filelocation_list)
-                check_list = set(list(fail_detector.membership_list.keys())) & set(filelocation_list[sdfs_filename])
-                remove_task.append(i)
-                if sorted(list(check_list)) == sorted(put_ack[sdfs_filename]) or len(put_ack[sdfs_filename])>=len(check_list): 
-                    print(f"SEND FINISH ACK TO THE USER REQUEST SOURCE at {str(replica_ip)}, check_list is {str(check_list)}, put_ack is {str(sorted(put_ack[sdfs_filename]))}")
-                    put_ack[sdfs_filename] = []
-                    schedule_counter[sdfs_filename][1] = 0
-                    ack_packet = {}
-                    ack_packet['request_type'] = 'finish_ack'
-                    ack_packet['task_id'] = http_packet['task_id']
-                    send(ack_packet, 'finish_ack', False, [source])
-                    # remove_task.append(i)
-            
-            elif http_packet['request_type'] =='delete_ack':
-                global delete_ack
-                source = http_packet['request_source']
-                sdfs_filename = http_packet['sdfs_filename']
-                replica_ip = http_packet['replica_ip']
-                delete_ack[sdfs_filename].append(replica_ip)
-                check_list = set(fail_detector.membership_list.keys()) & set(filelocation_list[sdfs_filename])
-                remove_task.append(i)
-                if sorted(list(check_list)) == sorted(delete_ack[sdfs_filename]) or len(delete_ack[sdfs_filename])>=len(check_list): 
-                    delete_ack[sdfs_filename] = []
-                    schedule_counter[sdfs_filename][1] = 0
-                    # after receive all acks, delete from file location list
-                    del filelocation_list[sdfs_filename]
-                    ack_packet = {}
-                    ack_packet['request_type'] = 'finish_ack'
-                    ack_packet['task_id'] = http_packet['task_id']
-                    send(ack_packet, 'finish_ack', False, [source])
-                    # remove_task.append(i)
-            
-            elif http_packet['request_type'] =='get_ack':
-                sdfs_filename = http_packet['sdfs_filename']
-                source = http_packet['request_source']
-                schedule_counter[sdfs_filename][0] -= 1
+def commit_write(write):
+    """
+    Quorum replicas stored a put: record its version and replicas, drop the copies of servers
+    that no longer hold the file (e.g. fragments of a formerly erasure coded file)
+    """
+    sdfs_filename = write['http_packet']['sdfs_filename']
+    discard_copies(sdfs_filename, write['replicas'])
+    metadata_log.record(filelocation_list, 'put', sdfs_filename, write['replicas'], write['attrs'])
+    fresh_replicas[sdfs_filename] = set(write['acked'])
+    write['committed'] = True
+
+def handle_put_ack(http_packet):
+    """
+    The user is acked and the file released as soon as quorum replicas committed the put.
+    Lagging replicas finish in the background; once all live replicas answered, the ones that
+    failed are dropped from the file and copied again by the re-replication planner.
+    """
+    write = write_acks.get(http_packet['task_id'])
+    if write is None:
+        return
+    sdfs_filename = http_packet['sdfs_filename']
+    replica_ip = http_packet['replica_ip']
+    if http_packet.get('ok', True):
+        write['acked'].add(replica_ip)
+        if write['committed']:
+            fresh_replicas.setdefault(sdfs_filename, set()).add(replica_ip)
+    else:
+        write['failed'].add(replica_ip)
+
+    members = set(fail_detector.membership_list.keys())
+    live = members & set(write['replicas'])
+    answered = live <= (write['acked'] | write['failed'])
+    if not write['released'] and (len(write['acked']) >= min(write['quorum'], len(live)) or answered):
+        print(f"SEND FINISH ACK TO THE USER REQUEST SOURCE, {len(write['acked'])} of {len(live)} replicas acked, quorum {write['quorum']}")
+        write['released'] = True
+        if len(write['acked']) >= min(write['quorum'], len(live)) and len(write['acked']) > 0:
+            commit_write(write)
+        leader_scheduler.finish_write(sdfs_filename)
+        ack_packet = {}
+        ack_packet['request_type'] = 'finish_ack'
+        ack_packet['task_id'] = http_packet['task_id']
+        ack_packet['sdfs_filename'] = sdfs_filename
+        ack_packet['version'] = write['http_packet']['version']
+        ack_packet['size'] = file_attrs.get(sdfs_filename, {}).get('size')
+        if not write['committed']:
+            # the file keeps its previous version and replicas
+            ack_packet['failed'] = [sdfs_filename]
+        send(ack_packet, 'finish_ack', False, [write['http_packet']['request_source']])
+
+    if answered:
+        del write_acks[http_packet['task_id']]
+        hosts = filelocation_list.get(sdfs_filename)
+        if len(write['failed']) > 0 and write['committed'] and hosts is not None:
+            if erasure_of(sdfs_filename) is None:
+                metadata_log.record(filelocation_list, 'move', sdfs_filename, [ip for ip in hosts if ip not in write['failed']])
+            else:
+                # a fragment keeps its position: mark it lost so repair_file rebuilds it on another member
+                metadata_log.record(filelocation_list, 'move', sdfs_filename, [lost_fragment if ip in write['failed'] else ip for ip in hosts])
+                for ip in write['failed']:
+                    send_discard(ip, sdfs_filename)
+            rereplication_planner.schedule(sdfs_filename, redundancy_left(sdfs_filename, members))
+
+def send_get(http_packet):
+    """
+    Reads go to a replica known to hold the latest version. With a read quorum above one the
+    version stamps of that many replicas are compared first and the newest copy is read.
+    """
+    sdfs_filename = http_packet['sdfs_filename']
+    quorum = http_packet.get('quorum', read_quorum)
+    members = set(fail_detector.membership_list.keys())
+    live = [ip for ip in filelocation_list[sdfs_filename] if ip in members]
+    fresh = fresh_replicas.get(sdfs_filename, set())
+    preferred = http_packet.get('preferred', [])
+    live.sort(key = lambda ip: (ip not in fresh, preferred.index(ip) if ip in preferred else len(preferred)))
+    # gets the scheduler joined to this one are served by the same transfer, see finish_get
+    group = OrderedDict()
+    for request in [http_packet] + http_packet.pop('joined', []):
+        group.setdefault(request['request_source'], []).append(request)
+    if len(group) > 1 or len(group[http_packet['request_source']]) > 1:
+        metrics.count('leader.joined_gets', sum(len(requests) for requests in group.values()) - 1)
+    with ack_lock:
+        read_state[http_packet['task_id']] = {'http_packet': http_packet, 'tried': set(), 'asked': set(live[:quorum]), 'versions': {},
+                                              'group': group, 'pending': set(group)}
+    if quorum <= 1:
+        try_read(http_packet['task_id'])
+        return
+
+    query_packet = {}
+    query_packet['task_id'] = http_packet['task_id']
+    query_packet['request_type'] = 'version_query'
+    query_packet['request_source'] = http_packet['request_source']
+    query_packet['sdfs_filename'] = sdfs_filename
+    for ip in live[:quorum]:
+        send_packet(ip, query_packet, file_receiver_port, 'version_query')
+
+def try_read(task_id):
+    """
+    Send the get to the best replica not tried yet: the newest stamp a quorum reported, else
+    one that acked the latest write, and among those the one the requester ranked fastest.
+    If every replica is behind the read fails. The replica sends the file to the first
+    destination of the read's group only, the destinations relay it to each other.
+    """
+    read = read_state[task_id]
+    http_packet = read['http_packet']
+    sdfs_filename = http_packet['sdfs_filename']
+    members = set(fail_detector.membership_list.keys())
+    fresh = fresh_replicas.get(sdfs_filename, set())
+    candidates = [ip for ip in filelocation_list.get(sdfs_filename, []) if ip in members and ip not in read['tried']]
+    preferred = http_packet.get('preferred', [])
+    candidates.sort(key = lambda ip: (-read['versions'].get(ip, -1), ip not in fresh, preferred.index(ip) if ip in preferred else len(preferred)))
+    if len(candidates) == 0:
+        del read_state[task_id]
+        leader_scheduler.finish_read(sdfs_filename)
+        for requests in read['group'].values():
+            for request in requests:
                 ack_packet = {}
                 ack_packet['request_type'] = 'finish_ack'
-                ack_packet['task_id'] = http_packet['task_id']
-                send(ack_packet, 'finish_ack', False, [source])
-                remove_task.append(i)
+                ack_packet['task_id'] = request['task_id']
+                ack_packet['failed'] = [sdfs_filename]
+                send(ack_packet, 'finish_ack', False, [request['request_source']])
+        return
+
+    read['tried'].add(candidates[0])
+    get_packet = dict(http_packet)
+    get_packet['version'] = max([file_attrs.get(sdfs_filename, {}).get('version') or 0] + list(read['versions'].values()))
+    get_packet['relay'] = list(read['group'])
+    get_packet['waiters'] = {dest: [[request['task_id'], request['local_filename']] for request in requests] for dest, requests in read['group'].items()}
+    send_packet(candidates[0], get_packet, file_receiver_port, 'get')
+
+def send_erasure_put(http_packet, members):
+    """
+    Place the k+m fragments of an erasure coded put on distinct members, fragment i goes to
+    replica_ips[i]. Current holders of the file are reused first.
+    """
+    sdfs_filename = http_packet['sdfs_filename']
+    erasure = http_packet['erasure']
+    count = erasure['k'] + erasure['m']
+    replica_ips = [ip for ip in filelocation_list.get(sdfs_filename, []) if ip in members][:count]
+    replica_ips += node_load.choose([ip for ip in members if ip not in replica_ips], count - len(replica_ips), -(-erasure['size'] // erasure['k']))
+
+    print("Fragment ips ", replica_ips)
+    # like full copies, one lagging fragment does not hold the put back; readers skip it until it
+    # acked, and a fragment that failed is rebuilt by the re-replication planner, see handle_put_ack
+    start_write(http_packet, replica_ips, len(replica_ips) - 1, next_attrs(sdfs_filename, erasure['size'], erasure = erasure))
+    for index, replica_ip in enumerate(replica_ips):
+        fragment_packet = dict(http_packet)
+        fragment_packet['fragment'] = index
+        send_packet(replica_ip, fragment_packet, file_receiver_port, 'put')
+
+def discard_copies(sdfs_filename, keep_ips):
+    """
+    Tell holders of sdfs_filename that are not in keep_ips to drop their copy
+    """
+    for ip in filelocation_list.get(sdfs_filename, []):
+        if ip not in keep_ips:
+            send_discard(ip, sdfs_filename)
+
+def send_discard(ip, sdfs_filename):
+    http_packet = {}
+    http_packet['task_id'] = host_domain_name + '_'+str(datetime.datetime.now())
+    http_packet['request_type'] = 'discard'
+    http_packet['sdfs_filename'] = sdfs_filename
+    send_packet(ip, http_packet, file_receiver_port, 'discard')
 
+def send_batch(http_packet):
+    """
+    Leader side of a batch request, it holds the slot of every file in the batch.
+    Files are grouped by replica so every replica gets one request for all of its files.
+    """
+    request_type = http_packet['request_type']
+    replica_files = defaultdict(list)
+    puts = {}                   # sdfs_filename: (replicas, attrs) of a batch put
+    failed = []
+    members = list(fail_detector.membership_list.keys())
+    members.remove(host_domain_name)
+    for item in http_packet['files']:
+        sdfs_filename = item['sdfs_filename']
+        if request_type == 'batch_put':
+            if sdfs_filename in filelocation_list and erasure_of(sdfs_filename) is None:
+                replica_ips = filelocation_list[sdfs_filename]
             else:
-               print(f"INVALID request_type {request_type}")
-
-        # handle logic to avoid continous same operation and starvation
-        for file_name, check in waiting_read.items():
-            if not check:
-                schedule_counter[file_name][3] = 0
-        for file_name, check in waiting_write.items():
-            if not check:
-                schedule_counter[file_name][2] = 0
-
-        # remove tasks that are done from job queue
-        for task in remove_task[::-1]:
-            del leader_queue[task]
-    
+                replica_ips = node_load.choose(members, replication_factor, item.get('size'))
+            # recorded in finish_batch once the replicas stored it
+            puts[sdfs_filename] = (replica_ips, next_attrs(sdfs_filename, item.get('size')))
+            item['version'] = puts[sdfs_filename][1]['version']
+        elif sdfs_filename not in filelocation_list:
+            continue
+        elif request_type == 'batch_delete':
+            item['version'] = next_attrs(sdfs_filename, None)['version']
+            replica_ips = filelocation_list[sdfs_filename]
+        elif request_type == 'batch_get' and erasure_of(sdfs_filename) is not None:
+            # fragments can not be copied out one to one, erasure coded files are read with get
+            failed.append(sdfs_filename)
+            continue
+        elif request_type == 'batch_get':
+            replica_ips = filelocation_list[sdfs_filename][:1]
+        else:
+            replica_ips = filelocation_list[sdfs_filename]
+        for replica_ip in replica_ips:
+            replica_files[replica_ip].append(item)
+
+    with ack_lock:
+        batch_acks[http_packet['task_id']] = {'http_packet': http_packet, 'pending': set(replica_files), 'failed': failed, 'puts': puts}
+        if len(replica_files) == 0:
+            finish_batch(http_packet['task_id'])
+    for replica_ip, items in replica_files.items():
+        replica_packet = dict(http_packet)
+        replica_packet['files'] = items
+        send_packet(replica_ip, replica_packet, file_receiver_port, request_type)
+
+def finish_batch(task_id):
+    """
+    All replicas answered a batch: release its files and send one finish_ack to the user
+    """
+    batch = batch_acks.pop(task_id)
+    http_packet = batch['http_packet']
+    if http_packet['request_type'] == 'batch_delete':
+        for sdfs_filename in request_files(http_packet):
+            if sdfs_filename in filelocation_list:
+                metadata_log.record(filelocation_list, 'delete', sdfs_filename)
+    for sdfs_filename, (replica_ips, attrs) in batch['puts'].items():
+        if sdfs_filename not in batch['failed']:
+            metadata_log.record(filelocation_list, 'put', sdfs_filename, replica_ips, attrs)
+            fresh_replicas[sdfs_filename] = set(replica_ips)
+    leader_scheduler.finish_request(http_packet)
+    ack_packet = {}
+    ack_packet['request_type'] = 'finish_ack'
+    ack_packet['task_id'] = task_id
+    ack_packet['failed'] = sorted(set(batch['failed']))
+    send(ack_packet, 'finish_ack', False, [http_packet['request_source']])
+
+def submit_batch(http_packet):
+    """
+    A batch request given by name prefix is expanded to the matching sdfs files before it
+    is scheduled, so it is queued on exactly the files it works on
+    """
+    if 'prefix' in http_packet:
+        local_dir = http_packet.get('local_dir')
+        http_packet['files'] = [{'sdfs_filename': sdfs_filename, 'local_filename': os.path.join(local_dir, sdfs_filename) if local_dir else None}
+                                for sdfs_filename in filelocation_list.prefix(http_packet['prefix'])]
+    if len(http_packet['files']) == 0:
+        ack_packet = {}
+        ack_packet['request_type'] = 'finish_ack'
+        ack_packet['task_id'] = http_packet['task_id']
+        send(ack_packet, 'finish_ack', False, [http_packet['request_source']])
+    else:
+        leader_scheduler.submit(http_packet)
+
+def handle_ack(http_packet):
+    """
+    This function collects acks from the members, answers the user with finish_ack
+    and releases the file in the leader scheduler
+    """
+    if http_packet['request_type'] == 'batch_ack':
+        batch = batch_acks.get(http_packet['task_id'])
+        if batch is not None:
+            batch['pending'].discard(http_packet['replica_ip'])
+            batch['failed'].extend(http_packet['failed'])
+            if len(batch['pending'] & set(fail_detector.membership_list.keys())) == 0:
+                finish_batch(http_packet['task_id'])
+        return
+
+    source = http_packet['request_source']
+    sdfs_filename = http_packet['sdfs_filename']
+
+    if http_packet['request_type'] =='put_ack':
+        handle_put_ack(http_packet)
+
+    elif http_packet['request_type'] == 'version_ack':
+        read = read_state.get(http_packet['task_id'])
+        if read is not None and len(read['tried']) == 0:
+            read['versions'][http_packet['replica_ip']] = http_packet['version']
+            if set(read['versions']) >= read['asked'] & set(fail_detector.membership_list.keys()):
+                try_read(http_packet['task_id'])
+
+    elif http_packet['request_type'] == 'get_stale':
+        if http_packet['task_id'] in read_state:
+            try_read(http_packet['task_id'])
+
+    elif http_packet['request_type'] =='delete_ack':
+        replica_ip = http_packet['replica_ip']
+        delete_ack[sdfs_filename].append(replica_ip)
+        check_list = set(fail_detector.membership_list.keys()) & set(filelocation_list[sdfs_filename])
+        if sorted(list(check_list)) == sorted(delete_ack[sdfs_filename]) or len(delete_ack[sdfs_filename])>=len(check_list): 
+            delete_ack[sdfs_filename] = []
+            # after receive all acks, delete from file location list
+            metadata_log.record(filelocation_list, 'delete', sdfs_filename)
+            fresh_replicas.pop(sdfs_filename, None)
+            leader_scheduler.finish_write(sdfs_filename)
+            ack_packet = {}
+            ack_packet['request_type'] = 'finish_ack'
+            ack_packet['task_id'] = http_packet['task_id']
+            send(ack_packet, 'finish_ack', False, [source])
+
+    elif http_packet['request_type'] =='append_ack':
+        append_ack[sdfs_filename].append((http_packet['replica_ip'], http_packet['ok'], http_packet['size']))
+        members = set(fail_detector.membership_list.keys())
+        acked = set(ip for ip, ok, size in append_ack[sdfs_filename])
+        if acked >= members & set(filelocation_list[sdfs_filename]):
+            finish_append(http_packet)
+
+    elif http_packet['request_type'] =='get_ack':
+        finish_get(http_packet)
+
+def finish_get(http_packet):
+    """
+    One destination of a get answered: ack every request from it, failed if it could not store
+    the file. Destinations a relay
+    could not reach are scheduled again as new gets. The read slot is freed once every
+    destination answered.
+    """
+    sdfs_filename = http_packet['sdfs_filename']
+    dest = http_packet.get('dest', http_packet['request_source'])
+    read = read_state.get(http_packet['task_id'])
+    if read is not None:
+        group = read['group']
+    else:
+        # erasure coded gets have no read state, the requester acks for itself
+        group = {dest: [{'task_id': http_packet['task_id'], 'request_source': dest}]}
+    for request in group.get(dest, []):
+        ack_packet = {}
+        ack_packet['request_type'] = 'finish_ack'
+        ack_packet['task_id'] = request['task_id']
+        if http_packet.get('failed'):
+            ack_packet['failed'] = [sdfs_filename]
+        elif sdfs_filename in file_attrs:
+            ack_packet['sdfs_filename'] = sdfs_filename
+            ack_packet['version'] = file_attrs[sdfs_filename].get('version')
+            ack_packet['size'] = file_attrs[sdfs_filename].get('size')
+        send(ack_packet, 'finish_ack', False, [request['request_source']])
+    if read is None:
+        leader_scheduler.finish_read(sdfs_filename)
+        return
+
+    read['pending'].discard(dest)
+    for failed in http_packet.get('relay_failed', []):
+        read['pending'].discard(failed)
+        for request in group.get(failed, []):
+            leader_scheduler.submit(request)
+    if len(read['pending']) == 0:
+        del read_state[http_packet['task_id']]
+        leader_scheduler.finish_read(sdfs_filename)
+
+def finish_append(http_packet):
+    """
+    Every live replica answered an append: bump the file's version and length, and drop replicas
+    that failed or ended up with a different length, the re-replication planner copies the file again.
+    """
+    sdfs_filename = http_packet['sdfs_filename']
+    results = append_ack.pop(sdfs_filename)
+    sizes = Counter(size for ip, ok, size in results if ok)
+    ack_packet = {}
+    ack_packet['request_type'] = 'finish_ack'
+    ack_packet['task_id'] = http_packet['task_id']
+    if len(sizes) > 0:
+        size = sizes.most_common(1)[0][0]
+        good = [ip for ip in filelocation_list[sdfs_filename] if (ip, True, size) in results]
+        # the task_id tells a new leader that resumes this append that it was already applied
+        metadata_log.record(filelocation_list, 'append', sdfs_filename, good, next_attrs(sdfs_filename, size, task_id = http_packet['task_id']))
+        fresh_replicas[sdfs_filename] = set(good)
+        if len(good) < len(results):
+            rereplication_planner.schedule(sdfs_filename, redundancy_left(sdfs_filename, set(fail_detector.membership_list.keys())))
+        ack_packet['sdfs_filename'] = sdfs_filename
+        ack_packet['version'] = file_attrs[sdfs_filename]['version']
+        ack_packet['size'] = size
+    else:
+        ack_packet['failed'] = [sdfs_filename]
+    leader_scheduler.finish_write(sdfs_filename)
+    send(ack_packet, 'finish_ack', False, [http_packet['request_source']])
+
+def finish_superseded(http_packet):
+    """
+    A queued put that a later put to the same file replaces before it ran: it is acked right away
+    and never transferred, only the newest contents go to the replicas
+    """
+    metrics.count('leader.superseded')
+    ack_packet = {}
+    ack_packet['request_type'] = 'finish_ack'
+    ack_packet['task_id'] = http_packet['task_id']
+    ack_packet['sdfs_filename'] = http_packet['sdfs_filename']
+    ack_packet['superseded'] = True
+    send(ack_packet, 'finish_ack', False, [http_packet['request_source']])
+
+def joinable_read(http_packet):
+    # an erasure coded get is decoded by every requester itself
+    return erasure_of(http_packet['sdfs_filename']) is None
+
+leader_scheduler = RequestScheduler(send2Member, supersede = finish_superseded, join_reads = joinable_read)
+admission = AdmissionControl()
+
+def redundancy_left(sdfs_filename, members):
+    """
+        Copies of a file that can still be lost without losing the file
+    """
+    alive = len([ip for ip in filelocation_list[sdfs_filename] if ip in members])
+    erasure = erasure_of(sdfs_filename)
+    return alive - (erasure['k'] if erasure is not None else 1)
 
 def rereplicate():
     """
-        This function always detects if there are failures and proceed with rereplication
+        This function takes failures off the failure queue, drops the failed server from the file
+        table and hands every file it held to the re-replication planner
     """
     while True:
-        while len(fail_detector.failure_queue) > 0:
+        # failures stay queued while we are not the leader, a new leader repairs them all
+        while len(fail_detector.failure_queue) > 0 and election.is_leader():
             domain_name = fail_detector.failure_queue.popleft()
             print(f"Failure occured! {str(domain_name)}")
-            for sdfs_filename, ips in filelocation_list.items():
-                if domain_name in ips:
-                    # update filelocation_list for all
-                    filelocation_list[sdfs_filename].remove(domain_name)
-                    location_packet = {}
-                    location_packet['task_id'] = host_domain_name + '_'+str(datetime.datetime.now())  
-                    location_packet['request_type'] = 'update'
-                    location_packet['sdfs_filename'] = sdfs_filename
-                    
-                    send_fail = True
-                    while send_fail: 
-                    # create one new replica
-                        mb_list = set(fail_detector.membership_list)
-                        replica_source = random.choice(filelocation_list[sdfs_filename])
-                        dest = random.choice(list(mb_list - set(filelocation_list[sdfs_filename])))
-
-                        # If there is enough space to put replica
-                        if dest:
-                            # Add new replica destinaion if availble
-                            filelocation_list[sdfs_filename].append(dest)
-                            http_packet = {}
-                            http_packet['task_id'] = host_domain_name + '_'+str(datetime.datetime.now())  
-                            http_packet['sdfs_filename'] = sdfs_filename
-                            http_packet['local_filename'] = '/home/aaghosh2/MP3_FILE/' + sdfs_filename
-                            http_packet['request_type'] = "put"
-                            # If request_type == 'put': user input put localfilename, sdfs_filename, source == user host_domain, replica_ips == destination
-                            http_packet['request_source'] = replica_source
-                            send_fail = not (send(http_packet, 'rereplicate', False, [dest]))
-                            if send_fail:
-                                filelocation_list[sdfs_filename].remove(dest)
-                        
-                        else:
-                            send_fail = False
-                    
-                    # Send the location packet in 2 cases: 1. there is new replica destination 2. No new deplica destination, just remove it.
-                    location_packet['payload'] = {sdfs_filename:filelocation_list[sdfs_filename]}
-                    send(location_packet, 'update', False)
+            members = set(fail_detector.membership_list) - {domain_name}
+            for sdfs_filename in filelocation_list.files_on(domain_name):
+                ips = filelocation_list.get(sdfs_filename)
+                if ips is None:
+                    continue
+                if erasure_of(sdfs_filename) is None:
+                    # members pick the change up with their next metadata pull
+                    metadata_log.record(filelocation_list, 'move', sdfs_filename, [ip for ip in ips if ip != domain_name])
+                rereplication_planner.schedule(sdfs_filename, redundancy_left(sdfs_filename, members))
+        time.sleep(0.1)
+
+def repair_file(sdfs_filename):
+    """
+        Bring one file back to full redundancy, run by the re-replication planner workers
+    """
+    while sdfs_filename in filelocation_list:
+        members = set(fail_detector.membership_list)
+        hosts = filelocation_list[sdfs_filename]
+        erasure = erasure_of(sdfs_filename)
+        if erasure is not None:
+            lost = [index for index, host in enumerate(hosts) if host not in members or host == host_domain_name and not os.path.exists(f'{mp3_file_path}/{sdfs_filename}')]
+            if len(lost) == 0 or not repair_copy(sdfs_filename, members, lost[0]):
+                return
+        else:
+            alive = [ip for ip in hosts if ip in members]
+            if len(alive) == 0:
+                logger.info(f"All replicas of {sdfs_filename} are lost")
+                return
+            if len(alive) >= min(replication_factor, len(members)) or not repair_copy(sdfs_filename, members):
+                return
+
+def repair_copy(sdfs_filename, members, fragment = None):
+    """
+        Create one new replica, or regenerate erasure fragment number fragment, on the least
+        busy member that does not hold the file. Returns True once the copy is acked.
+    """
+    for attempt in range(rereplicate_attempts):
+        hosts = filelocation_list.get(sdfs_filename)
+        if hosts is None:
+            return False
+        erasure = erasure_of(sdfs_filename)
+        sources = [ip for index, ip in enumerate(hosts) if ip in members and index != fragment]
+        fresh = [ip for ip in sources if ip in fresh_replicas.get(sdfs_filename, ())]
+        if fragment is None and len(fresh) > 0:
+            # copy from a replica that holds the latest version
+            sources = fresh
+        destinations = node_load.eligible(members - set(hosts), copy_size(sdfs_filename)) or list(members - set(hosts))
+        reserved = rereplication_planner.reserve(destinations, sources, erasure['k'] if fragment is not None else 1)
+        if reserved is None:
+            logger.info(f"No member can take a new copy of {sdfs_filename}")
+            return False
+        dest, sources = reserved
+
+        http_packet = {}
+        http_packet['task_id'] = host_domain_name + '_' + sdfs_filename + '_' + str(datetime.datetime.now())
+        http_packet['sdfs_filename'] = sdfs_filename
+        http_packet['bandwidth'] = rereplicate_bandwidth
+        http_packet['version'] = file_attrs.get(sdfs_filename, {}).get('version')
+        if fragment is not None:
+            http_packet['request_type'] = 'ec_rebuild'
+            http_packet['fragment'] = fragment
+            http_packet['sources'] = [[hosts.index(ip), ip] for ip in sources]
+            http_packet['erasure'] = erasure
+        else:
+            http_packet['request_type'] = 'put'
+            http_packet['local_filename'] = os.path.join(mp3_file_path, sdfs_filename)
+            http_packet['size'] = file_attrs.get(sdfs_filename, {}).get('size')
+            # If request_type == 'put': user input put localfilename, sdfs_filename, source == user host_domain, replica_ips == destination
+            http_packet['request_source'] = sources[0]
+            http_packet['rereplicate'] = True
+
+        if not admit_background(http_packet['task_id']):
+            rereplication_planner.release([dest] + sources)
+            return False
+        rereplication_planner.expect(http_packet['task_id'])
+        try:
+            sent = send(http_packet, 'rereplicate', False, [dest])
+            ok = rereplication_planner.wait(http_packet['task_id'], rereplicate_timeout if sent else 0)
+        finally:
+            rereplication_planner.release([dest] + sources)
+            admission.release(http_packet['task_id'])
+
+        hosts = filelocation_list.get(sdfs_filename)
+        if ok and hosts is not None:
+            # the table only points at the new copy once it is really there
+            if fragment is not None:
+                new_hosts = list(hosts)
+                new_hosts[fragment] = dest
+            else:
+                new_hosts = hosts + [dest]
+            metadata_log.record(filelocation_list, 'move', sdfs_filename, new_hosts)
+            if http_packet['version'] == file_attrs.get(sdfs_filename, {}).get('version'):
+                fresh_replicas.setdefault(sdfs_filename, set()).add(dest)
+            return True
+        logger.info(f"Copy of {sdfs_filename} to {dest} failed, attempt {attempt + 1}")
+    return False
+
+def admit_background(task_id):
+    """
+        Count a replica transfer of the leader in the 'rereplication' class of admission control,
+        waiting while the leader is too loaded for it. False if this server stopped being leader.
+    """
+    while election.is_leader():
+        retry_after = admission.admit(task_id, host_domain_name, 'rereplication')
+        if retry_after is None:
+            return True
+        metrics.count('leader.rejected.rereplication')
+        time.sleep(retry_after)
+    return False
+
+rereplication_planner = RereplicationPlanner(repair_file)
+
+metrics.gauge('leader.queue_depth', leader_scheduler.queue_depth)
+metrics.gauge('leader.rereplication_pending', rereplication_planner.pending)
+metrics.gauge('leader.writes_in_flight', lambda : len(write_acks))
+metrics.gauge('leader.reads_in_flight', lambda : len(read_state))
+metrics.gauge('member.active_transfers', lambda : active_transfers)
+metrics.gauge('files', lambda : len(filelocation_list))
+metrics.gauge('member.packed', pack_store.stats)
+metrics.gauge('leader.admission', admission.stats)
+
+def copy_size(sdfs_filename):
+    """
+        Bytes one replica or fragment of a file takes on disk
+    """
+    size = file_attrs.get(sdfs_filename, {}).get('size') or 0
+    erasure = erasure_of(sdfs_filename)
+    return -(-size // erasure['k']) if erasure is not None else size
+
+def balance():
+    """
+        Replica balancer: every balance_interval move up to balance_moves replicas from the most
+        overfull members to the least loaded members that fit them. Copies are bandwidth capped
+        and share the per member limit of re-replication, so balancing never crowds out repairs.
+    """
+    while True:
+        time.sleep(balance_interval)
+        if not election.is_leader() or not admission.has_room('rereplication'):
+            # moves are the lowest priority work, a loaded leader skips them
+            continue
+        members = set(fail_detector.membership_list) - {host_domain_name}
+        moves = 0
+        for source in node_load.overfull(members):
+            # largest files first, the fewest moves free the most space
+            for sdfs_filename in sorted(filelocation_list.files_on(source), key = copy_size, reverse = True):
+                if moves >= balance_moves:
+                    break
+                hosts = filelocation_list.get(sdfs_filename)
+                if hosts is None or erasure_of(sdfs_filename) is not None or rereplication_planner.pending() > 0:
+                    continue
+                destinations = node_load.eligible(members - set(hosts), copy_size(sdfs_filename))
+                if len(destinations) == 0:
+                    continue
+                try:
+                    move_replica(sdfs_filename, source, destinations[0])
+                    moves += 1
+                except Exception as e:
+                    logger.error(f"Balancing {sdfs_filename} error: {str(e)}")
+
+def move_replica(sdfs_filename, source, dest):
+    """
+        Copy the replica of sdfs_filename on source to dest. The table only switches from source
+        to dest through a 'rebalance' request in the leader scheduler, so the swap is ordered
+        with writes to the file and is dropped if a newer version was written meanwhile.
+    """
+    task_id = host_domain_name + '_' + sdfs_filename + '_' + str(datetime.datetime.now())
+    if not admit_background(task_id):
+        return
+    reserved = rereplication_planner.reserve([dest], [source])
+    if reserved is None:
+        admission.release(task_id)
+        return
+    http_packet = {}
+    http_packet['task_id'] = task_id
+    http_packet['request_type'] = 'put'
+    http_packet['sdfs_filename'] = sdfs_filename
+    http_packet['local_filename'] = os.path.join(mp3_file_path, sdfs_filename)
+    http_packet['size'] = file_attrs.get(sdfs_filename, {}).get('size')
+    http_packet['request_source'] = source
+    http_packet['bandwidth'] = rereplicate_bandwidth
+    http_packet['version'] = file_attrs.get(sdfs_filename, {}).get('version')
+    http_packet['rereplicate'] = True
+    node_load.placed([dest], copy_size(sdfs_filename))
+
+    rereplication_planner.expect(http_packet['task_id'])
+    try:
+        sent = send(http_packet, 'rereplicate', False, [dest])
+        ok = rereplication_planner.wait(http_packet['task_id'], rereplicate_timeout if sent else 0)
+    finally:
+        rereplication_planner.release([dest, source])
+
+    rebalance_packet = dict(http_packet)
+    rebalance_packet['request_type'] = 'rebalance'
+    rebalance_packet['source'] = source
+    rebalance_packet['dest'] = dest
+    rebalance_packet['ok'] = ok
+    # keeps its admission slot until it ran, requests of the users go first
+    rebalance_packet['priority'] = 'rereplication'
+    leader_scheduler.submit(rebalance_packet)
+
+def finish_rebalance(http_packet):
+    """
+        Swap source for dest in the replicas of a file, run while holding the file's write slot
+    """
+    sdfs_filename = http_packet['sdfs_filename']
+    hosts = filelocation_list.get(sdfs_filename)
+    current = hosts is not None and http_packet['source'] in hosts and http_packet['dest'] not in hosts \
+        and http_packet['version'] == file_attrs.get(sdfs_filename, {}).get('version')
+    if http_packet['ok'] and current:
+        print(f"Moved {sdfs_filename} from {http_packet['source']} to {http_packet['dest']}")
+        new_hosts = [http_packet['dest'] if ip == http_packet['source'] else ip for ip in hosts]
+        metadata_log.record(filelocation_list, 'move', sdfs_filename, new_hosts)
+        fresh = fresh_replicas.get(sdfs_filename)
+        if fresh is not None and http_packet['source'] in fresh:
+            fresh.discard(http_packet['source'])
+            fresh.add(http_packet['dest'])
+        send_discard(http_packet['source'], sdfs_filename)
+    elif http_packet['ok']:
+        # the file changed while it was copied, the new copy is stale
+        send_discard(http_packet['dest'], sdfs_filename)
+    admission.release(http_packet['task_id'])
+    leader_scheduler.finish_write(sdfs_filename)
 
 def intro_new_join():
+    """
+        Only the new member gets the file table, as one compact snapshot
+    """
     while True:
-        while len(fail_detector.filelocation_intro_queue) > 0:
+        while len(fail_detector.filelocation_intro_queue) > 0 and election.is_leader():
             domain_name = fail_detector.filelocation_intro_queue.popleft()
+            if domain_name == host_domain_name:
+                continue
+            version, snapshot = metadata_log.snapshot(filelocation_list)
             location_packet = {}
             location_packet['task_id'] = 'newjoin_' + host_domain_name + '_'+str(datetime.datetime.now())  
-            location_packet['request_type'] = 'update'
-            location_packet['payload'] = filelocation_list
-            send(location_packet, 'update', False)
+            location_packet['request_type'] = 'metadata_snapshot'
+            location_packet['leader'] = host_domain_name
+            location_packet['version'] = version
+            location_packet['payload'] = snapshot
+            send(location_packet, 'metadata', False, [domain_name])
+        time.sleep(metadata_pull_interval)
+
+def recover_metadata():
+    """
+        This function rebuilds the leader's file table from the metadata snapshot and wal
+    """
+    with metadata_lock:
+        followed_leader = metadata_leader is not None and metadata_leader != host_domain_name
+        pulled_table = dict(filelocation_list)
+        pulled_attrs = dict(file_attrs)
+
+    version = metadata_log.replay(filelocation_list)
+    logger.info(f"Replayed metadata up to version {version}, {len(filelocation_list)} files")
+
+    # taking over from another leader: the table and attributes pulled from it are newer than
+    # our own log, replay cleared both
+    if followed_leader:
+        filelocation_list.clear()
+        filelocation_list.update(pulled_table)
+        file_attrs.clear()
+        file_attrs.update(pulled_attrs)
+        metadata_log.compact(filelocation_list)
+
+    # local sdfs directory is wiped on start, so replicas that lived here are gone
+    members = set(fail_detector.membership_list)
+    for sdfs_filename in filelocation_list.files_on(host_domain_name):
+        ips = filelocation_list[sdfs_filename]
+        if not is_stored(sdfs_filename):
+            if erasure_of(sdfs_filename) is None:
+                metadata_log.record(filelocation_list, 'move', sdfs_filename, [ip for ip in ips if ip != host_domain_name])
+            rereplication_planner.schedule(sdfs_filename, redundancy_left(sdfs_filename, members - {host_domain_name}))
+
+def leader_request(http_packet):
+    """
+        This function handles one framed request sent to the leader. Requests of one
+        connection are handled in arrival order, so the scheduler sees them in that order.
+    """
+    try:
+        if not (election.is_leader() and leader_ready.is_set()):
+            # only the lease holder acts as leader, clients are sent to the one they should ask
+            if http_packet['request_type'] in timed_requests:
+                redirect_packet = {}
+                redirect_packet['task_id'] = http_packet['task_id']
+                redirect_packet['request_type'] = 'not_leader'
+                redirect_packet['leader'] = election.leader()
+                redirect_packet['request'] = http_packet
+                send_packet(http_packet['request_source'], redirect_packet, file_receiver_port, 'not_leader')
+            if http_packet['request_type'] not in ['put_ack', 'append_ack', 'delete_ack', 'get_ack', 'get_stale', 'version_ack', 'batch_ack', 'rereplicate_ack']:
+                return
+        if http_packet['request_type'] == 'metadata_pull':
+            serve_metadata_pull(http_packet)
+            return
+        logger.info(f"Receive {http_packet['request_type']} from {http_packet['request_source']}")
+        if http_packet['request_type'] == 'rereplicate_ack':
+            rereplication_planner.ack(http_packet['task_id'], http_packet['ok'])
+        elif http_packet['request_type'] in ['put_ack', 'append_ack', 'delete_ack', 'get_ack', 'get_stale', 'version_ack', 'batch_ack']:
+            # acks from different members arrive on different connections
+            with ack_lock:
+                handle_ack(http_packet)
+        elif http_packet['request_type'] in timed_requests:
+            accept_request(http_packet)
+        else:
+            leader_scheduler.submit(http_packet)
+    finally:
+        if 'payload_path' in http_packet:
+            remove_spool_file(http_packet['payload_path'])
 
-def leader_main():
-    global leader_queue
+def accept_request(http_packet, force = False):
+    """
+        Schedule a user request. It stays in open_requests, and so on the standby, until its finish_ack is sent.
+        Over the admission limits the client is told to retry later instead, force skips the limits.
+    """
+    priority = http_packet.get('priority', default_class)
+    retry_after = admission.admit(http_packet['task_id'], http_packet['request_source'], priority, force)
+    if retry_after is not None:
+        metrics.count('leader.rejected.' + priority)
+        retry_packet = {}
+        retry_packet['task_id'] = http_packet['task_id']
+        retry_packet['request_type'] = 'retry_later'
+        retry_packet['retry_after'] = retry_after
+        retry_packet['request'] = http_packet
+        send_packet(http_packet['request_source'], retry_packet, file_receiver_port, 'retry_later')
+        return
+    # latency from leader enqueue to finish_ack
+    metrics.start(('leader', http_packet['task_id']), 'leader.' + http_packet['request_type'])
+    with open_lock:
+        # a copy, dispatching adds leader state to the packet
+        open_requests[http_packet['task_id']] = copy.deepcopy(http_packet)
+        open_changes['opened'].append(open_requests[http_packet['task_id']])
+    if http_packet['request_type'] in batch_requests:
+        submit_batch(http_packet)
+    else:
+        leader_scheduler.submit(http_packet)
 
-    # Keep checking if self is leader
-    while True:
-        if len(fail_detector.membership_list.keys())>1:
-            min_now = min(fail_detector.membership_list.keys())
-            if min_now == host_domain_name:
-                break
-    
-    rereplicate_thread = threading.Thread(target = rereplicate)
-    rereplicate_thread.start()
+def close_request(task_id):
+    admission.release(task_id)
+    with open_lock:
+        if open_requests.pop(task_id, None) is not None:
+            open_changes['closed'].append(task_id)
 
-    intro_new_join_thread = threading.Thread(target = intro_new_join)
-    intro_new_join_thread.start()
+def standby_of(members):
+    """
+        The member next in line for leadership
+    """
+    members = sorted(members)
+    return members[1] if len(members) > 1 else None
 
-    file_sockets['leader'].listen()
+def stream_standby():
+    """
+        Leader: every standby_interval send the standby the changes of the open requests and the
+        metadata entries it has not seen, so it can take over without losing queued or running
+        requests. A new standby first gets all open requests. An empty sync is the heartbeat
+        that tells the standby its copy is current.
+    """
+    standby = None
+    streamed_version = None
     while True:
-        clientsocket, clientip = file_sockets['leader'].accept()
-        query = clientsocket.recv(1024)
-        http_packet = query.decode(msg_format)
-        http_packet = json.loads(http_packet)
-        logger.info(f"Receive {http_packet['request_type']} from {http_packet['request_source']}")
-        leader_queue.append(http_packet)
+        time.sleep(standby_interval)
+        members = list(fail_detector.membership_list.keys())
+        if not election.is_leader():
+            standby = None
+            continue
+        reset = standby_of(members) != standby
+        standby = standby_of(members)
+        if standby is None:
+            continue
+        with open_lock:
+            opened = list(open_requests.values()) if reset else open_changes['opened']
+            closed = [] if reset else open_changes['closed']
+            open_changes['opened'] = []
+            open_changes['closed'] = []
+
+        if reset or streamed_version is None or member_versions.get(standby, -1) > streamed_version:
+            streamed_version = member_versions.get(standby)
+        entries = metadata_log.entries_since(streamed_version, metadata_pull_limit) if streamed_version is not None else None
+        if entries:
+            delta_packet = {}
+            delta_packet['task_id'] = 'standby_' + host_domain_name + '_' + str(datetime.datetime.now())
+            delta_packet['request_type'] = 'metadata_delta'
+            delta_packet['leader'] = host_domain_name
+            delta_packet['version'] = metadata_log.version
+            delta_packet['entries'] = entries
+            if send_packet(standby, delta_packet, file_receiver_port, 'metadata_delta'):
+                streamed_version = entries[-1]['version']
+        elif entries is None:
+            streamed_version = None
+
+        sync_packet = {}
+        sync_packet['task_id'] = 'standby_' + host_domain_name + '_' + str(datetime.datetime.now())
+        sync_packet['request_type'] = 'standby_sync'
+        sync_packet['leader'] = host_domain_name
+        sync_packet['reset'] = reset
+        sync_packet['opened'] = opened
+        sync_packet['closed'] = closed
+        if not send_packet(standby, sync_packet, file_receiver_port, 'standby_sync'):
+            # resend everything once the standby is reachable again
+            standby = None
+
+def standby_sync(http_packet):
+    """
+        Standby: apply the leader's changes to our copy of its open requests
+    """
+    with standby_lock:
+        if http_packet['reset'] or http_packet['leader'] != standby_state['leader']:
+            standby_state['leader'] = http_packet['leader']
+            standby_state['requests'] = OrderedDict()
+        for request in http_packet['opened']:
+            standby_state['requests'][request['task_id']] = request
+        for task_id in http_packet['closed']:
+            standby_state['requests'].pop(task_id, None)
+        standby_state['time'] = time.time()
+
+def resume_requests():
+    """
+        New leader: requests the failed leader had accepted but not acked are scheduled again.
+        Puts, gets and batches are simply run again. Appends carry their offset and the leader
+        records the task_id of the last applied append, so an append is never applied twice.
+    """
+    with standby_lock:
+        fresh = time.time() - standby_state['time'] < standby_stale
+        if standby_state['leader'] in fail_detector.membership_list or not fresh:
+            return
+        requests = list(standby_state['requests'].values())
+        standby_state['requests'] = OrderedDict()
+    print(f"Resuming {len(requests)} requests of failed leader {standby_state['leader']}")
+
+    for http_packet in requests:
+        sdfs_filename = http_packet.get('sdfs_filename')
+        applied = http_packet['request_type'] == 'append' and file_attrs.get(sdfs_filename, {}).get('task_id') == http_packet['task_id']
+        deleted = http_packet['request_type'] == 'delete' and sdfs_filename not in filelocation_list
+        if applied or deleted:
+            ack_packet = {}
+            ack_packet['request_type'] = 'finish_ack'
+            ack_packet['task_id'] = http_packet['task_id']
+            if applied:
+                ack_packet['sdfs_filename'] = sdfs_filename
+                ack_packet['version'] = file_attrs[sdfs_filename]['version']
+                ack_packet['size'] = file_attrs[sdfs_filename]['size']
+            send(ack_packet, 'finish_ack', False, [http_packet['request_source']])
+        else:
+            accept_request(http_packet, force = True)
+
+def leader_main():
+    """
+    Sleeps until the election gives this server the leader lease, then recovers the leader state
+    and runs the leader services. Losing the lease stops them acting, a later lease recovers again.
+    """
+    started = False
+    while True:
+        election.wait_role(True)
+        recover_metadata()
+        # before new requests are accepted, so resumed requests keep their place in the queues
+        resume_requests()
+        leader_ready.set()
+
+        if not started:
+            started = True
+            standby_thread = threading.Thread(target = stream_standby)
+            standby_thread.start()
+
+            rereplication_planner.start()
+            rereplicate_thread = threading.Thread(target = rereplicate)
+            rereplicate_thread.start()
+
+            balance_thread = threading.Thread(target = balance)
+            balance_thread.start()
+
+            intro_new_join_thread = threading.Thread(target = intro_new_join)
+            intro_new_join_thread.start()
+
+        election.wait_role(False)
+        leader_ready.clear()
+
+def leader_server():
+    """
+    Every server listens on the leader port, a server that does not hold the lease redirects clients
+    """
+    AsyncServer(file_sockets['leader'], leader_request, mp3_spool_path, ordered = True, on_error = logger.error).run()
+
+def follow_redirect(http_packet):
+    """
+    Client: the server we asked is not the leader, resend the request to the leader it named
+    """
+    request = http_packet['request']
+    request['redirects'] = request.get('redirects', 0) + 1
+    if request['redirects'] > max_redirects or http_packet['leader'] is None:
+        metrics.stop(('client', request['task_id']))
+        print(f"Task {request['task_id']} failed, no leader found")
+        return
+    if http_packet['leader'] == host_domain_name or request['redirects'] > 1:
+        # an election is running, give it time to finish
+        time.sleep(renew_interval)
+    send_packet(http_packet['leader'], request, file_leader_port, request['request_type'])
+
+def retry_request(http_packet):
+    """
+    Client: the leader is overloaded, send the request again after the time it asked for, doubled
+    with every retry and jittered so rejected clients do not come back all at once
+    """
+    request = http_packet['request']
+    request['retries'] = request.get('retries', 0) + 1
+    if request['retries'] > max_retries:
+        metrics.stop(('client', request['task_id']))
+        print(f"Task {request['task_id']} failed, leader overloaded")
+        return
+    wait = min(max_retry_wait, http_packet['retry_after'] * 2 ** (request['retries'] - 1)) * random.uniform(0.5, 1.5)
+    print(f"Task {request['task_id']} retries in {wait:.1f}s, leader overloaded")
+    # a timer, so the wait does not hold a receiver worker
+    threading.Timer(wait, send, args = (request, request['request_type'], True)).start()
     
 
-def send2Leader(request_type, sdfs_filename, local_filename = None, host_domain_name = host_domain_name):
+def send2Leader(request_type, sdfs_filename, local_filename = None, host_domain_name = host_domain_name, erasure = None, fragment_prefix = None, quorum = None, byte_range = None, priority = default_class):
     """
     This function is to handle user inputs and prepare packet to send to leader.
+    An erasure coded put also names the fragments encoded locally at fragment_prefix.
+    quorum overrides write_quorum (put) or read_quorum (get) for this request.
+    byte_range = (offset, length) makes a get read only those bytes of the file.
+    priority is the admission class, 'job' for requests maple/juice make.
     """
 
     http_packet = {}
@@ -518,22 +2022,124 @@ def send2Leader(request_type, sdfs_filename, local_filename = None, host_domain_
     http_packet['local_filename'] = local_filename
     http_packet['request_type'] = request_type
     http_packet['request_source'] = host_domain_name
+    http_packet['priority'] = priority
+    if request_type in ['put', 'append'] and local_filename is not None and os.path.exists(local_filename):
+        http_packet['size'] = os.path.getsize(local_filename)
+    if erasure is not None:
+        http_packet['erasure'] = erasure
+        http_packet['fragment_prefix'] = fragment_prefix
+    if quorum is not None:
+        http_packet['quorum'] = int(quorum)
+    if byte_range is not None:
+        http_packet['offset'], http_packet['length'] = int(byte_range[0]), int(byte_range[1])
+    if request_type == 'get' and sdfs_filename in filelocation_list:
+        # replicas this server reads fastest from, the leader prefers them among up to date replicas
+        http_packet['preferred'] = peer_stats.rank(filelocation_list[sdfs_filename], file_attrs.get(sdfs_filename, {}).get('size'))
 
     # use socket['result_port] to get result
-    if request_type in ['put', 'get', 'delete', 'maple']:
+    if request_type in ['put', 'append', 'get', 'delete', 'maple']:
+        metrics.start(('client', http_packet['task_id']), 'client.' + request_type)
         send(http_packet, request_type, True)
 
     else:
         print(f"INVALID request_type {request_type}")
+    return http_packet['task_id']
+
+def putErasureCoded(local_filename, sdfs_filename, k = default_k, m = default_m):
+    """
+    Encode a local file into k data and m parity fragments and put them with one request.
+    The leader falls back to full replicas if there are fewer than k+m members.
+    """
+    fragment_prefix = f'{mp3_local_path}/{sdfs_filename}.ec'
+    size = encode_file(local_filename, fragment_prefix, k, m)
+    task_id = send2Leader('put', sdfs_filename, os.path.abspath(local_filename), erasure = {'k': k, 'm': m, 'size': size}, fragment_prefix = fragment_prefix)
+    local_cleanup[task_id] = [fragment_path(fragment_prefix, index) for index in range(k + m)]
+
+def send2LeaderBatch(request_type, files = None, prefix = None, local_dir = None, host_domain_name = host_domain_name, priority = default_class):
+    """
+    Batch put/get/delete in one leader round-trip. files is a list of (local_filename, sdfs_filename)
+    pairs; for get and delete a prefix selects every sdfs file whose name starts with it instead,
+    gets are stored as local_dir/sdfs_filename.
+    """
+    http_packet = {}
+    http_packet['task_id'] = host_domain_name + '_'+str(datetime.datetime.now())
+    http_packet['request_type'] = request_type
+    http_packet['request_source'] = host_domain_name
+    http_packet['priority'] = priority
+    http_packet['files'] = [{'local_filename': local_filename, 'sdfs_filename': sdfs_filename} for local_filename, sdfs_filename in files or []]
+    for item in http_packet['files']:
+        if request_type == 'batch_put' and os.path.exists(item['local_filename']):
+            item['size'] = os.path.getsize(item['local_filename'])
+    if prefix is not None:
+        http_packet['prefix'] = prefix
+        http_packet['local_dir'] = local_dir
+    print(f"Task {http_packet['task_id']} starts! ")
+
+    if request_type in batch_requests:
+        metrics.start(('client', http_packet['task_id']), 'client.' + request_type)
+        send(http_packet, request_type, True)
+    else:
+        print(f"INVALID request_type {request_type}")
 
 def downloadFile (sdfs_file_name):
-    if (sdfs_file_name in filelocation_list):
-        file_location = random.choice(filelocation_list[sdfs_file_name])
-        cmd = f'scp -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null aaghosh2@{file_location}:/home/aaghosh2/MP3_FILE/{sdfs_file_name} /home/aaghosh2/MP3_LOCAL/{sdfs_file_name}'
+    """
+        Download an sdfs file to mp3_local_path. Concurrent downloads of one version on this
+        server share one transfer, the later callers wait for the first to finish.
+    """
+    key = (sdfs_file_name, file_attrs.get(sdfs_file_name, {}).get('version'))
+    with download_lock:
+        done = downloads.get(key)
+        first = done is None
+        if first:
+            done = downloads[key] = threading.Event()
+    if not first:
+        metrics.count('member.joined_downloads')
+        done.wait()
+        return
+    try:
+        fetch_input(sdfs_file_name)
+    finally:
+        with download_lock:
+            del downloads[key]
+        done.set()
+
+def use_inputs(sdfs_file_names):
+    """
+        A juice task needs the downloads of these files, they stay on disk until it released them
+    """
+    with download_lock:
+        for sdfs_file_name in sdfs_file_names:
+            input_users[sdfs_file_name] = input_users.get(sdfs_file_name, 0) + 1
+
+def release_input(sdfs_file_name):
+    """
+        A juice task is done with a downloaded input, the last task that used it removes it
+    """
+    with download_lock:
+        input_users[sdfs_file_name] -= 1
+        if input_users[sdfs_file_name] == 0:
+            del input_users[sdfs_file_name]
+            try:
+                os.remove(f'{mp3_local_path}/{sdfs_file_name}')
+            except OSError:
+                pass
+
+def fetch_input(sdfs_file_name):
+    if (sdfs_file_name in filelocation_list and erasure_of(sdfs_file_name) is not None):
         try:
-            result = subprocess.check_output(cmd, shell=True)
+            fetch_erasure_file(sdfs_file_name, filelocation_list[sdfs_file_name], erasure_of(sdfs_file_name), f'{mp3_local_path}/{sdfs_file_name}')
         except Exception as e:
-            logger.error(f"init local/sdfs dir error: {str(e)}")
+            logger.error(f"Erasure download of {sdfs_file_name} error: {str(e)}")
+    elif (sdfs_file_name in filelocation_list):
+        # fastest replica first, the next ones are tried if it fails
+        members = set(fail_detector.membership_list.keys())
+        replicas = [ip for ip in filelocation_list[sdfs_file_name] if ip in members]
+        for file_location in peer_stats.rank(replicas, file_attrs.get(sdfs_file_name, {}).get('size')):
+            try:
+                fetch_file(file_location, sdfs_file_name, f'{mp3_local_path}/{sdfs_file_name}')
+                return
+            except Exception as e:
+                logger.error(f"Fetch of {sdfs_file_name} from {file_location} error: {str(e)}")
 
 
 def sendMapleRequest(maple_exe, num_maples, intermediate_prefix, sdfs_src_dir):
@@ -554,24 +2160,22 @@ def sendMapleRequest(maple_exe, num_maples, intermediate_prefix, sdfs_src_dir):
     # Maple ID denotes the that this worker
     # is in charge of the (maple_id - 1) * lines_per_worker to the (maple_id * lines_per_worker)
     # number of lines
+    metrics.start(('client', http_packet['task_id']), 'client.maple')
     maple_queue[http_packet['task_id']] = {
         "pending_workers" : list(range(1, num_maples + 1)),
-        "accumulated_results" : "",
+        "accumulated_results" : new_spool_file(),
         "prefix" : intermediate_prefix
     }
     ix = 1
     for target in maple_targets:
         http_packet['maple_id'] = ix
         ix+=1
-        http_packet_bytes = json.dumps(http_packet)
-        http_packet_bytes = http_packet_bytes.encode(msg_format)
-        send_packet(target, http_packet_bytes, file_receiver_port, 'maple')
+        send_packet(target, http_packet, file_receiver_port, 'maple')
 
 # Get all files in the file system that match the prefix
 # and split them into num_juices # of chunks
 def getAllFiles(sdfs_intermediate_prefix, num_juices):
-    files = list(filelocation_list.keys())
-    matching_files = [file for file in files if file.startswith(sdfs_intermediate_prefix)]
+    matching_files = filelocation_list.prefix(sdfs_intermediate_prefix)
     matching_files = np.array_split(matching_files, num_juices)
     matching_files = [list(arr) for arr in matching_files]
     return matching_files
@@ -591,9 +2195,10 @@ def sendJuiceRequest(juice_exe, num_juices, sdfs_intermediate_prefix, sdfs_dest_
         juice_targets = random.sample(members, len(members))
     
     matching_files = getAllFiles(sdfs_intermediate_prefix, num_juices)
+    metrics.start(('client', http_packet['task_id']), 'client.juice')
     juice_queue[http_packet['task_id']] = {
         "pending_workers" : list(range(1, num_juices + 1)),
-        "accumulated_results" : "",
+        "accumulated_results" : new_spool_file(),
         "sdfs_dest_filename" : sdfs_dest_dir,
         "delete_input" : delete_input
     }
@@ -602,10 +2207,8 @@ def sendJuiceRequest(juice_exe, num_juices, sdfs_intermediate_prefix, sdfs_dest_
         http_packet['juice_id'] = ix
         http_packet['files_to_reduce'] = matching_files[ix - 1]
         ix+=1
-        http_packet_bytes = json.dumps(http_packet)
-        http_packet_bytes = http_packet_bytes.encode(msg_format)
         print("Test before sending juice request")
-        send_packet(target, http_packet_bytes, file_receiver_port, 'juice')
+        send_packet(target, http_packet, file_receiver_port, 'juice')
         print("Finish sending juice request")
 
 
@@ -618,7 +2221,7 @@ def handleMapleRequest(http_packet):
     # Download file, and start processing
     downloadFile(map_file)
 
-    with open (f"/home/aaghosh2/MP3_LOCAL/{map_file}", "r") as input_file:
+    with open (f"{mp3_local_path}/{map_file}", "r") as input_file:
         lines = input_file.readlines()
         lines_per_worker = len(lines) // num_maples
         sharded_file = f"sharded_{map_file}"
@@ -629,23 +2232,25 @@ def handleMapleRequest(http_packet):
             shard_file.writelines(lines[start_index : end_index])
 
     command = [maple_exe, f"sharded_{map_file}"]
+    results_path = new_spool_file()
     try:
-        result = subprocess.run(command, check = True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        keys_json = result.stdout.decode()
+        # maple output goes to disk and is streamed back as the payload of the response
+        with open(results_path, 'wb') as results_file:
+            subprocess.run(command, check = True, stdout=results_file, stderr=subprocess.PIPE)
         response_packet = {}
         response_packet['request_type'] = 'maple_response'
-        response_packet['maple_results'] = keys_json
         response_packet['maple_source'] = maple_id
         response_packet['task_id'] = task_id
         # Send results back to leader
         if (machine_id != "01"):
-            response_packet = json.dumps(response_packet)
-            response_packet = response_packet.encode(msg_format)
-            send_packet('fa23-cs425-5601.cs.illinois.edu', response_packet, file_receiver_port, "maple_response")
+            send_packet('fa23-cs425-5601.cs.illinois.edu', response_packet, file_receiver_port, "maple_response", results_path)
         else:
+            response_packet['payload_path'] = results_path
             handleMapleResponse(response_packet)
     except Exception as e:
         logger.error(f"init local/sdfs dir error: {str(e)}")
+    finally:
+        remove_spool_file(results_path)
 
 def handleJuiceRequest(http_packet):
     juice_exe = http_packet['juice_exe']
@@ -653,40 +2258,56 @@ def handleJuiceRequest(http_packet):
     juice_id = int(http_packet['juice_id'])
     num_juices = int(http_packet['num_juices'])
     task_id =  http_packet['task_id']
-    # Download files, and start processing
-    reduce_output = ""
-    for file in reduce_files:
-        downloadFile(file)
-
-        command = [juice_exe, f"/home/aaghosh2/MP3_LOCAL/{file}"]
-        try:
-            result = subprocess.run(command, check = True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            keys_json = result.stdout.decode()
-            reduce_output += keys_json
-        except Exception as e:
-            logger.error(f"init local/sdfs dir error: {str(e)}")
+    # Download files, and start processing; the next files download while the reducer runs
+    # reducer outputs are appended on disk and streamed back as the payload of the response
+    # every input is removed once reduced, so the prefetch budget bounds the disk it takes
+    results_path = new_spool_file()
+    prefetcher = Prefetcher(reduce_files, downloadFile, lambda sdfs_filename: file_attrs.get(sdfs_filename, {}).get('size'))
+    use_inputs(reduce_files)
+    released = 0
+    error = None
+    try:
+        with open(results_path, 'ab') as results_file:
+            for file in prefetcher.start():
+                command = [juice_exe, f"{mp3_local_path}/{file}"]
+                try:
+                    subprocess.run(command, check = True, stdout=results_file, stderr=subprocess.PIPE)
+                finally:
+                    release_input(file)
+                    released += 1
+    except Exception as e:
+        logger.error(f"Juice {juice_id} of {task_id} error: {str(e)}")
+        error = str(e)
     try:
         response_packet = {}
         response_packet['request_type'] = 'juice_response'
-        response_packet['juice_results'] = reduce_output
         response_packet['juice_source'] = juice_id
         response_packet['task_id'] = task_id
+        if error is not None:
+            # the results are incomplete, the job fails instead of writing them
+            response_packet['error'] = error
         # Send results back to leader
         if (machine_id != "01"):
-            response_packet = json.dumps(response_packet)
-            response_packet = response_packet.encode(msg_format)
-            send_packet('fa23-cs425-5601.cs.illinois.edu', response_packet, file_receiver_port, "juice_response")
+            send_packet('fa23-cs425-5601.cs.illinois.edu', response_packet, file_receiver_port, "juice_response", results_path)
             print("Finish handling juice request")
         else:
+            response_packet['payload_path'] = results_path
             handleJuiceResponse(response_packet)
             print("Finish handling juice request")
     except Exception as e:
         logger.error(f"init local/sdfs dir error: {str(e)}")
-
-def separateKeys(data):
-    data = data.split('\n')
+    finally:
+        remove_spool_file(results_path)
+        # inputs a failed task did not reduce, once no download of them is running any more
+        prefetcher.join()
+        for file in reduce_files[released:]:
+            release_input(file)
+
+def separateKeys(results_path):
     key_info = {}
-    for line in data:
+    with open(results_path, 'r') as results_file:
+        lines = [line.rstrip('\n') for line in results_file]
+    for line in lines:
         if (line != ""):
             pair = line.strip("()")
             pair = pair.split(", ")
@@ -698,77 +2319,116 @@ def separateKeys(data):
     return key_info
 
 
+def new_spool_file():
+    fd, path = tempfile.mkstemp(dir = mp3_spool_path)
+    os.close(fd)
+    return path
+
+def remove_spool_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def append_results(results_path, payload_path):
+    """
+        Append a response payload to the accumulated results on disk
+    """
+    with open(payload_path, 'rb') as payload, open(results_path, 'ab') as results:
+        shutil.copyfileobj(payload, results)
+
 def handleMapleResponse(http_packet):
-    maple_results = http_packet['maple_results']
     maple_source = http_packet['maple_source']
     task_id =  http_packet['task_id']
+    # responses of different workers are handled in parallel threads
+    with mapreduce_lock:
+        handle_maple_response(http_packet, maple_source, task_id)
+
+def handle_maple_response(http_packet, maple_source, task_id):
     if (task_id in maple_queue):
         if (maple_source in maple_queue[task_id]["pending_workers"]):
             maple_queue[task_id]["pending_workers"].remove(maple_source)
-            maple_queue[task_id]["accumulated_results"] += maple_results
+            append_results(maple_queue[task_id]["accumulated_results"], http_packet['payload_path'])
         
         # Maple phase done
         if (len(maple_queue[task_id]["pending_workers"]) == 0):
             sdfs_intermediate_prefix = maple_queue[task_id]["prefix"]
             separated_key_data = separateKeys(maple_queue[task_id]["accumulated_results"])
+            intermediate_files = []
             for key in separated_key_data:
                 intermediate_file_name = f"{sdfs_intermediate_prefix}_{key}"
                 with open(f"./maple_files/{intermediate_file_name}", "w") as maple_file:
                     values = separated_key_data[key]
                     for value in values:
                         maple_file.write(f"({key}, {value})\n")
-                send2Leader("put", intermediate_file_name, f"/home/aaghosh2/CS_425/cs_425_mp4/maple_files/{intermediate_file_name}")
+                intermediate_files.append((f"{mp4_path}/maple_files/{intermediate_file_name}", intermediate_file_name))
+            # all intermediate files go to the sdfs in one batch instead of one put per key
+            send2LeaderBatch("batch_put", intermediate_files, priority = 'job')
             
+            remove_spool_file(maple_queue[task_id]["accumulated_results"])
             del maple_queue[task_id]
+            metrics.stop(('client', task_id))
             print("All maple tasks finished.")
 
 def handleJuiceResponse(http_packet):
-    juice_results = http_packet['juice_results']
     juice_source = http_packet['juice_source']
     task_id =  http_packet['task_id']
+    with mapreduce_lock:
+        handle_juice_response(http_packet, juice_source, task_id)
+
+def handle_juice_response(http_packet, juice_source, task_id):
     if (task_id in juice_queue):
         if (juice_source in juice_queue[task_id]["pending_workers"]):
             juice_queue[task_id]["pending_workers"].remove(juice_source)
-            juice_queue[task_id]["accumulated_results"] += juice_results
+            if 'error' in http_packet:
+                juice_queue[task_id].setdefault("errors", []).append(f"juice {juice_source}: {http_packet['error']}")
+            else:
+                append_results(juice_queue[task_id]["accumulated_results"], http_packet['payload_path'])
         
         # Juice phase done
         if (len(juice_queue[task_id]["pending_workers"]) == 0):
             print(juice_queue[task_id])
             sdfs_dest_filename = juice_queue[task_id]["sdfs_dest_filename"]
-            reduce_data = juice_queue[task_id]["accumulated_results"]
-            with open(f"./juice_files/{sdfs_dest_filename}", "w") as juice_file:
-                juice_file.write(reduce_data)
-            send2Leader("put", sdfs_dest_filename, f"/home/aaghosh2/CS_425/cs_425_mp4/juice_files/{sdfs_dest_filename}")
+            if "errors" in juice_queue[task_id]:
+                remove_spool_file(juice_queue[task_id]["accumulated_results"])
+                print(f"Juice task failed, {sdfs_dest_filename} is not written: {juice_queue[task_id]['errors']}")
+            else:
+                shutil.move(juice_queue[task_id]["accumulated_results"], f"./juice_files/{sdfs_dest_filename}")
+                send2Leader("put", sdfs_dest_filename, f"{mp4_path}/juice_files/{sdfs_dest_filename}", priority = 'job')
             
             del juice_queue[task_id]
+            metrics.stop(('client', task_id))
             print("All juice tasks finished.")
 
 def clean_local_sdfs_dir():
     try:
         # init sdfs
-        cmd = 'rm -rf /home/aaghosh2/MP3_FILE'
+        cmd = f'rm -rf {mp3_file_path}'
         result = subprocess.check_output(cmd, shell=True)
         logger.info("successfully remove sdfs directory") 
-        cmd = 'mkdir -p /home/aaghosh2/MP3_FILE'
+        cmd = f'mkdir -p {mp3_file_path}'
         result = subprocess.check_output(cmd, shell=True)
-        cmd = 'rm -rf /home/aaghosh2/CS_425/cs_425_mp4/maple_files'
+        cmd = f'rm -rf {mp4_path}/maple_files'
         result = subprocess.check_output(cmd, shell=True)
         logger.info("successfully remove maple files directory")
-        cmd = 'mkdir -p /home/aaghosh2/CS_425/cs_425_mp4/maple_files'
+        cmd = f'mkdir -p {mp4_path}/maple_files'
         result = subprocess.check_output(cmd, shell=True)
-        cmd = 'rm -rf /home/aaghosh2/CS_425/cs_425_mp4/juice_files'
+        cmd = f'rm -rf {mp4_path}/juice_files'
         result = subprocess.check_output(cmd, shell=True)
         logger.info("successfully remove juice files directory")
-        cmd = 'mkdir -p /home/aaghosh2/CS_425/cs_425_mp4/juice_files'
+        cmd = f'mkdir -p {mp4_path}/juice_files'
         result = subprocess.check_output(cmd, shell=True)
         logger.info("successfully create sdfs directory")
         # init local to get files from sdfs
-        cmd = 'rm -rf /home/aaghosh2/MP3_LOCAL'
+        cmd = f'rm -rf {mp3_local_path}'
         result = subprocess.check_output(cmd, shell=True)
         logger.info("successfully remove local directory")
-        cmd = 'mkdir -p /home/aaghosh2/MP3_LOCAL'
+        cmd = f'mkdir -p {mp3_local_path}'
         result = subprocess.check_output(cmd, shell=True)
         logger.info("successfully create local directory")
+        # payload spool for framed messages
+        cmd = f'rm -rf {mp3_spool_path}; mkdir -p {mp3_spool_path}'
+        result = subprocess.check_output(cmd, shell=True)
     except Exception as e:
         logger.error(f"init local/sdfs dir error: {str(e)}")
     
@@ -778,50 +2438,110 @@ if __name__ == "__main__":
     clean_local_sdfs_dir()
 
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)         
-    hostip = socket.gethostname() 
+    # a restarted server binds again while connections of the old one are in TIME_WAIT
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    hostip = node_host(host_domain_name)
     hostport = file_receiver_port               
 
     sock.bind((hostip, hostport))
     file_sockets['reciever'] = sock
 
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)         
-    hostip = socket.gethostname() 
+    # a restarted server binds again while connections of the old one are in TIME_WAIT
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    hostip = node_host(host_domain_name)
     hostport = file_leader_port               
 
     sock.bind((hostip, hostport))
     file_sockets['leader'] = sock
 
-    server_thread = threading.Thread(target=fail_detector.start_gossiping)
-    server_thread.start()
+    if len(static_members) > 0:
+        # fixed membership, no failure detection
+        for member in static_members:
+            fail_detector.membership_list[member] = {'heartbeat': 0, 'status': 'Join', 'timestamp': time.time()}
+        election.notify()
+    else:
+        server_thread = threading.Thread(target=fail_detector.start_gossiping)
+        server_thread.start()
+
+    election_thread = threading.Thread(target=election.run)
+    election_thread.start()
 
     leader_thread = threading.Thread(target=leader_main)
     leader_thread.start()
 
+    leader_server_thread = threading.Thread(target=leader_server)
+    leader_server_thread.start()
+
     listening_thread = threading.Thread(target = receiver)
     listening_thread.start()
 
-    leader_function_thread = threading.Thread(target=send2Member)
+    leader_function_thread = threading.Thread(target=leader_scheduler.run)
     leader_function_thread.start()
 
+    metadata_pull_thread = threading.Thread(target=pull_metadata)
+    metadata_pull_thread.start()
+
+    probe_thread = threading.Thread(target=probe_peers)
+    probe_thread.start()
+
+    metrics_thread = threading.Thread(target=metrics.serve, kwargs={'port': metrics_port})
+    metrics_thread.start()
+
+    compaction_thread = threading.Thread(target=compact_segments)
+    compaction_thread.start()
+
 
     while True:
-        user_input = input("Please Enter message for SDFS: ")
+        try:
+            user_input = input("Please Enter message for SDFS: ")
+        except EOFError:
+            # no terminal (e.g. started by benchmark.py), keep serving
+            threading.Event().wait()
         request_type = user_input.split(' ')[0]
         # SPECIFY LEADER TO MINIMUM ID
         try: 
             
-            if request_type.lower() == "put": # host start to leave the gossiping group
+            if request_type.lower() == "put": # put {local_filename} {sdfs_filename} [write quorum]
+                local_filename, sdfs_filename = user_input.split(' ')[1], user_input.split(' ')[2]
+                quorum = user_input.split(' ')[3] if len(user_input.split(' ')) > 3 else None
+                send2Leader(request_type, sdfs_filename, local_filename, quorum = quorum)
+
+            elif request_type.lower() == 'append': # append {local_filename} {sdfs_filename}, only the new bytes are in local_filename
                 local_filename, sdfs_filename = user_input.split(' ')[1], user_input.split(' ')[2]
-                send2Leader(request_type, sdfs_filename, local_filename)
+                send2Leader('append', sdfs_filename, os.path.abspath(local_filename))
 
-            elif request_type.lower() == 'get':
+            elif request_type.lower() == 'get': # get {sdfs_filename} {local_filename} [read quorum]
                 local_filename, sdfs_filename = user_input.split(' ')[2], user_input.split(' ')[1]
-                send2Leader(request_type, sdfs_filename, local_filename)
+                quorum = user_input.split(' ')[3] if len(user_input.split(' ')) > 3 else None
+                send2Leader(request_type, sdfs_filename, local_filename, quorum = quorum)
             
+            elif request_type.lower() == 'getrange': # getrange {sdfs_filename} {local_filename} {offset} {length}
+                sdfs_filename, local_filename, offset, length = user_input.split(' ')[1:5]
+                send2Leader('get', sdfs_filename, local_filename, byte_range = (offset, length))
+
             elif request_type.lower() == 'delete':
                 sdfs_filename = user_input.split(' ')[1]
                 send2Leader(request_type, sdfs_filename)
 
+            elif request_type.lower() == 'putec': # putec {local_filename} {sdfs_filename} [k] [m]
+                args = user_input.split(' ')
+                local_filename, sdfs_filename = args[1], args[2]
+                k, m = (int(args[3]), int(args[4])) if len(args) > 4 else (default_k, default_m)
+                putErasureCoded(local_filename, sdfs_filename, k, m)
+
+            elif request_type.lower() == 'batchput': # batchput {local_dir} {name_prefix}
+                local_dir, prefix = user_input.split(' ')[1], user_input.split(' ')[2]
+                files = [(os.path.abspath(os.path.join(local_dir, filename)), filename) for filename in sorted(os.listdir(local_dir)) if filename.startswith(prefix)]
+                send2LeaderBatch('batch_put', files)
+
+            elif request_type.lower() == 'batchget': # batchget {sdfs_prefix} {local_dir}
+                prefix, local_dir = user_input.split(' ')[1], user_input.split(' ')[2]
+                send2LeaderBatch('batch_get', prefix = prefix, local_dir = os.path.abspath(local_dir))
+
+            elif request_type.lower() == 'batchdelete': # batchdelete {sdfs_prefix}
+                send2LeaderBatch('batch_delete', prefix = user_input.split(' ')[1])
+
             elif request_type.lower() == 'maple':
                 maple_exe, num_maples, sdfs_intermediate_prefix, sdfs_src_dir = user_input.split(' ')[1], user_input.split(' ')[2], user_input.split(' ')[3], user_input.split(' ')[4]
                 sendMapleRequest(maple_exe, num_maples, sdfs_intermediate_prefix, sdfs_src_dir)
@@ -835,19 +2555,29 @@ if __name__ == "__main__":
                 sdfs_filename = user_input.split(' ')[1]
                 try:
                     print(f"Machines that store {str(sdfs_filename)} is : {str(filelocation_list[sdfs_filename])}")
+                    if sdfs_filename in file_attrs:
+                        print(f"Version {file_attrs[sdfs_filename].get('version')}, {file_attrs[sdfs_filename].get('size')} bytes")
+                    if erasure_of(sdfs_filename) is not None:
+                        print(f"Erasure coded {erasure_of(sdfs_filename)['k']}+{erasure_of(sdfs_filename)['m']}, machine i stores fragment i")
                 except:
                     print(f"Machines that store {str(sdfs_filename)} is : None")
             
+            elif user_input.lower() == 'stats':
+                print(json.dumps(metrics.snapshot(), indent = 2))
+
             elif user_input.lower() == 'store':
-                files = []
-                for k, v in filelocation_list.items():
-                    if host_domain_name in v:
-                        files.append(k)
+                files = filelocation_list.files_on(host_domain_name)
                 print(f"Files store on {machine_id} is {str(files)}")
+
+            elif request_type.lower() == 'lsprefix': # lsprefix {sdfs_prefix}
+                print(f"Files starting with {user_input.split(' ')[1]}: {str(filelocation_list.prefix(user_input.split(' ')[1]))}")
+
+            elif request_type.lower() == 'lsrange': # lsrange {first_name} {end_name}, end_name excluded
+                print(f"Files in range: {str(filelocation_list.range(user_input.split(' ')[1], user_input.split(' ')[2]))}")
             
             elif request_type.lower() == 'multiread': # multiread sdfs_filename 2 7
                 sdfs_filename, m = user_input.split(' ')[1], user_input.split(' ')[2]
-                local_filename = f'/home/aaghosh2/MP3_LOCAL/{sdfs_filename}'
+                local_filename = f'{mp3_local_path}/{sdfs_filename}'
                 mems = list(fail_detector.membership_list.keys())
                 random_vms = random.sample(mems, k = int(m))
                 print(f"Target VMS: {str(random_vms)}")
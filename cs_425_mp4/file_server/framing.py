@@ -0,0 +1,101 @@
+import os
+import time
+import json
+import struct
+import shutil
+import tempfile
+
+#########hard code area
+msg_format = 'utf-8'
+frame_header = struct.Struct('!IQ')  # [4 byte json length][8 byte payload length][json][payload]
+max_json_length = 64 << 20           # anything bigger than this is a corrupted stream
+chunk_size = 1 << 16
+#########
+
+
+def recv_exact(sock, size):
+    """
+        Read exactly size bytes, None if the peer closed the connection first
+    """
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, chunk_size))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def send_message(sock, http_packet, payload = None):
+    """
+        Send one framed message. payload is optional raw data attached to the json packet:
+        bytes, the path of a file, or (path, offset, length) for a byte range of a file. Files
+        go from the page cache to the socket with sendfile, without a copy through python.
+    """
+    body = json.dumps(http_packet).encode(msg_format)
+    if payload is None:
+        sock.sendall(frame_header.pack(len(body), 0) + body)
+    elif isinstance(payload, (bytes, bytearray)):
+        sock.sendall(frame_header.pack(len(body), len(payload)) + body)
+        sock.sendall(payload)
+    else:
+        path, offset, length = payload if isinstance(payload, tuple) else (payload, 0, None)
+        with open(path, 'rb') as fd:
+            size = os.fstat(fd.fileno()).st_size
+            offset = min(offset, size)
+            length = size - offset if length is None else min(length, size - offset)
+            sock.sendall(frame_header.pack(len(body), length) + body)
+            if length > 0:
+                sock.sendfile(fd, offset, length)
+
+
+def recv_message(sock, spool_dir):
+    """
+        Read exactly one framed message of any size. The json part is returned as a dict,
+        an attached payload is streamed into a file under spool_dir whose path is stored in
+        http_packet['payload_path'], the caller removes it once handled.
+        Returns None when the connection is closed.
+    """
+    header = recv_exact(sock, frame_header.size)
+    if header is None:
+        return None
+    json_length, payload_length = frame_header.unpack(header)
+    if json_length > max_json_length:
+        raise ValueError(f"frame json length {json_length} too large")
+
+    body = recv_exact(sock, json_length)
+    if body is None:
+        return None
+    http_packet = json.loads(body.decode(msg_format))
+
+    if payload_length > 0:
+        fd, path = tempfile.mkstemp(dir = spool_dir, prefix = 'payload_')
+        start = time.time()
+        try:
+            with os.fdopen(fd, 'wb') as spool:
+                remaining = payload_length
+                while remaining > 0:
+                    chunk = sock.recv(min(remaining, chunk_size))
+                    if not chunk:
+                        raise ConnectionError("connection closed in the middle of a payload")
+                    spool.write(chunk)
+                    remaining -= len(chunk)
+        except BaseException:
+            os.remove(path)
+            raise
+        http_packet['payload_path'] = path
+        # receiving side throughput of the payload, e.g. for peer_stats
+        http_packet['payload_bytes'] = payload_length
+        http_packet['payload_seconds'] = time.time() - start
+    return http_packet
+
+
+def store_payload(http_packet, path):
+    """
+        Move the spooled payload of a frame to path, an empty payload makes an empty file
+    """
+    if 'payload_path' in http_packet:
+        shutil.move(http_packet.pop('payload_path'), path)
+    else:
+        open(path, 'wb').close()
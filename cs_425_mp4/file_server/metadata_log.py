@@ -0,0 +1,174 @@
+import os
+import json
+import threading
+import itertools
+from collections import deque
+
+#########hard code area
+wal_filename = 'metadata.wal'
+snapshot_filename = 'metadata.snapshot'
+snapshot_interval = 50000   # number of wal records between two snapshots
+tail_size = 100000          # recent records kept in memory to answer member pulls
+#########
+
+
+def apply_entry(table, entry, attrs = None):
+    """
+        This function applies one metadata record to a file location table.
+        attrs keeps per-file attributes (version, size, erasure code), a put or
+        append replaces them and a replica move leaves them as they are.
+    """
+    op = entry['op']
+    sdfs_filename = entry['sdfs_filename']
+    if op in ['put', 'append', 'move']:
+        table[sdfs_filename] = list(entry['replicas'])
+    elif op == 'delete':
+        table.pop(sdfs_filename, None)
+
+    if attrs is not None and op != 'move':
+        if 'attrs' in entry:
+            attrs[sdfs_filename] = entry['attrs']
+        else:
+            attrs.pop(sdfs_filename, None)
+
+
+def encode_snapshot(table, attrs = None):
+    """
+        Compact bulk form of a file table, replica host names are stored once and
+        referenced by index: {'hosts': [host, ...], 'files': {sdfs_filename: [host_index, ...]}, 'attrs': {...}}
+    """
+    hosts = {}
+    files = {}
+    for sdfs_filename, ips in table.items():
+        files[sdfs_filename] = [hosts.setdefault(ip, len(hosts)) for ip in ips]
+    return {'hosts': sorted(hosts, key = hosts.get), 'files': files, 'attrs': dict(attrs or {})}
+
+
+def decode_snapshot(snapshot):
+    hosts = snapshot['hosts']
+    return {sdfs_filename: [hosts[ix] for ix in ixs] for sdfs_filename, ixs in snapshot['files'].items()}
+
+
+class MetadataLog():
+    """
+        Write-ahead log of the leader's file metadata (put, delete, replica moves).
+        Every change gets a monotonically increasing version, is applied to the table
+        and appended to the wal under one lock. Every snapshot_interval records the
+        whole table is written to a snapshot and the wal is truncated. The most recent
+        records stay in memory so members can pull only what they have not seen yet.
+    """
+
+    def __init__(self, log_dir, attrs = None, snapshot_interval = snapshot_interval, fsync = False):
+        self.log_dir = log_dir
+        self.attrs = attrs if attrs is not None else {}   # per-file attributes kept next to the table
+        self.wal_path = os.path.join(log_dir, wal_filename)
+        self.snapshot_path = os.path.join(log_dir, snapshot_filename)
+        self.snapshot_interval = snapshot_interval
+        self.fsync = fsync
+        self.lock = threading.RLock()
+        self.version = 0
+        self.records_since_snapshot = 0
+        self.wal_fd = None
+        self.tail = deque(maxlen = tail_size)
+
+    def replay(self, table):
+        """
+            Load the last snapshot and the wal records after it into table.
+            Returns the version of the last applied record.
+        """
+        with self.lock:
+            os.makedirs(self.log_dir, exist_ok = True)
+            table.clear()
+            self.attrs.clear()
+            self.tail.clear()
+            self.version = 0
+            if os.path.exists(self.snapshot_path):
+                with open(self.snapshot_path, 'r') as fd:
+                    snapshot = json.load(fd)
+                table.update(snapshot['files'])
+                self.attrs.update(snapshot.get('attrs', {}))
+                self.version = snapshot['version']
+
+            self.records_since_snapshot = 0
+            if os.path.exists(self.wal_path):
+                with open(self.wal_path, 'r') as fd:
+                    for line in fd:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            # torn record from a crash in the middle of a write
+                            break
+                        if entry['version'] <= self.version:
+                            continue
+                        apply_entry(table, entry, self.attrs)
+                        self.tail.append(entry)
+                        self.version = entry['version']
+                        self.records_since_snapshot += 1
+
+            if self.wal_fd is not None:
+                # replayed again when this server becomes leader again
+                self.wal_fd.close()
+            self.wal_fd = open(self.wal_path, 'a')
+            return self.version
+
+    def record(self, table, op, sdfs_filename, replicas = None, attrs = None):
+        """
+            Apply one change to table and append it to the wal
+        """
+        with self.lock:
+            self.version += 1
+            entry = {'version': self.version, 'op': op, 'sdfs_filename': sdfs_filename}
+            if replicas is not None:
+                entry['replicas'] = list(replicas)
+            if attrs is not None:
+                entry['attrs'] = attrs
+            apply_entry(table, entry, self.attrs)
+            self.tail.append(entry)
+
+            if self.wal_fd is not None:
+                self.wal_fd.write(json.dumps(entry) + '\n')
+                self.wal_fd.flush()
+                if self.fsync:
+                    os.fsync(self.wal_fd.fileno())
+                self.records_since_snapshot += 1
+                if self.records_since_snapshot >= self.snapshot_interval:
+                    self.compact(table)
+            return entry
+
+    def compact(self, table):
+        """
+            Write the whole table into a new snapshot and truncate the wal
+        """
+        with self.lock:
+            tmp_path = self.snapshot_path + '.tmp'
+            with open(tmp_path, 'w') as fd:
+                json.dump({'version': self.version, 'files': table, 'attrs': self.attrs}, fd)
+                fd.flush()
+                os.fsync(fd.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+
+            if self.wal_fd is not None:
+                self.wal_fd.close()
+            self.wal_fd = open(self.wal_path, 'w')
+            self.records_since_snapshot = 0
+
+    def entries_since(self, version, limit = None):
+        """
+            Records after version, in order. Returns None when they are no longer
+            kept in memory and the caller has to fall back to a snapshot.
+        """
+        with self.lock:
+            if version == self.version:
+                return []
+            if version > self.version or len(self.tail) == 0 or self.tail[0]['version'] > version + 1:
+                return None
+            start = version + 1 - self.tail[0]['version']
+            stop = None if limit is None else start + limit
+            return list(itertools.islice(self.tail, start, stop))
+
+    def snapshot(self, table):
+        """
+            Consistent (version, compact snapshot) pair of table
+        """
+        with self.lock:
+            return self.version, encode_snapshot(table, self.attrs)
@@ -0,0 +1,136 @@
+import json
+import time
+import bisect
+import threading
+from collections import defaultdict
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+#########hard code area
+metrics_host = '127.0.0.1'      # the stats endpoint is local only
+metrics_port = 5010
+max_running = 10000             # timed operations kept, the oldest are dropped if they never finish
+latency_buckets = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 300]   # seconds
+#########
+
+
+class Histogram():
+    """
+        Fixed bucket histogram, counts[i] holds samples <= buckets[i], the last count the rest.
+        Percentiles are the upper bound of the bucket they fall in.
+    """
+
+    def __init__(self, buckets = latency_buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+        return self.max
+
+    def summary(self):
+        return {'count': self.count, 'mean': self.sum / self.count if self.count else None, 'max': self.max,
+                'p50': self.percentile(0.5), 'p90': self.percentile(0.9), 'p99': self.percentile(0.99)}
+
+
+class Metrics():
+    """
+        Registry of counters, histograms and gauges (callables read when a snapshot is taken)
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = defaultdict(int)
+        self.histograms = {}
+        self.gauges = {}
+        self.timers = {}                # key: (histogram name, start time) of a running operation
+
+    def count(self, name, value = 1):
+        with self.lock:
+            self.counters[name] += value
+
+    def observe(self, name, value):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(value)
+
+    def gauge(self, name, read):
+        self.gauges[name] = read
+
+    def start(self, key, name):
+        """
+            Start timing an operation that finishes somewhere else, see stop
+        """
+        with self.lock:
+            self.timers[key] = (name, time.time())
+            if len(self.timers) > max_running:
+                del self.timers[next(iter(self.timers))]
+
+    def stop(self, key):
+        """
+            Observe the latency of an operation started with start, if it was
+        """
+        with self.lock:
+            timer = self.timers.pop(key, None)
+        if timer is not None:
+            self.observe(timer[0], time.time() - timer[1])
+            self.count(timer[0] + '.count')
+
+    def snapshot(self):
+        with self.lock:
+            snapshot = {'uptime': time.time() - self.started,
+                        'counters': dict(self.counters),
+                        'histograms': {name: histogram.summary() for name, histogram in self.histograms.items()},
+                        'running': len(self.timers)}
+        gauges = {}
+        for name, read in list(self.gauges.items()):
+            try:
+                gauges[name] = read()
+            except Exception as e:
+                gauges[name] = str(e)
+        snapshot['gauges'] = gauges
+        return snapshot
+
+    def serve(self, host = metrics_host, port = metrics_port):
+        """
+            GET / (or /metrics) on host:port returns the snapshot as json
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ['/', '/metrics']:
+                    self.send_error(404)
+                    return
+                body = json.dumps(metrics.snapshot(), indent = 2).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        Server((host, port), Handler).serve_forever()
@@ -0,0 +1,170 @@
+import os
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+#########hard code area
+pack_threshold = 64 << 10       # files up to this size are packed into segments instead of getting their own file
+segment_size = 64 << 20         # a segment is sealed once it holds this many bytes, new files go to a new one
+compact_ratio = 0.5             # share of deleted bytes that makes a sealed segment worth compacting
+compact_interval = 30           # seconds between two compaction passes
+#########
+
+
+class PackStore():
+    """
+        Small sdfs files of this server packed into append-only segment files, so a maple job's
+        thousands of {prefix}_{key} files cost a few inodes instead of one each. The index maps
+        sdfs_filename -> (segment, offset, length). A put appends the file to the active segment,
+        an overwrite or delete only drops the index entry and counts its bytes as dead, and
+        compaction copies the live entries of mostly dead sealed segments into the active one and
+        removes them. A segment that is being read is removed when its last reader is done.
+        The index lives in memory like replica_versions: the sdfs directory is wiped on start.
+    """
+
+    def __init__(self, root, threshold = pack_threshold, segment_size = segment_size):
+        self.root = root
+        self.threshold = threshold
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+        self.index = {}                 # sdfs_filename: (segment, offset, length)
+        self.segments = {}              # segment: {'size', 'dead'}
+        self.readers = Counter()        # segment: reads in progress
+        self.retired = set()            # compacted segments removed once their readers are done
+        self.active = None
+        self.next_segment = 0
+
+    def fits(self, size):
+        return size is not None and size <= self.threshold
+
+    def segment_path(self, segment):
+        return os.path.join(self.root, f'segment_{segment:06d}')
+
+    def __contains__(self, sdfs_filename):
+        return sdfs_filename in self.index
+
+    def _append(self, data):
+        # caller holds self.lock
+        if self.active is None or self.segments[self.active]['size'] + len(data) > self.segment_size:
+            os.makedirs(self.root, exist_ok = True)
+            self.active = self.next_segment
+            self.next_segment += 1
+            self.segments[self.active] = {'size': 0, 'dead': 0}
+        offset = self.segments[self.active]['size']
+        with open(self.segment_path(self.active), 'ab') as fd:
+            fd.write(data)
+        self.segments[self.active]['size'] += len(data)
+        return self.active, offset
+
+    def _drop(self, sdfs_filename):
+        # caller holds self.lock
+        entry = self.index.pop(sdfs_filename, None)
+        if entry is not None:
+            self.segments[entry[0]]['dead'] += entry[2]
+        return entry is not None
+
+    def put(self, sdfs_filename, path):
+        """
+            Pack the file at path as sdfs_filename, replacing an earlier packed version
+        """
+        with open(path, 'rb') as fd:
+            data = fd.read()
+        with self.lock:
+            self._drop(sdfs_filename)
+            segment, offset = self._append(data)
+            self.index[sdfs_filename] = (segment, offset, len(data))
+
+    def delete(self, sdfs_filename):
+        """
+            Drop sdfs_filename, False if it is not packed here
+        """
+        with self.lock:
+            return self._drop(sdfs_filename)
+
+    @contextmanager
+    def reading(self, sdfs_filename):
+        """
+            (segment path, offset, length) of a packed file, or None. The segment stays on disk
+            until the block exits, even if compaction moves the file meanwhile.
+        """
+        with self.lock:
+            entry = self.index.get(sdfs_filename)
+            if entry is not None:
+                self.readers[entry[0]] += 1
+        if entry is None:
+            yield None
+            return
+        try:
+            yield self.segment_path(entry[0]), entry[1], entry[2]
+        finally:
+            with self.lock:
+                self.readers[entry[0]] -= 1
+                if self.readers[entry[0]] == 0:
+                    del self.readers[entry[0]]
+                    if entry[0] in self.retired:
+                        self._remove_segment(entry[0])
+
+    def read(self, sdfs_filename):
+        with self.reading(sdfs_filename) as entry:
+            if entry is None:
+                return None
+            path, offset, length = entry
+            with open(path, 'rb') as fd:
+                fd.seek(offset)
+                return fd.read(length)
+
+    def extract(self, sdfs_filename, dest):
+        """
+            Write a packed file out to dest as a file of its own, False if it is not packed here
+        """
+        data = self.read(sdfs_filename)
+        if data is None:
+            return False
+        with open(dest, 'wb') as fd:
+            fd.write(data)
+        return True
+
+    def _remove_segment(self, segment):
+        # caller holds self.lock
+        self.retired.discard(segment)
+        try:
+            os.remove(self.segment_path(segment))
+        except OSError:
+            pass
+
+    def compact(self, ratio = compact_ratio):
+        """
+            Rewrite sealed segments with at least ratio dead bytes, returns the bytes reclaimed
+        """
+        with self.lock:
+            victims = [segment for segment, info in self.segments.items()
+                       if segment != self.active and info['size'] > 0 and info['dead'] >= ratio * info['size']]
+        reclaimed = 0
+        for segment in victims:
+            with self.lock:
+                live = [(sdfs_filename, entry) for sdfs_filename, entry in self.index.items() if entry[0] == segment]
+            for sdfs_filename, entry in live:
+                with open(self.segment_path(segment), 'rb') as fd:
+                    fd.seek(entry[1])
+                    data = fd.read(entry[2])
+                with self.lock:
+                    if self.index.get(sdfs_filename) != entry:
+                        # overwritten or deleted while we read it
+                        continue
+                    new_segment, offset = self._append(data)
+                    self.index[sdfs_filename] = (new_segment, offset, entry[2])
+            with self.lock:
+                if any(entry[0] == segment for entry in self.index.values()):
+                    continue
+                reclaimed += self.segments.pop(segment)['dead']
+                if self.readers[segment] > 0:
+                    self.retired.add(segment)
+                else:
+                    self._remove_segment(segment)
+        return reclaimed
+
+    def stats(self):
+        with self.lock:
+            return {'files': len(self.index), 'segments': len(self.segments),
+                    'bytes': sum(info['size'] for info in self.segments.values()),
+                    'dead_bytes': sum(info['dead'] for info in self.segments.values())}
@@ -0,0 +1,77 @@
+import time
+import random
+import socket
+import threading
+
+#########hard code area
+ewma_alpha = 0.3                # weight of a new sample in the moving averages
+probe_rate = 0.1                # share of reads sent to a random other replica to keep its estimates current
+probe_interval = 2              # seconds between two rtt probes of a random peer
+min_sample_bytes = 64 << 10     # smaller transfers are dominated by setup time and do not update throughput
+default_rtt = 0.001             # seconds, assumed for peers never measured so they get tried
+default_throughput = 100 << 20  # bytes/s, assumed for peers never measured
+#########
+
+
+class PeerStats():
+    """
+        Moving averages (EWMA) of the round trip time and transfer throughput to every peer.
+        rtt samples come from timed TCP connects to the peer, throughput samples from the
+        scp transfers this server makes. The expected time to read n bytes from a peer is
+        rtt + n / throughput; peers never measured look fast so they are tried early.
+    """
+
+    def __init__(self, alpha = ewma_alpha, probe_rate = probe_rate):
+        self.lock = threading.Lock()
+        self.alpha = alpha
+        self.probe_rate = probe_rate
+        self.rtts = {}              # peer: seconds
+        self.throughputs = {}       # peer: bytes/s
+
+    def _average(self, table, peer, sample):
+        # caller holds self.lock
+        old = table.get(peer)
+        table[peer] = sample if old is None else (1 - self.alpha) * old + self.alpha * sample
+
+    def record_rtt(self, peer, seconds):
+        with self.lock:
+            self._average(self.rtts, peer, seconds)
+
+    def record_transfer(self, peer, nbytes, seconds):
+        """
+            One finished transfer of nbytes to or from peer that took seconds
+        """
+        if nbytes < min_sample_bytes or seconds <= 0:
+            return
+        with self.lock:
+            self._average(self.throughputs, peer, nbytes / seconds)
+
+    def expected_time(self, peer, nbytes = 0):
+        with self.lock:
+            return self.rtts.get(peer, default_rtt) + (nbytes or 0) / self.throughputs.get(peer, default_throughput)
+
+    def rank(self, peers, nbytes = 0):
+        """
+            Peers best first. With probability probe_rate a random other peer is moved to
+            the front, so slow or unmeasured peers are sampled again now and then.
+        """
+        ranked = sorted(peers, key = lambda peer: (self.expected_time(peer, nbytes), random.random()))
+        if len(ranked) > 1 and random.random() < self.probe_rate:
+            probe = ranked.pop(random.randrange(1, len(ranked)))
+            ranked.insert(0, probe)
+        return ranked
+
+    def probe(self, peer, address, timeout = 1):
+        """
+            Time a TCP connect to peer at address (host, port), a lost probe counts as timeout seconds
+        """
+        start = time.time()
+        try:
+            socket.create_connection(address, timeout = timeout).close()
+            self.record_rtt(peer, time.time() - start)
+        except OSError:
+            self.record_rtt(peer, timeout)
+
+    def snapshot(self):
+        with self.lock:
+            return {peer: {'rtt': self.rtts.get(peer), 'throughput': self.throughputs.get(peer)} for peer in set(self.rtts) | set(self.throughputs)}
@@ -0,0 +1,101 @@
+import time
+import random
+import threading
+from collections import Counter
+
+#########hard code area
+report_ttl = 5                  # seconds a member's load report is trusted, older reports count as unknown
+min_free_bytes = 256 << 20      # free disk a member keeps after a new copy, members below it get no new copies
+transfer_weight = 0.05          # utilization one running transfer is worth when members are compared
+overfull_margin = 0.15          # utilization above the member average that makes a member overfull
+#########
+
+
+class NodeLoad():
+    """
+        Leader side view of member load. Members report free disk, bytes stored in sdfs and
+        running transfers with every metadata pull. Copies the leader placed since a member's
+        last report are added on top, so a burst of puts does not all pick the same member.
+        score = (stored bytes / (stored + free bytes)) + transfer_weight * transfers
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reports = {}               # member: {'free', 'stored', 'transfers', 'time'}
+        self.pending_bytes = Counter()  # member: bytes placed on it since its last report
+        self.pending_transfers = Counter()
+
+    def update(self, host, report):
+        with self.lock:
+            report = dict(report)
+            report['time'] = time.time()
+            self.reports[host] = report
+            self.pending_bytes.pop(host, None)
+            self.pending_transfers.pop(host, None)
+
+    def placed(self, hosts, size):
+        """
+            Count a new copy of size bytes on every host until the next report of that host
+        """
+        with self.lock:
+            for host in hosts:
+                self.pending_bytes[host] += size or 0
+                self.pending_transfers[host] += 1
+
+    def _report(self, host):
+        # caller holds self.lock
+        report = self.reports.get(host)
+        if report is None or time.time() - report['time'] > report_ttl:
+            return None
+        return report
+
+    def _utilization(self, host):
+        report = self._report(host)
+        if report is None:
+            return 0.0
+        stored = report['stored'] + self.pending_bytes[host]
+        return stored / max(1, report['stored'] + report['free'])
+
+    def _score(self, host):
+        report = self._report(host)
+        transfers = (report['transfers'] if report is not None else 0) + self.pending_transfers[host]
+        return self._utilization(host) + transfer_weight * transfers
+
+    def _fits(self, host, size):
+        report = self._report(host)
+        if report is None:
+            return True
+        return report['free'] - self.pending_bytes[host] - (size or 0) >= min_free_bytes
+
+    def eligible(self, hosts, size = 0):
+        """
+            Hosts with room for size more bytes, least loaded first
+        """
+        with self.lock:
+            fitting = [host for host in hosts if self._fits(host, size)]
+            return sorted(fitting, key = lambda host: (self._score(host), random.random()))
+
+    def choose(self, hosts, count, size = 0):
+        """
+            The count least loaded hosts with room for a copy of size bytes. Hosts that are
+            full are only used when there are not enough others, so a put still gets placed.
+        """
+        chosen = self.eligible(hosts, size)[:count]
+        if len(chosen) < count:
+            with self.lock:
+                rest = sorted([host for host in hosts if host not in chosen], key = lambda host: (self._score(host), random.random()))
+            chosen += rest[:count - len(chosen)]
+        self.placed(chosen, size)
+        return chosen
+
+    def overfull(self, hosts):
+        """
+            Hosts whose disk utilization is overfull_margin above the average, most full first
+        """
+        with self.lock:
+            known = [host for host in hosts if self._report(host) is not None]
+            if len(known) < 2:
+                return []
+            average = sum(self._utilization(host) for host in known) / len(known)
+            full = [host for host in known if self._utilization(host) > average + overfull_margin]
+            return sorted(full, key = self._utilization, reverse = True)
@@ -0,0 +1,94 @@
+import threading
+
+#########hard code area
+prefetch_depth = 2              # input files downloaded ahead of the one being processed
+prefetch_budget = 512 << 20     # bytes of downloaded inputs not processed yet that may sit on disk at once
+#########
+
+
+class Prefetcher():
+    """
+        Downloads the inputs of a task in order on a background thread while the caller
+        processes the earlier ones, so network and cpu overlap. Iterating yields the names in
+        order, each once its download finished; the download of a name runs at most depth files
+        ahead of the one the caller works on, and only while the downloaded, unprocessed files
+        and the next one fit in budget bytes. The file right after the current one is always
+        fetched, so one input bigger than the budget does not stall the pipeline.
+        download(name) blocks until the file is local, size(name) is its expected size or None.
+    """
+
+    def __init__(self, names, download, size, depth = prefetch_depth, budget = prefetch_budget):
+        self.names = list(names)
+        self.download = download
+        self.size = size
+        self.depth = depth
+        self.budget = budget
+        self.condition = threading.Condition()
+        self.ready = {}                 # index: bytes, downloaded and not processed yet
+        self.errors = {}                # index: exception of a failed download
+        self.next = 0                   # index of the next file to download
+        self.consumed = 0               # files processed
+        self.closed = False
+        self.thread = threading.Thread(target = self.run, daemon = True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _may_fetch(self):
+        # caller holds self.condition; files downloading or downloaded but not processed
+        ahead = self.next - self.consumed
+        if ahead == 0:
+            return True
+        if ahead > self.depth:
+            return False
+        if ahead == 1:
+            return True
+        return sum(self.ready.values()) + (self.size(self.names[self.next]) or 0) <= self.budget
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.closed and self.next < len(self.names) and not self._may_fetch():
+                    self.condition.wait()
+                if self.closed or self.next >= len(self.names):
+                    return
+                index = self.next
+                self.next += 1
+            error = None
+            try:
+                self.download(self.names[index])
+            except Exception as e:
+                error = e
+            with self.condition:
+                self.ready[index] = self.size(self.names[index]) or 0
+                if error is not None:
+                    self.errors[index] = error
+                self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def join(self):
+        """
+            Stop downloading and wait for the download in progress, afterwards no more files appear
+        """
+        self.close()
+        self.thread.join()
+    def __iter__(self):
+        try:
+            for index, name in enumerate(self.names):
+                with self.condition:
+                    while index not in self.ready:
+                        self.condition.wait()
+                    if index in self.errors:
+                        raise self.errors.pop(index)
+                yield name
+                with self.condition:
+                    del self.ready[index]
+                    self.consumed += 1
+                    self.condition.notify_all()
+        finally:
+            self.close()
@@ -0,0 +1,66 @@
+import shutil
+
+
+def relay_subtree(index, count):
+    """
+        Positions in a joined get's relay list that receive the file through position index
+    """
+    subtree, frontier = [], [index]
+    while len(frontier) > 0:
+        position = frontier.pop()
+        if position < count:
+            subtree.append(position)
+            frontier += [2 * position + 1, 2 * position + 2]
+    return subtree
+
+
+def receive_relayed(http_packet, node, store, forward, record_transfer = None):
+    """
+        Requester side of a get, the file_data frame a replica or another requester sent to node.
+        A joined get has every destination in relay and the local files of each in waiters: node
+        stores one copy for all of its waiters and relays the file on, destination i sends it to
+        destinations 2i+1 and 2i+2, so n destinations cost the replica one transfer.
+        store(path) moves the received payload to path, forward(dest, http_packet, path) sends
+        the file on and returns False if dest can not be reached, record_transfer(peer, bytes,
+        seconds) gets the throughput of the transfer.
+        Returns the get_ack for the leader. It is always built, the leader holds the file's read
+        slot until every destination answered: 'failed' if the file could not be stored here,
+        with the reason in 'error', and 'relay_failed' the destinations it did not reach.
+    """
+    relay = http_packet.get('relay', [node])
+    index = http_packet.get('relay_index', 0)
+    children = [child for child in [2 * index + 1, 2 * index + 2] if child < len(relay)]
+    forwarded = set()
+    return_packet = {}
+    return_packet['task_id'] = http_packet['task_id']
+    return_packet['request_type'] = 'get_ack'
+    return_packet['request_source'] = node
+    return_packet['dest'] = relay[index]
+    return_packet['sdfs_filename'] = http_packet['sdfs_filename']
+    return_packet['replica_ip'] = http_packet['replica_ip']
+    return_packet['failed'] = True
+    try:
+        if 'error' in http_packet:
+            raise FileNotFoundError(f"{http_packet['replica_ip']} could not send {http_packet['sdfs_filename']}: {http_packet['error']}")
+        waiters = http_packet.get('waiters', {}).get(relay[index], [[http_packet['task_id'], http_packet['local_filename']]])
+        first = waiters[0][1]
+        store(first)
+        if record_transfer is not None and 'payload_seconds' in http_packet:
+            sender = http_packet['replica_ip'] if index == 0 else relay[(index - 1) // 2]
+            record_transfer(sender, http_packet['payload_bytes'], http_packet['payload_seconds'])
+        for task_id, local_filename in waiters[1:]:
+            shutil.copyfile(first, local_filename)
+        return_packet['failed'] = False
+
+        for child in children:
+            child_packet = dict(http_packet)
+            for key in ['payload_path', 'payload_bytes', 'payload_seconds']:
+                child_packet.pop(key, None)
+            child_packet['relay_index'] = child
+            if forward(relay[child], child_packet, first):
+                forwarded.add(child)
+    except Exception as e:
+        return_packet['error'] = str(e)
+    return_packet['relay_failed'] = [relay[position] for child in children if child not in forwarded
+                                     for position in relay_subtree(child, len(relay))]
+    return return_packet
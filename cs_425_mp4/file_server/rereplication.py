@@ -0,0 +1,131 @@
+import heapq
+import random
+import itertools
+import threading
+from collections import Counter
+
+#########hard code area
+max_workers = 8         # files re-replicated at the same time
+max_per_member = 2      # re-replication transfers one member sends or receives at the same time
+#########
+
+
+class RereplicationPlanner():
+    """
+        Re-replication after failures. Affected files wait in a priority queue ordered by how much
+        redundancy they have left (copies that can still be lost), so a file down to its last
+        replica is repaired before one that still has three. A bounded pool of workers repairs
+        files in parallel with repair(sdfs_filename). Transfers are spread over the members: every
+        transfer reserves the least busy source(s) and destination, and no member takes part in
+        more than max_per_member transfers at once, so foreground requests still get bandwidth.
+    """
+
+    def __init__(self, repair, max_workers = max_workers, max_per_member = max_per_member):
+        self.repair = repair
+        self.max_workers = max_workers
+        self.max_per_member = max_per_member
+        self.cond = threading.Condition()
+        self.heap = []                  # (redundancy left, seq, sdfs_filename)
+        self.priority = {}              # sdfs_filename: redundancy it is queued with, older heap entries are stale
+        self.seq = itertools.count()
+        self.running = set()
+        self.rerun = set()              # files that failed again while they were being repaired
+        self.load = Counter()           # member: transfers it takes part in
+        self.acks = {}                  # task_id: [threading.Event, ok]
+
+    def schedule(self, sdfs_filename, redundancy):
+        """
+            Queue a file for repair, a file already queued only moves up
+        """
+        with self.cond:
+            if self.priority.get(sdfs_filename, redundancy + 1) <= redundancy:
+                return
+            self.priority[sdfs_filename] = redundancy
+            heapq.heappush(self.heap, (redundancy, next(self.seq), sdfs_filename))
+            self.cond.notify_all()
+
+    def pending(self):
+        with self.cond:
+            return len(self.priority) + len(self.running)
+
+    def start(self):
+        for _ in range(self.max_workers):
+            threading.Thread(target = self.worker, daemon = True).start()
+
+    def worker(self):
+        while True:
+            with self.cond:
+                while True:
+                    while self.heap and self.priority.get(self.heap[0][2]) != self.heap[0][0]:
+                        heapq.heappop(self.heap)
+                    if self.heap:
+                        break
+                    self.cond.wait()
+                _, _, sdfs_filename = heapq.heappop(self.heap)
+                del self.priority[sdfs_filename]
+                if sdfs_filename in self.running:
+                    self.rerun.add(sdfs_filename)
+                    continue
+                self.running.add(sdfs_filename)
+
+            try:
+                self.repair(sdfs_filename)
+            except Exception as e:
+                print(f"Re-replication of {sdfs_filename} error: {str(e)}")
+            finally:
+                with self.cond:
+                    self.running.discard(sdfs_filename)
+                    if sdfs_filename in self.rerun:
+                        self.rerun.discard(sdfs_filename)
+                        self.priority[sdfs_filename] = 0
+                        heapq.heappush(self.heap, (0, next(self.seq), sdfs_filename))
+                        self.cond.notify_all()
+
+    def reserve(self, destinations, sources, source_count = 1):
+        """
+            Take the least busy destination and source_count least busy sources, waiting while
+            all candidates are at max_per_member. Returns (dest, [sources]) or None if there
+            are not enough candidates at all.
+        """
+        if len(destinations) == 0 or len(sources) < source_count:
+            return None
+        with self.cond:
+            while True:
+                free_destinations = [host for host in destinations if self.load[host] < self.max_per_member]
+                free_sources = [host for host in sources if self.load[host] < self.max_per_member]
+                if len(free_destinations) > 0 and len(free_sources) >= source_count:
+                    dest = min(free_destinations, key = lambda host: (self.load[host], random.random()))
+                    chosen = sorted(free_sources, key = lambda host: (self.load[host], random.random()))[:source_count]
+                    for host in [dest] + chosen:
+                        self.load[host] += 1
+                    return dest, chosen
+                self.cond.wait()
+
+    def release(self, hosts):
+        with self.cond:
+            for host in hosts:
+                self.load[host] -= 1
+                if self.load[host] <= 0:
+                    del self.load[host]
+            self.cond.notify_all()
+
+    def expect(self, task_id):
+        with self.cond:
+            self.acks[task_id] = [threading.Event(), False]
+
+    def ack(self, task_id, ok):
+        with self.cond:
+            entry = self.acks.get(task_id)
+            if entry is not None:
+                entry[1] = ok
+                entry[0].set()
+
+    def wait(self, task_id, timeout):
+        """
+            Wait for the ack of an expected transfer, False on failure or timeout
+        """
+        entry = self.acks[task_id]
+        entry[0].wait(timeout)
+        with self.cond:
+            del self.acks[task_id]
+            return entry[1]
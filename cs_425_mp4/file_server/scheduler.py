@@ -0,0 +1,242 @@
+import threading
+from collections import deque, defaultdict
+
+#########hard code area
+max_readers = 2         # concurrent reads allowed on one sdfs file
+max_consecutive = 4     # same type operations in a row while the other type is waiting
+write_requests = ['put', 'append', 'delete', 'batch_put', 'batch_delete', 'rebalance']
+read_requests = ['get', 'batch_get']
+class_ranks = {'interactive': 0, 'job': 1, 'rereplication': 2}   # admission classes, served in this order
+background_class = 'rereplication'
+#########
+
+
+def request_files(http_packet):
+    """
+        sdfs files a request works on, a batch request carries a list of files
+    """
+    if 'files' in http_packet:
+        return list(dict.fromkeys(item['sdfs_filename'] for item in http_packet['files']))
+    return [http_packet['sdfs_filename']]
+
+
+def is_get(http_packet):
+    """
+        A single file get
+    """
+    return http_packet['request_type'] == 'get' and 'files' not in http_packet
+
+def is_put(http_packet):
+    """
+        A single file put, which replaces the whole file
+    """
+    return http_packet['request_type'] == 'put' and 'files' not in http_packet
+
+def class_rank(http_packet):
+    return class_ranks.get(http_packet.get('priority'), 0)
+
+def is_background(http_packet):
+    """
+        Leader work such as a replica move, it checks the file's version itself when it runs,
+        so requests of the users may pass it
+    """
+    return http_packet.get('priority') == background_class and 'files' not in http_packet
+
+
+class RequestScheduler():
+    """
+        Event driven scheduler for leader requests. Every sdfs file has its own FIFO queue,
+        the scheduling thread sleeps on a condition variable and only wakes up when a request
+        arrives or a running request finishes on some file.
+        A batch request is queued on all of its files and starts as one unit once it holds
+        the slot of every file; it is never reordered, so batches can not deadlock each other.
+        When a put is about to start and more puts of the same file are queued right behind it,
+        only the last of them runs, the others are handed to supersede(http_packet) in queue
+        order: their contents would be overwritten anyway.
+        Likewise a get that starts takes the gets of the same byte range queued behind it, up to
+        the next write, along in http_packet['joined'] if join_reads(http_packet) allows it: they
+        read the same version, so one read slot and one transfer serve them all.
+        Requests carry their admission class in http_packet['priority']. Files whose next request
+        is of a higher class are served first, and background requests (replica moves) let the
+        requests queued behind them on their file go first.
+        schedule_counter = {'sdfsfilename':[R_count, W_count, R_pre, W_pre]}
+    """
+
+    def __init__(self, dispatch, max_readers = max_readers, max_consecutive = max_consecutive, supersede = None, join_reads = None):
+        self.dispatch = dispatch
+        self.supersede = supersede
+        self.join_reads = join_reads
+        self.superseded = []            # puts coalesced away, handed to supersede outside the lock
+        self.max_readers = max_readers
+        self.max_consecutive = max_consecutive
+        self.cond = threading.Condition()
+        self.file_queues = defaultdict(deque)
+        self.schedule_counter = defaultdict(lambda : [0,0,0,0])
+        self.ready_files = [deque() for rank in range(len(class_ranks))]   # files that may be able to start their next request, by class
+        self.ready_rank = {}            # sdfs_filename: best class rank it is queued in ready_files with
+        self.reserved = {}              # id(batch request): number of its files whose slot it holds
+
+    def submit(self, http_packet):
+        """
+            Append a request to the FIFO queue of its file
+        """
+        with self.cond:
+            for sdfs_filename in request_files(http_packet):
+                self.file_queues[sdfs_filename].append(http_packet)
+                self._mark_ready(sdfs_filename)
+
+    def finish_read(self, sdfs_filename):
+        with self.cond:
+            self.schedule_counter[sdfs_filename][0] = max(0, self.schedule_counter[sdfs_filename][0] - 1)
+            self._mark_ready(sdfs_filename)
+
+    def finish_write(self, sdfs_filename):
+        with self.cond:
+            self.schedule_counter[sdfs_filename][1] = 0
+            self._mark_ready(sdfs_filename)
+
+    def finish_request(self, http_packet):
+        """
+            Release every file of a finished request
+        """
+        for sdfs_filename in request_files(http_packet):
+            if http_packet['request_type'] in write_requests:
+                self.finish_write(sdfs_filename)
+            else:
+                self.finish_read(sdfs_filename)
+
+    def queue_depth(self):
+        with self.cond:
+            return sum(len(queue) for queue in self.file_queues.values())
+
+    def _next_request(self, queue):
+        # the request a file would start next, the first one that is not background work
+        for http_packet in queue:
+            if not is_background(http_packet):
+                return http_packet
+        return queue[0] if queue else None
+
+    def _mark_ready(self, sdfs_filename):
+        # caller holds self.cond; a file that becomes more urgent is queued again, the stale entry is skipped
+        http_packet = self._next_request(self.file_queues.get(sdfs_filename, ()))
+        rank = class_rank(http_packet) if http_packet is not None else len(class_ranks) - 1
+        if self.ready_rank.get(sdfs_filename, len(class_ranks)) > rank:
+            self.ready_rank[sdfs_filename] = rank
+            self.ready_files[rank].append(sdfs_filename)
+            self.cond.notify()
+
+    def _can_start(self, counter, is_write):
+        if is_write:
+            return counter[0] == 0 and counter[1] == 0
+        return counter[0] < self.max_readers and counter[1] == 0
+
+    def _pick(self, sdfs_filename):
+        """
+            Take the next request of a file that is allowed to start, or None.
+            Requests start in FIFO order, except that after max_consecutive operations of
+            one type the first waiting single request of the other type goes next.
+            A batch that only got the slot of this file returns self.reserved instead.
+        """
+        queue = self.file_queues[sdfs_filename]
+        counter = self.schedule_counter[sdfs_filename]
+        candidate = queue[0]
+        if is_background(candidate):
+            candidate = self._next_request(queue)
+        is_write = candidate['request_type'] in write_requests
+
+        consecutive = counter[3] if is_write else counter[2]
+        if consecutive >= self.max_consecutive:
+            for http_packet in queue:
+                if 'files' in http_packet:
+                    continue
+                if (http_packet['request_type'] in write_requests) != is_write:
+                    candidate = http_packet
+                    is_write = not is_write
+                    break
+
+        if not self._can_start(counter, is_write):
+            return None
+
+        if self.supersede is not None and candidate is queue[0] and is_put(candidate):
+            # nothing runs on the file, so acking the superseded puts now keeps the acks in order
+            while len(queue) > 1 and is_put(queue[1]):
+                self.superseded.append(queue.popleft())
+            candidate = queue[0]
+
+        position = next(ix for ix, http_packet in enumerate(queue) if http_packet is candidate)
+        del queue[position]
+        if is_get(candidate) and self.join_reads is not None and self.join_reads(candidate):
+            candidate['joined'] = self._take_joinable(queue, position, candidate)
+
+        if is_write:
+            counter[1] = 1
+            counter[2] = 0
+            counter[3] += 1
+        else:
+            counter[0] += 1
+            counter[2] += 1
+            counter[3] = 0
+
+        if 'files' in candidate:
+            held = self.reserved.get(id(candidate), 0) + 1
+            if held < len(request_files(candidate)):
+                self.reserved[id(candidate)] = held
+                return self.reserved
+            self.reserved.pop(id(candidate), None)
+        return candidate
+
+    def _take_joinable(self, queue, position, candidate):
+        # the gets behind position that read what candidate reads, until the next write
+        joined = []
+        quorum = candidate.get('quorum', 1)
+        for http_packet in list(queue)[position:]:
+            if http_packet['request_type'] in write_requests:
+                break
+            if is_get(http_packet) and http_packet.get('quorum', 1) <= quorum and \
+                    (http_packet.get('offset'), http_packet.get('length')) == (candidate.get('offset'), candidate.get('length')):
+                joined.append(http_packet)
+        if joined:
+            taken = set(id(http_packet) for http_packet in joined)
+            kept = [http_packet for http_packet in queue if id(http_packet) not in taken]
+            queue.clear()
+            queue.extend(kept)
+        return joined
+
+    def run(self):
+        """
+            Scheduling thread: wait for ready files and dispatch requests that can start
+        """
+        while True:
+            started = []
+            with self.cond:
+                while not any(self.ready_files):
+                    self.cond.wait()
+                rank = next(rank for rank, files in enumerate(self.ready_files) if files)
+                sdfs_filename = self.ready_files[rank].popleft()
+                if self.ready_rank.get(sdfs_filename) != rank:
+                    # queued again with a higher class, already served from there
+                    continue
+                del self.ready_rank[sdfs_filename]
+
+                queue = self.file_queues.get(sdfs_filename)
+                while queue:
+                    http_packet = self._pick(sdfs_filename)
+                    if http_packet is None:
+                        break
+                    if http_packet is not self.reserved:
+                        started.append(http_packet)
+
+                # drop state of idle files so memory does not grow with the namespace
+                if not queue:
+                    self.file_queues.pop(sdfs_filename, None)
+                    counter = self.schedule_counter.get(sdfs_filename)
+                    if counter is not None and counter[0] == 0 and counter[1] == 0:
+                        del self.schedule_counter[sdfs_filename]
+
+                superseded, self.superseded = self.superseded, []
+
+            # network sends happen outside of the lock
+            for http_packet in superseded:
+                self.supersede(http_packet)
+            for http_packet in started:
+                self.dispatch(http_packet)
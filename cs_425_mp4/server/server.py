@@ -18,7 +18,7 @@ host_name = 'fa23-cs425-56{}.cs.illinois.edu'
 machine_2_ip = {i: 'fa23-cs425-56{}.cs.illinois.edu'.format('0'+str(i)) for i in range(1, 10)}  #host domain names of machnine 1~9
 machine_2_ip[10] = 'fa23-cs425-5610.cs.illinois.edu'                                            #host domain name of machine 10
 root = '/home/aaghosh2/MP1/logs/'    #log file path name 
-mp2_log_path = '/home/aaghosh2/mp2_server_log'
+mp2_log_path = os.path.join(os.environ.get('SDFS_ROOT', '/home/aaghosh2'), 'mp2_server_log')
 msg_format = 'utf-8'                #data encoding format of socket programming
 logs = [root]                       #if need to handle multi log files on a single machine
 gossiping_sockets = {}   #record all socket for gossiping
@@ -31,8 +31,8 @@ gossiping_threadpool = {}
 gossiping_timeout = 0.1
 sock_timeout = 0.08
 membership_list = {} #dict() dict([domain_name, heartbeat, localtime, status])
-host_domain_name = socket.gethostname() 
-machine_id = int(host_domain_name[13:15])
+host_domain_name = os.environ.get('SDFS_NODE', socket.gethostname())  # SDFS_NODE names a server when several run on one machine
+machine_id = int(host_domain_name[13:15]) if host_domain_name.startswith('fa23-cs425-56') else host_domain_name
 T_fail = 4
 T_cleanup = 2
 heartbeatrate = 0.07
@@ -83,7 +83,7 @@ class FailDetector():
         self.machine_2_ip = {i: 'fa23-cs425-56{}.cs.illinois.edu'.format('0'+str(i)) for i in range(1, 10)}  #host domain names of machnine 1~9
         self.machine_2_ip[10] = 'fa23-cs425-5610.cs.illinois.edu'                                            #host domain name of machine 10
         self.root = '/home/aaghosh2/MP1/logs/'    #log file path name 
-        self.mp2_log_path = '/home/aaghosh2/mp2_server_log'
+        self.mp2_log_path = mp2_log_path
         self.msg_format = 'utf-8'                #data encoding format of socket programming
         self.logs = [root]                       #if need to handle multi log files on a single machine
         self.gossiping_sockets = {}   #record all socket for gossiping
@@ -96,8 +96,8 @@ class FailDetector():
         self.gossiping_timeout = 0.1
         self.sock_timeout = 0.08
         self.membership_list = {} #dict() dict([domain_name, heartbeat, localtime, status])
-        self.host_domain_name = socket.gethostname() 
-        self.machine_id = int(host_domain_name[13:15])
+        self.host_domain_name = host_domain_name
+        self.machine_id = machine_id
         self.T_fail = 4
         self.T_cleanup = 2
         self.heartbeatrate = 0.07
@@ -114,8 +114,16 @@ class FailDetector():
         self.gossiping_start_time = None
         self.failure_queue = deque()
         self.filelocation_intro_queue = deque()
+        self.membership_callbacks = [] # callback(event, domain_name) for 'join' and 'failure' events, must not block
         #########
 
+    def notify_membership(self, event, domain_name):
+        for callback in self.membership_callbacks:
+            try:
+                callback(event, domain_name)
+            except Exception as e:
+                self.logger.error("Membership callback error: {}".format(str(e)))
+
 
     def gossiping_timestamp_handling(self): # increase heartbeat and failure/cleanup detection and check leave status
         
@@ -164,6 +172,7 @@ class FailDetector():
                 self.status_join-={domain_name}
                 self.membership_list[domain_name]['status'] = 'Failure'
                 self.failure_queue.append(domain_name)
+                self.notify_membership('failure', domain_name)
                 self.membership_list[domain_name]['timestamp'] = time.time()
                 if self.recieve_time > 0:
                     self.logger.debug("False positive prob is : {}".format(self.failure_time/self.recieve_time))
@@ -308,6 +317,7 @@ class FailDetector():
                     if domain_name not in self.membership_list:
                         self.status_join.add(domain_name)
                         self.filelocation_intro_queue.append(domain_name)
+                        self.notify_membership('join', domain_name)
                         self.membership_list[domain_name] = dict(info)
                         self.membership_list[domain_name]['timestamp'] = time.time()
                         self.logger.writelog("server {} joins the membership list on local time {} (s)".format(domain_name, self.membership_list[domain_name]['timestamp']))
@@ -0,0 +1,40 @@
+import os
+import sys
+import tempfile
+import pytest
+
+# fileserver reads its settings from the environment on import, keep it away from the VM paths
+os.environ.setdefault('SDFS_ROOT', tempfile.mkdtemp(prefix = 'sdfs_test_'))
+os.environ.setdefault('SDFS_NODE', 'node00')
+os.environ.setdefault('SDFS_MEMBERS', 'node00,node01,node02,node03,node04')
+os.environ.setdefault('SDFS_TRANSFER', 'local')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'file_server'))
+
+
+@pytest.fixture
+def fileserver(monkeypatch, tmp_path):
+    """
+        The fileserver module with empty leader state, packets it sends are collected in
+        fileserver.sent as (dest, http_packet) instead of going to the network
+    """
+    import fileserver
+    for state in [fileserver.filelocation_list, fileserver.file_attrs, fileserver.write_acks, fileserver.read_state,
+                  fileserver.fresh_replicas, fileserver.replica_versions, fileserver.stored_sizes]:
+        state.clear()
+    monkeypatch.setattr(fileserver, 'stored_bytes', 0)
+    monkeypatch.setattr(fileserver, 'metadata_log', fileserver.MetadataLog(str(tmp_path / 'meta'), fileserver.file_attrs))
+    for path in [fileserver.mp3_file_path, fileserver.mp3_local_path, fileserver.mp3_spool_path]:
+        os.makedirs(path, exist_ok = True)
+    monkeypatch.setattr(fileserver.fail_detector, 'membership_list',
+                        {member: {'heartbeat': 0, 'status': 'Join', 'timestamp': 0} for member in fileserver.static_members})
+    sent = []
+    def send_packet(dest, http_packet, port, request_type = None, payload = None):
+        sent.append((dest, dict(http_packet)))
+        return True
+    def send(http_packet, request_type, to_leader, replica_ips = None):
+        for dest in (['leader'] if to_leader else replica_ips or []):
+            sent.append((dest, dict(http_packet)))
+    monkeypatch.setattr(fileserver, 'send_packet', send_packet)
+    monkeypatch.setattr(fileserver, 'send', send)
+    monkeypatch.setattr(fileserver, 'sent', sent, raising = False)
+    return fileserver
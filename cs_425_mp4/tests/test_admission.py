@@ -0,0 +1,55 @@
+from admission import AdmissionControl, retry_base
+
+
+def test_lower_classes_hit_their_share_first():
+    admission = AdmissionControl(max_outstanding = 10, max_per_client = 10)
+    for index in range(3):
+        assert admission.admit(f'm{index}', 'leader', 'rereplication') is None
+    # rereplication may fill 3 of 10, the others still find room
+    retry_after = admission.admit('m3', 'leader', 'rereplication')
+    assert retry_after == retry_base * 2
+    assert admission.has_room('job') and not admission.has_room('rereplication')
+    # a released slot can be taken again, admitting the same task twice counts once
+    admission.release('m0')
+    assert admission.admit('m3', 'leader', 'rereplication') is None
+    assert admission.admit('m3', 'leader', 'rereplication') is None
+
+    # shares are of all outstanding requests, so job is full at 7 in total
+    for index in range(4):
+        assert admission.admit(f'j{index}', 'client', 'job') is None
+    assert admission.admit('j4', 'client', 'job') is not None
+    assert admission.admit('i0', 'client', 'interactive') is None
+    assert admission.stats()['rejected'] == {'rereplication': 1, 'job': 1}
+    assert admission.stats()['per_class'] == {'rereplication': 3, 'job': 4, 'interactive': 1}
+
+
+def test_one_client_is_limited_and_told_to_wait_longer():
+    admission = AdmissionControl(max_outstanding = 100, max_per_client = 2)
+    assert admission.admit('a0', 'a') is None
+    assert admission.admit('a1', 'a') is None
+    assert admission.admit('a2', 'a') == retry_base * 2
+    assert admission.admit('b0', 'b') is None
+    # a request a new leader resumes is admitted anyway
+    assert admission.admit('a2', 'a', force = True) is None
+    assert admission.stats()['clients'] == 2
+
+
+class Scheduler():
+    def __init__(self):
+        self.submitted = []
+    def submit(self, http_packet):
+        self.submitted.append(http_packet['task_id'])
+
+
+def test_leader_tells_rejected_clients_to_retry_later(fileserver, monkeypatch):
+    monkeypatch.setattr(fileserver, 'leader_scheduler', Scheduler())
+    monkeypatch.setattr(fileserver, 'admission', AdmissionControl(max_outstanding = 1))
+    monkeypatch.setattr(fileserver, 'open_requests', type(fileserver.open_requests)())
+    for task_id in ['g0', 'g1']:
+        fileserver.accept_request({'task_id': task_id, 'request_type': 'get', 'request_source': 'node04', 'sdfs_filename': 'f'})
+
+    assert fileserver.leader_scheduler.submitted == ['g0']
+    assert list(fileserver.open_requests) == ['g0']
+    [(dest, retry_packet)] = fileserver.sent
+    assert dest == 'node04' and retry_packet['request_type'] == 'retry_later'
+    assert retry_packet['retry_after'] > 0 and retry_packet['request']['task_id'] == 'g1'
@@ -0,0 +1,28 @@
+from pack_store import PackStore
+
+
+def append_request(task_id, local_filename, offset, version):
+    return {'task_id': task_id, 'request_type': 'append', 'request_source': 'node04', 'sdfs_filename': 'f',
+            'local_filename': local_filename, 'offset': offset, 'version': version}
+
+
+def append_acks(fileserver):
+    return [(http_packet['ok'], http_packet['size']) for dest, http_packet in fileserver.sent if http_packet['request_type'] == 'append_ack']
+
+
+def test_replica_appends_only_the_new_bytes(fileserver, monkeypatch, tmp_path):
+    monkeypatch.setattr(fileserver, 'pack_store', PackStore(str(tmp_path / 'segments')))
+    (tmp_path / 'first').write_bytes(b'abc')
+    fileserver.install_copy(str(tmp_path / 'first'), 'f', 1)
+    (tmp_path / 'new').write_bytes(b'de')
+
+    fileserver.append_file(append_request('a1', str(tmp_path / 'new'), 3, 2))
+    # a retry of the same append starts at the same offset and does not duplicate the bytes
+    fileserver.append_file(append_request('a1', str(tmp_path / 'new'), 3, 2))
+    # a replica that missed bytes before the offset can not append
+    fileserver.append_file(append_request('a2', str(tmp_path / 'new'), 9, 3))
+
+    assert append_acks(fileserver) == [(True, 5), (True, 5), (False, None)]
+    with open(f'{fileserver.mp3_file_path}/f', 'rb') as fd:
+        assert fd.read() == b'abcde'
+    assert fileserver.replica_versions['f'] == 2 and 'f' not in fileserver.pack_store
@@ -0,0 +1,47 @@
+from pack_store import PackStore
+
+
+def batch_request(task_id, request_type, files):
+    return {'task_id': task_id, 'request_type': request_type, 'request_source': 'node04', 'files': files}
+
+
+def batch_acks(fileserver):
+    return [http_packet for dest, http_packet in fileserver.sent if http_packet['request_type'] == 'batch_ack']
+
+
+def test_replica_answers_a_batch_with_one_ack(fileserver, monkeypatch, tmp_path):
+    monkeypatch.setattr(fileserver, 'pack_store', PackStore(str(tmp_path / 'segments')))
+    (tmp_path / 'a').write_bytes(b'aaa')
+    files = [{'sdfs_filename': 'a', 'local_filename': str(tmp_path / 'a'), 'version': 1},
+             {'sdfs_filename': 'b', 'local_filename': str(tmp_path / 'missing'), 'version': 1}]
+    fileserver.batch_files(batch_request('p', 'batch_put', files))
+    assert [http_packet['failed'] for http_packet in batch_acks(fileserver)] == [['b']]
+    assert fileserver.is_stored('a') and not fileserver.is_stored('b')
+    assert fileserver.replica_versions == {'a': 1}
+
+    fileserver.batch_files(batch_request('g', 'batch_get', [{'sdfs_filename': 'a', 'local_filename': str(tmp_path / 'out')}]))
+    assert (tmp_path / 'out').read_bytes() == b'aaa'
+
+    fileserver.batch_files(batch_request('d', 'batch_delete', [{'sdfs_filename': 'a', 'version': 2}]))
+    assert [http_packet['failed'] for http_packet in batch_acks(fileserver)] == [['b'], [], []]
+    assert not fileserver.is_stored('a') and fileserver.replica_versions == {'a': 2}
+
+
+def test_leader_sends_one_request_per_replica_and_one_finish_ack(fileserver, monkeypatch):
+    monkeypatch.setattr(fileserver, 'batch_acks', {})
+    files = [{'sdfs_filename': name, 'local_filename': '/tmp/' + name, 'size': 3} for name in ['a', 'b', 'c']]
+    fileserver.send_batch(batch_request('p', 'batch_put', files))
+    replica_packets = {dest: http_packet for dest, http_packet in fileserver.sent}
+    assert len(replica_packets) == len(fileserver.sent)
+    assert sum(len(http_packet['files']) for http_packet in replica_packets.values()) == 3 * fileserver.replication_factor
+    assert fileserver.filelocation_list == {}
+
+    fileserver.sent.clear()
+    for dest, http_packet in replica_packets.items():
+        failed = ['b'] if 'b' in [item['sdfs_filename'] for item in http_packet['files']] else []
+        fileserver.handle_ack({'task_id': 'p', 'request_type': 'batch_ack', 'request_source': 'node04', 'replica_ip': dest, 'failed': failed})
+    [(dest, ack_packet)] = fileserver.sent
+    assert dest == 'node04' and ack_packet['request_type'] == 'finish_ack' and ack_packet['failed'] == ['b']
+    # only the files every replica stored are recorded
+    assert sorted(fileserver.filelocation_list) == ['a', 'c']
+    assert fileserver.file_attrs['a']['version'] == 1
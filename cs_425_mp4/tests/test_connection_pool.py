@@ -0,0 +1,38 @@
+import socket
+import threading
+from connection_pool import ConnectionPool
+from framing import recv_message
+
+
+def test_control_messages_do_not_wait_behind_a_transfer(tmp_path):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(8)
+    listener.settimeout(5)
+    port = listener.getsockname()[1]
+    big = tmp_path / 'big'
+    big.write_bytes(b'x' * (64 << 20))
+
+    pool = ConnectionPool()
+    def send_file():
+        try:
+            pool.send('127.0.0.1', port, {'request_type': 'file_data'}, str(big))
+        except OSError:
+            # the connection is dropped at the end of the test
+            pass
+    transfer = threading.Thread(target = send_file, daemon = True)
+    transfer.start()
+    # the receiver does not read the transfer, so it stalls once the socket buffers are full
+    data_conn, _ = listener.accept()
+    transfer.join(0.5)
+    assert transfer.is_alive()
+
+    sent = threading.Event()
+    threading.Thread(target = lambda: (pool.send('127.0.0.1', port, {'request_type': 'lease_renew'}), sent.set()), daemon = True).start()
+    control_conn, _ = listener.accept()
+    assert sent.wait(5)
+    assert recv_message(control_conn, str(tmp_path))['request_type'] == 'lease_renew'
+
+    pool.drop('127.0.0.1')
+    for sock in [data_conn, control_conn, listener]:
+        sock.close()
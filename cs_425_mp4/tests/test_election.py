@@ -0,0 +1,84 @@
+import time
+import threading
+from election import LeaderElection
+
+
+class Network():
+    """
+        Delivers lease messages between elections synchronously, dropping those to nodes
+        outside the set a node can reach
+    """
+
+    def __init__(self, nodes, voters = True):
+        self.nodes = {}
+        self.reachable = {}
+        for node in nodes:
+            self.nodes[node] = LeaderElection(node, lambda node = node: sorted(self.reachable[node]), self.sender(node), nodes if voters else None)
+            threading.Thread(target = self.nodes[node].send_replies, daemon = True).start()
+
+    def sender(self, source):
+        def send(dest, http_packet):
+            if dest not in self.reachable[source]:
+                return False
+            self.nodes[dest].handle(http_packet)
+            return True
+        return send
+
+    def partition(self, *groups):
+        for group in groups:
+            for node in group:
+                self.reachable[node] = set(group)
+
+
+def test_majority_of_members_in_view_is_not_enough():
+    network = Network(['a', 'b', 'c', 'd', 'e'])
+    # two disjoint views, each candidate would have a majority of what it sees
+    network.partition(['a', 'b'], ['c', 'd'], ['e'])
+    network.nodes['a'].campaign(['a', 'b'])
+    network.nodes['c'].campaign(['c', 'd'])
+    assert not network.nodes['a'].is_leader()
+    assert not network.nodes['c'].is_leader()
+
+
+def test_majority_of_voters_elects_one_leader():
+    network = Network(['a', 'b', 'c', 'd', 'e'])
+    network.partition(['a', 'b', 'c'], ['d', 'e'])
+    network.nodes['a'].campaign(['a', 'b', 'c'])
+    network.nodes['d'].campaign(['d', 'e'])
+    assert network.nodes['a'].is_leader()
+    assert not network.nodes['d'].is_leader()
+    assert network.nodes['b'].leader() == 'a'
+
+    # b and c granted a, so a second candidate that reaches them is refused while a's lease runs
+    network.partition(['b', 'c', 'd', 'e'], ['a'])
+    network.nodes['b'].campaign(['b', 'c', 'd', 'e'])
+    assert not network.nodes['b'].is_leader()
+
+
+def test_lease_messages_do_not_block_the_caller():
+    sent = threading.Event()
+    def slow_send(dest, http_packet):
+        time.sleep(0.5)
+        sent.set()
+        return True
+    election = LeaderElection('b', lambda: ['a', 'b', 'c'], slow_send, ['a', 'b', 'c'])
+    threading.Thread(target = election.send_replies, daemon = True).start()
+    start = time.monotonic()
+    election.handle({'task_id': 't', 'request_type': 'lease_request', 'request_source': 'a', 'round': 1})
+    assert time.monotonic() - start < 0.1
+    assert sent.wait(2)
+    assert election.leader() == 'a'
+
+
+def test_members_seen_vote_without_configured_voters():
+    network = Network(['a', 'b', 'c'], voters = False)
+    network.partition(['a', 'b', 'c'])
+    network.nodes['a'].campaign(['a', 'b', 'c'])
+    assert network.nodes['a'].is_leader()
+    assert network.nodes['c'].leader() == 'a'
+
+    # a failed member keeps its vote, the remaining one is no majority
+    network.nodes['a'].step_down()
+    network.partition(['a'], ['b'], ['c'])
+    network.nodes['a'].campaign(['a'])
+    assert not network.nodes['a'].is_leader()
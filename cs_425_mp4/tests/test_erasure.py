@@ -0,0 +1,39 @@
+import os
+import pytest
+import erasure
+from erasure import encode_file, decode_file, rebuild_fragment, fragment_path
+
+
+@pytest.fixture
+def coded(tmp_path, monkeypatch):
+    # several stripes, the last one padded
+    monkeypatch.setattr(erasure, 'stripe_size', 256)
+    data = os.urandom(3 * 1000 + 7)
+    source = tmp_path / 'source'
+    source.write_bytes(data)
+    assert encode_file(str(source), str(tmp_path / 'fragment'), 3, 2) == len(data)
+    return data, tmp_path, [fragment_path(str(tmp_path / 'fragment'), index) for index in range(5)]
+
+
+def test_any_k_fragments_decode(coded):
+    data, tmp_path, paths = coded
+    for drop in [(0, 1), (3, 4), (1, 3), (0, 4)]:
+        fragments = {index: path for index, path in enumerate(paths) if index not in drop}
+        out = tmp_path / 'out'
+        decode_file(fragments, len(data), str(out), 3, 2)
+        assert out.read_bytes() == data
+
+
+def test_rebuilt_fragment_matches_the_lost_one(coded):
+    data, tmp_path, paths = coded
+    fragments = {index: paths[index] for index in [0, 2, 4]}
+    out = str(tmp_path / 'rebuilt')
+    rebuild_fragment(fragments, len(data), 1, out, 3, 2)
+    with open(out, 'rb') as rebuilt, open(paths[1], 'rb') as lost:
+        assert rebuilt.read() == lost.read()
+
+
+def test_too_few_fragments_fail(coded):
+    data, tmp_path, paths = coded
+    with pytest.raises(ValueError):
+        decode_file({0: paths[0], 1: paths[1]}, len(data), str(tmp_path / 'out'), 3, 2)
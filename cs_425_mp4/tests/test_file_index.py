@@ -0,0 +1,39 @@
+from file_index import FileTable
+
+
+def test_sorted_names_follow_inserts_and_deletes():
+    table = FileTable({'b/2': ['n1'], 'a/1': ['n2']})
+    table['b/1'] = ['n1', 'n2']
+    table['c'] = ['n3']
+    table['a/1'] = ['n3']
+    assert table.sorted_names == ['a/1', 'b/1', 'b/2', 'c']
+    assert table.prefix('b/') == ['b/1', 'b/2']
+    assert table.prefix('d') == []
+    assert table.range('a', 'c') == ['a/1', 'b/1', 'b/2']
+
+    del table['b/1']
+    assert table.pop('c') == ['n3']
+    assert table.pop('c', None) is None
+    assert table.sorted_names == ['a/1', 'b/2']
+    table.update({'a/0': ['n1'], 'b/2': ['n2']})
+    assert table.sorted_names == ['a/0', 'a/1', 'b/2'] == sorted(table)
+
+
+def test_host_index_follows_replica_lists():
+    table = FileTable()
+    table['f'] = ['n1', 'n2']
+    table['g'] = ['n2', 'n3']
+    assert table.files_on('n2') == ['f', 'g']
+
+    # replica lists are replaced, the old hosts lose the file
+    table['f'] = ['n3', 'n4']
+    assert table.files_on('n1') == [] and 'n1' not in table.host_files
+    assert table.files_on('n3') == ['f', 'g']
+
+    table.setdefault('h', ['n4'])
+    table.setdefault('h', ['n1'])
+    assert table.files_on('n4') == ['f', 'h']
+    del table['g']
+    assert table.files_on('n2') == []
+    table.clear()
+    assert table.files_on('n3') == [] and table.sorted_names == []
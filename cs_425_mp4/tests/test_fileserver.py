@@ -0,0 +1,272 @@
+def test_recover_metadata_keeps_pulled_attrs(fileserver, monkeypatch):
+    # a member that followed node01 takes over: its own log is older than what it pulled
+    monkeypatch.setattr(fileserver, 'metadata_leader', 'node01')
+    fileserver.filelocation_list['f'] = ['node01', 'node02', 'node03']
+    erasure = {'k': 2, 'm': 1, 'size': 10}
+    fileserver.file_attrs['f'] = {'version': 7, 'size': 10, 'erasure': erasure}
+
+    fileserver.recover_metadata()
+
+    assert fileserver.filelocation_list['f'] == ['node01', 'node02', 'node03']
+    assert fileserver.file_attrs['f'] == {'version': 7, 'size': 10, 'erasure': erasure}
+    assert fileserver.erasure_of('f') == erasure
+    # and the new leader's log now starts from them
+    fileserver.filelocation_list.clear()
+    fileserver.metadata_log.replay(fileserver.filelocation_list)
+    assert fileserver.file_attrs['f']['version'] == 7
+
+
+class Scheduler():
+    def __init__(self):
+        self.finished = []
+    def finish_write(self, sdfs_filename):
+        self.finished.append(sdfs_filename)
+    def finish_read(self, sdfs_filename):
+        self.finished.append(sdfs_filename)
+    def finish_request(self, http_packet):
+        self.finished.append(http_packet['task_id'])
+    def submit(self, http_packet):
+        pass
+
+
+def put_request(task_id, quorum, size = 10):
+    return {'task_id': task_id, 'request_type': 'put', 'request_source': 'node04', 'sdfs_filename': 'f',
+            'local_filename': '/tmp/f', 'size': size, 'quorum': quorum}
+
+
+def put_ack(task_id, replica_ip, ok = True):
+    return {'task_id': task_id, 'request_type': 'put_ack', 'request_source': 'node04', 'sdfs_filename': 'f',
+            'replica_ip': replica_ip, 'ok': ok}
+
+
+def finish_acks(fileserver):
+    return [http_packet for dest, http_packet in fileserver.sent if http_packet['request_type'] == 'finish_ack']
+
+
+def test_put_is_recorded_once_quorum_acked(fileserver, monkeypatch):
+    monkeypatch.setattr(fileserver, 'leader_scheduler', Scheduler())
+    fileserver.send2Member(put_request('p1', 2))
+    replicas = fileserver.write_acks['p1']['replicas']
+    assert len(replicas) == fileserver.replication_factor
+    # nothing is visible before the replicas have the bytes
+    assert 'f' not in fileserver.filelocation_list and 'f' not in fileserver.file_attrs
+
+    fileserver.handle_put_ack(put_ack('p1', replicas[0]))
+    assert 'f' not in fileserver.file_attrs
+    fileserver.handle_put_ack(put_ack('p1', replicas[1]))
+    assert fileserver.file_attrs['f']['version'] == 1
+    assert fileserver.filelocation_list['f'] == replicas
+    assert fileserver.fresh_replicas['f'] == set(replicas[:2])
+    assert 'failed' not in finish_acks(fileserver)[0]
+
+    # lagging replicas are fresh once they ack
+    for replica_ip in replicas[2:]:
+        fileserver.handle_put_ack(put_ack('p1', replica_ip))
+    assert fileserver.fresh_replicas['f'] == set(replicas)
+    assert 'p1' not in fileserver.write_acks
+
+
+def test_put_below_quorum_keeps_previous_version(fileserver, monkeypatch):
+    monkeypatch.setattr(fileserver, 'leader_scheduler', Scheduler())
+    fileserver.send2Member(put_request('p1', 3))
+    replicas = fileserver.write_acks['p1']['replicas']
+    for replica_ip in replicas:
+        fileserver.handle_put_ack(put_ack('p1', replica_ip))
+    assert fileserver.file_attrs['f']['version'] == 1
+
+    fileserver.sent.clear()
+    fileserver.send2Member(put_request('p2', 3, size = 20))
+    assert fileserver.write_acks['p2']['http_packet']['version'] == 2
+    fileserver.handle_put_ack(put_ack('p2', replicas[0]))
+    for replica_ip in replicas[1:]:
+        fileserver.handle_put_ack(put_ack('p2', replica_ip, ok = False))
+
+    assert finish_acks(fileserver)[0]['failed'] == ['f']
+    assert fileserver.file_attrs['f'] == {'version': 1, 'size': 10}
+    assert fileserver.filelocation_list['f'] == replicas
+    assert fileserver.fresh_replicas['f'] == set(replicas)
+
+
+def test_put_file_fails_the_ack_of_an_older_version(fileserver, tmp_path):
+    source = tmp_path / 'source'
+    source.write_bytes(b'old bytes')
+    fileserver.replica_versions['f'] = 5
+    put = put_request('p1', 3)
+    put['local_filename'] = str(source)
+    put['version'] = 4
+    fileserver.put_file(put)
+    assert fileserver.sent[-1][1]['request_type'] == 'put_ack'
+    assert fileserver.sent[-1][1]['ok'] is False
+    assert fileserver.replica_versions['f'] == 5
+
+    put['version'] = 6
+    fileserver.put_file(put)
+    assert fileserver.sent[-1][1]['ok'] is True
+    assert fileserver.replica_versions['f'] == 6
+    assert fileserver.pack_store.read('f') == b'old bytes'
+
+
+def test_get_to_unreachable_requester_is_failed(fileserver, monkeypatch):
+    fileserver.replica_versions['f'] = 1
+    fileserver.pack_store.put('f', __file__)
+    monkeypatch.setattr(fileserver, 'send_packet', lambda *args: False)
+    fileserver.get_file({'task_id': 't1', 'request_type': 'get', 'request_source': 'a', 'sdfs_filename': 'f',
+                         'local_filename': '/tmp/f', 'relay': ['a', 'b', 'c'], 'waiters': {}})
+    dest, ack = fileserver.sent[-1]
+    assert ack['request_type'] == 'get_ack' and ack['failed'] is True
+    assert ack['dest'] == 'a' and ack['relay_failed'] == ['b', 'c']
+    fileserver.pack_store.delete('f')
+
+
+def test_failed_get_ack_fails_its_requests_and_frees_the_file(fileserver, monkeypatch):
+    scheduler = Scheduler()
+    submitted = []
+    scheduler.submit = submitted.append
+    monkeypatch.setattr(fileserver, 'leader_scheduler', scheduler)
+    fileserver.filelocation_list['f'] = ['node01']
+    fileserver.file_attrs['f'] = {'version': 1, 'size': 4}
+    requests = [{'task_id': f't{i}', 'request_type': 'get', 'request_source': dest, 'sdfs_filename': 'f', 'local_filename': f'/tmp/f{i}'}
+                for i, dest in enumerate(['a', 'b', 'c'])]
+    requests[0]['joined'] = requests[1:]
+    fileserver.send_get(requests[0])
+    assert fileserver.sent[-1][1]['relay'] == ['a', 'b', 'c']
+
+    fileserver.sent.clear()
+    fileserver.handle_ack({'task_id': 't0', 'request_type': 'get_ack', 'request_source': 'a', 'dest': 'a', 'sdfs_filename': 'f',
+                           'replica_ip': 'node01', 'failed': True, 'relay_failed': ['b', 'c']})
+    assert finish_acks(fileserver) == [{'request_type': 'finish_ack', 'task_id': 't0', 'failed': ['f']}]
+    assert [request['task_id'] for request in submitted] == ['t1', 't2']
+    assert 't0' not in fileserver.read_state and scheduler.finished == ['f']
+
+
+def test_failed_fragment_write_is_marked_lost_and_repaired(fileserver, monkeypatch):
+    monkeypatch.setattr(fileserver, 'leader_scheduler', Scheduler())
+    scheduled = []
+    monkeypatch.setattr(fileserver.rereplication_planner, 'schedule', lambda sdfs_filename, redundancy: scheduled.append((sdfs_filename, redundancy)))
+    put = put_request('p1', 3)
+    put['erasure'] = {'k': 2, 'm': 1, 'size': 10}
+    fileserver.send2Member(put)
+    fragments = fileserver.write_acks['p1']['replicas']
+    assert len(fragments) == 3
+
+    fileserver.handle_put_ack(put_ack('p1', fragments[0]))
+    fileserver.handle_put_ack(put_ack('p1', fragments[2]))
+    # committed without the lagging fragment, which readers skip
+    assert fileserver.file_attrs['f']['version'] == 1
+    fileserver.sent.clear()
+    fileserver.send2Member({'task_id': 'g1', 'request_type': 'get', 'request_source': 'node04', 'sdfs_filename': 'f', 'local_filename': '/tmp/f'})
+    assert fileserver.sent[-1][1]['hosts'] == [fragments[0], fileserver.lost_fragment, fragments[2]]
+
+    fileserver.sent.clear()
+    fileserver.handle_put_ack(put_ack('p1', fragments[1], ok = False))
+    assert fileserver.filelocation_list['f'] == [fragments[0], fileserver.lost_fragment, fragments[2]]
+    assert (fragments[1], 'discard') in [(dest, http_packet['request_type']) for dest, http_packet in fileserver.sent]
+    assert scheduled == [('f', 0)]
+
+
+def test_local_load_counts_stored_copies(fileserver):
+    packed = fileserver.pack_store.stats()['bytes']
+    for sdfs, data in [('a', b'x' * 100), ('b', b'y' * 50)]:
+        incoming = fileserver.incoming_path()
+        with open(incoming, 'wb') as fd:
+            fd.write(data)
+        assert fileserver.install_copy(incoming, sdfs, 1, pack = False)
+    assert fileserver.local_load()['stored'] == packed + 150
+
+    incoming = fileserver.incoming_path()
+    with open(incoming, 'wb') as fd:
+        fd.write(b'z' * 10)
+    fileserver.install_copy(incoming, 'a', 2, pack = False)
+    fileserver.remove_stored('b')
+    assert fileserver.local_load()['stored'] == packed + 10
+    fileserver.remove_stored('a')
+    assert fileserver.local_load()['stored'] == packed + 0
+
+
+def test_juice_removes_inputs_and_reports_errors(fileserver, monkeypatch):
+    def download(sdfs_filename):
+        if sdfs_filename == 'missing':
+            raise FileNotFoundError(sdfs_filename)
+        with open(f'{fileserver.mp3_local_path}/{sdfs_filename}', 'w') as fd:
+            fd.write(f'({sdfs_filename}, 1)\n')
+    monkeypatch.setattr(fileserver, 'downloadFile', download)
+    juice = {'task_id': 'j1', 'request_type': 'juice', 'juice_exe': 'cat', 'juice_id': 1, 'num_juices': 1}
+
+    fileserver.handleJuiceRequest(dict(juice, files_to_reduce = ['a', 'b']))
+    dest, response = fileserver.sent[-1]
+    assert response['request_type'] == 'juice_response' and 'error' not in response
+    assert not {'a', 'b'} & set(fileserver.os.listdir(fileserver.mp3_local_path)) and fileserver.input_users == {}
+
+    fileserver.handleJuiceRequest(dict(juice, files_to_reduce = ['a', 'missing', 'b']))
+    dest, response = fileserver.sent[-1]
+    assert response['request_type'] == 'juice_response' and 'missing' in response['error']
+    assert not {'a', 'b'} & set(fileserver.os.listdir(fileserver.mp3_local_path)) and fileserver.input_users == {}
+
+
+def test_delete_before_a_slow_put_acks_and_drops_the_put(fileserver, tmp_path):
+    fileserver.metadata_log.record(fileserver.filelocation_list, 'put', 'f', [fileserver.host_domain_name], {'version': 1, 'size': 7})
+    fileserver.send2Member({'task_id': 'd1', 'request_type': 'delete', 'request_source': 'node04', 'sdfs_filename': 'f'})
+    dest, delete = fileserver.sent[-1]
+    assert delete['version'] == 2
+
+    # the leader released the put at its write quorum, this replica's copy has not arrived yet
+    fileserver.delete_file(delete)
+    dest, ack = fileserver.sent[-1]
+    assert ack['request_type'] == 'delete_ack' and ack['replica_ip'] == fileserver.host_domain_name
+
+    source = tmp_path / 'source'
+    source.write_bytes(b'deleted')
+    put = put_request('p1', 3)
+    put['local_filename'] = str(source)
+    put['version'] = 1
+    fileserver.put_file(put)
+    assert fileserver.sent[-1][1]['ok'] is False
+    assert not fileserver.is_stored('f')
+
+    # the file put again gets a version above the tombstone
+    fileserver.metadata_log.record(fileserver.filelocation_list, 'delete', 'f')
+    put['version'] = fileserver.next_attrs('f', 7)['version']
+    fileserver.put_file(put)
+    assert fileserver.sent[-1][1]['ok'] is True
+    fileserver.remove_stored('f')
+
+
+def test_request_on_a_missing_file_is_failed(fileserver, monkeypatch):
+    scheduler = Scheduler()
+    monkeypatch.setattr(fileserver, 'leader_scheduler', scheduler)
+    joined = {'task_id': 'g2', 'request_type': 'get', 'request_source': 'node03', 'sdfs_filename': 'missing', 'local_filename': '/tmp/m'}
+    for request in [{'task_id': 'g1', 'request_type': 'get', 'request_source': 'node04', 'sdfs_filename': 'missing',
+                     'local_filename': '/tmp/m', 'joined': [joined]},
+                    {'task_id': 'd1', 'request_type': 'delete', 'request_source': 'node04', 'sdfs_filename': 'missing'}]:
+        fileserver.send2Member(request)
+    assert [(dest, http_packet['task_id'], http_packet['failed']) for dest, http_packet in fileserver.sent] == \
+        [('node04', 'g1', ['missing']), ('node03', 'g2', ['missing']), ('node04', 'd1', ['missing'])]
+    assert scheduler.finished == ['g1', 'd1']
+
+
+def test_repair_transfers_go_through_admission(fileserver, monkeypatch):
+    monkeypatch.setattr(fileserver, 'admission', fileserver.AdmissionControl(max_outstanding = 10))
+    monkeypatch.setattr(fileserver.election, 'is_leader', lambda : True)
+    fileserver.metadata_log.record(fileserver.filelocation_list, 'put', 'f', ['node01'], {'version': 1, 'size': 4})
+    during = []
+    def wait(task_id, timeout):
+        during.append(fileserver.admission.stats()['per_class'])
+        return True
+    monkeypatch.setattr(fileserver.rereplication_planner, 'wait', wait)
+
+    assert fileserver.repair_copy('f', {'node01', 'node02'})
+    assert during == [{'rereplication': 1}]
+    assert fileserver.admission.stats()['outstanding'] == 0
+    assert fileserver.filelocation_list['f'] == ['node01', 'node02']
+
+    # a leader full of user requests holds repairs back, one that lost the lease gives up
+    for i in range(3):
+        fileserver.admission.admit(f't{i}', 'node04')
+    leader = [True]
+    monkeypatch.setattr(fileserver.election, 'is_leader', lambda : leader[0])
+    def sleep(seconds):
+        leader[0] = False
+    monkeypatch.setattr(fileserver.time, 'sleep', sleep)
+    assert not fileserver.repair_copy('f', {'node01', 'node02', 'node03'})
+    assert during == [{'rereplication': 1}]
+    assert fileserver.admission.stats()['rejected'] == {'rereplication': 1}
@@ -0,0 +1,37 @@
+import socket
+import threading
+from framing import send_message, recv_message, store_payload
+
+
+def test_messages_and_payloads_round_trip(tmp_path):
+    source = tmp_path / 'source'
+    source.write_bytes(bytes(range(256)) * 1000)
+    left, right = socket.socketpair()
+    def sender():
+        send_message(left, {'request_type': 'get_ack', 'n': 1})
+        send_message(left, {'request_type': 'put', 'n': 2}, b'abc')
+        send_message(left, {'request_type': 'put', 'n': 3}, str(source))
+        send_message(left, {'request_type': 'get_ack', 'n': 4}, (str(source), 10, 5))
+        left.close()
+    threading.Thread(target = sender, daemon = True).start()
+
+    assert recv_message(right, str(tmp_path)) == {'request_type': 'get_ack', 'n': 1}
+    small = recv_message(right, str(tmp_path))
+    store_payload(small, str(tmp_path / 'small'))
+    assert (tmp_path / 'small').read_bytes() == b'abc' and 'payload_path' not in small
+    assert small['payload_bytes'] == 3
+
+    whole = recv_message(right, str(tmp_path))
+    with open(whole['payload_path'], 'rb') as fd:
+        assert fd.read() == source.read_bytes()
+    ranged = recv_message(right, str(tmp_path))
+    with open(ranged['payload_path'], 'rb') as fd:
+        assert fd.read() == source.read_bytes()[10:15]
+    # the peer closed the connection
+    assert recv_message(right, str(tmp_path)) is None
+    right.close()
+
+
+def test_message_without_payload_stores_an_empty_file(tmp_path):
+    store_payload({'request_type': 'put'}, str(tmp_path / 'empty'))
+    assert (tmp_path / 'empty').read_bytes() == b''
@@ -0,0 +1,77 @@
+import json
+from metadata_log import MetadataLog, apply_entry, encode_snapshot, decode_snapshot
+
+
+def test_replay_restores_table_and_attrs_from_wal(tmp_path):
+    log = MetadataLog(str(tmp_path))
+    table = {}
+    log.replay(table)
+    log.record(table, 'put', 'a', ['n1', 'n2'], {'version': 1, 'size': 3})
+    log.record(table, 'put', 'b', ['n2', 'n3'], {'version': 1, 'size': 5})
+    log.record(table, 'move', 'a', ['n1', 'n4'])
+    log.record(table, 'delete', 'b')
+
+    restored = MetadataLog(str(tmp_path))
+    replayed = {}
+    assert restored.replay(replayed) == 4
+    assert replayed == {'a': ['n1', 'n4']}
+    assert restored.attrs == {'a': {'version': 1, 'size': 3}}
+
+
+def test_compaction_snapshot_and_later_records(tmp_path):
+    log = MetadataLog(str(tmp_path), snapshot_interval = 3)
+    table = {}
+    log.replay(table)
+    for index in range(5):
+        log.record(table, 'put', f'f{index}', ['n1'], {'version': 1, 'size': index})
+    # the snapshot was taken at 3 records, the wal holds the 2 after it
+    with open(log.snapshot_path) as fd:
+        assert json.load(fd)['version'] == 3
+    with open(log.wal_path) as fd:
+        assert [json.loads(line)['version'] for line in fd] == [4, 5]
+
+    restored = MetadataLog(str(tmp_path))
+    replayed = {}
+    assert restored.replay(replayed) == 5
+    assert replayed == table and restored.attrs == log.attrs
+
+
+def test_replay_stops_at_a_torn_record(tmp_path):
+    log = MetadataLog(str(tmp_path))
+    table = {}
+    log.replay(table)
+    log.record(table, 'put', 'a', ['n1'])
+    with open(log.wal_path, 'a') as fd:
+        fd.write('{"version": 2, "op": "pu')
+    replayed = {}
+    assert MetadataLog(str(tmp_path)).replay(replayed) == 1
+    assert replayed == {'a': ['n1']}
+
+
+def test_replay_again_closes_the_previous_wal(tmp_path):
+    log = MetadataLog(str(tmp_path))
+    log.replay({})
+    first = log.wal_fd
+    log.replay({})
+    assert first.closed and not log.wal_fd.closed
+
+
+def test_entries_since_and_snapshot_encoding(tmp_path):
+    log = MetadataLog(str(tmp_path))
+    table = {}
+    log.replay(table)
+    for index in range(3):
+        log.record(table, 'put', f'f{index}', ['n1', 'n2'])
+    assert [entry['version'] for entry in log.entries_since(1)] == [2, 3]
+    assert log.entries_since(3) == []
+    assert log.entries_since(5) is None
+
+    version, snapshot = log.snapshot(table)
+    assert version == 3 and decode_snapshot(snapshot) == table
+    assert snapshot['hosts'] == ['n1', 'n2']
+
+    copy = {}
+    for entry in log.entries_since(0):
+        apply_entry(copy, entry)
+    assert copy == table
+    assert decode_snapshot(encode_snapshot(copy)) == table
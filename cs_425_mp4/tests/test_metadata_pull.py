@@ -0,0 +1,36 @@
+def pull(fileserver, version, leader):
+    fileserver.sent.clear()
+    fileserver.serve_metadata_pull({'task_id': 't', 'request_type': 'metadata_pull', 'request_source': 'node01',
+                                    'version': version, 'leader': leader})
+    return [http_packet for dest, http_packet in fileserver.sent if dest == 'node01']
+
+
+def test_members_pull_the_entries_after_their_version(fileserver, monkeypatch):
+    monkeypatch.setattr(fileserver, 'member_versions', {})
+    fileserver.metadata_log.replay(fileserver.filelocation_list)
+    fileserver.metadata_log.record(fileserver.filelocation_list, 'put', 'a', ['node01', 'node02'], {'version': 1, 'size': 3})
+    fileserver.metadata_log.record(fileserver.filelocation_list, 'put', 'b', ['node02', 'node03'], {'version': 1, 'size': 5})
+    fileserver.metadata_log.record(fileserver.filelocation_list, 'delete', 'a')
+
+    [delta] = pull(fileserver, 1, 'node00')
+    assert delta['request_type'] == 'metadata_delta' and delta['version'] == 3
+    assert [entry['version'] for entry in delta['entries']] == [2, 3]
+    assert fileserver.member_versions == {'node01': 1}
+    # an up to date member gets no answer
+    assert pull(fileserver, 3, 'node00') == []
+    # a member that followed another leader gets a snapshot
+    [snapshot] = pull(fileserver, 3, 'node02')
+    assert snapshot['request_type'] == 'metadata_snapshot' and snapshot['version'] == 3
+
+    # the member side: a snapshot, then deltas with entries it already has skipped
+    leader_table = dict(fileserver.filelocation_list)
+    fileserver.filelocation_list.clear()
+    fileserver.file_attrs.clear()
+    monkeypatch.setattr(fileserver, 'metadata_version', 0)
+    monkeypatch.setattr(fileserver, 'metadata_leader', None)
+    fileserver.update_file(snapshot)
+    assert fileserver.filelocation_list == leader_table == {'b': ['node02', 'node03']}
+    assert fileserver.file_attrs == {'b': {'version': 1, 'size': 5}}
+    fileserver.metadata_log.record(leader_table, 'put', 'c', ['node04'], {'version': 1, 'size': 1})
+    fileserver.update_file(pull(fileserver, 1, 'node00')[0])
+    assert fileserver.filelocation_list == leader_table and fileserver.metadata_version == 4
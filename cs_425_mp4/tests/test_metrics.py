@@ -0,0 +1,36 @@
+from metrics import Histogram, Metrics
+
+
+def test_histogram_percentiles_are_bucket_bounds():
+    histogram = Histogram(buckets = [1, 2, 5])
+    assert histogram.percentile(0.5) is None
+    for value in [0.5, 0.5, 1.5, 4, 9]:
+        histogram.observe(value)
+    assert histogram.counts == [2, 1, 1, 1]
+    assert histogram.percentile(0.4) == 1
+    assert histogram.percentile(0.5) == 2
+    assert histogram.percentile(0.8) == 5
+    # samples above the last bucket report the max
+    assert histogram.percentile(0.99) == 9
+    summary = histogram.summary()
+    assert summary['count'] == 5 and summary['mean'] == 3.1 and summary['max'] == 9
+
+
+def test_counters_timers_and_gauges_in_snapshot():
+    metrics = Metrics()
+    metrics.count('put')
+    metrics.count('put', 2)
+    metrics.start('t1', 'put.latency')
+    metrics.start('t2', 'get.latency')
+    metrics.stop('t1')
+    # stopping an operation that was never started is ignored
+    metrics.stop('t3')
+    metrics.gauge('queue', lambda: 4)
+    metrics.gauge('broken', lambda: 1 / 0)
+
+    snapshot = metrics.snapshot()
+    assert snapshot['counters'] == {'put': 3, 'put.latency.count': 1}
+    assert snapshot['histograms']['put.latency']['count'] == 1
+    assert 'get.latency' not in snapshot['histograms'] and snapshot['running'] == 1
+    assert snapshot['gauges']['queue'] == 4
+    assert 'division' in snapshot['gauges']['broken']
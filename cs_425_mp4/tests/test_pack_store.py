@@ -0,0 +1,47 @@
+import os
+from pack_store import PackStore
+
+
+def put(store, tmp_path, sdfs_filename, data):
+    path = tmp_path / 'local'
+    path.write_bytes(data)
+    store.put(sdfs_filename, str(path))
+
+
+def test_overwrites_and_deletes_leave_dead_bytes(tmp_path):
+    store = PackStore(str(tmp_path / 'pack'), segment_size = 100)
+    put(store, tmp_path, 'a', b'a' * 40)
+    put(store, tmp_path, 'b', b'b' * 40)
+    put(store, tmp_path, 'a', b'A' * 40)
+    assert store.read('a') == b'A' * 40 and store.read('b') == b'b' * 40
+    # the third file did not fit, a new segment was started
+    assert store.stats() == {'files': 2, 'segments': 2, 'bytes': 120, 'dead_bytes': 40}
+    assert store.delete('b') and not store.delete('b')
+    assert 'b' not in store and store.read('b') is None
+    assert store.fits(store.threshold) and not store.fits(store.threshold + 1)
+
+
+def test_compaction_moves_live_files_and_removes_the_segment(tmp_path):
+    store = PackStore(str(tmp_path / 'pack'), segment_size = 100)
+    put(store, tmp_path, 'a', b'a' * 30)
+    put(store, tmp_path, 'b', b'b' * 30)
+    put(store, tmp_path, 'c', b'c' * 30)
+    store.delete('a')
+    store.delete('b')
+    put(store, tmp_path, 'd', b'd' * 50)
+    sealed = store.segment_path(0)
+
+    # a reader keeps the segment on disk until it is done
+    with store.reading('c') as entry:
+        assert entry == (sealed, 60, 30)
+        assert store.compact() == 60
+        assert os.path.exists(sealed)
+    assert not os.path.exists(sealed)
+
+    assert store.read('c') == b'c' * 30 and store.read('d') == b'd' * 50
+    assert store.stats() == {'files': 2, 'segments': 1, 'bytes': 80, 'dead_bytes': 0}
+    # the active segment is never compacted
+    store.delete('d')
+    assert store.compact() == 0
+    assert store.extract('c', str(tmp_path / 'out'))
+    assert (tmp_path / 'out').read_bytes() == b'c' * 30
@@ -0,0 +1,34 @@
+import pytest
+from peer_stats import PeerStats, min_sample_bytes, default_rtt, default_throughput
+
+
+def test_samples_are_averaged_with_alpha():
+    stats = PeerStats(alpha = 0.5)
+    stats.record_rtt('n1', 0.010)
+    assert stats.rtts['n1'] == 0.010
+    stats.record_rtt('n1', 0.030)
+    stats.record_rtt('n1', 0.030)
+    assert stats.rtts['n1'] == pytest.approx(0.025)
+
+    stats.record_transfer('n1', min_sample_bytes, 1)
+    stats.record_transfer('n1', 3 * min_sample_bytes, 1)
+    assert stats.throughputs['n1'] == pytest.approx(2 * min_sample_bytes)
+    # small or instant transfers say nothing about throughput
+    stats.record_transfer('n1', min_sample_bytes - 1, 0.000001)
+    stats.record_transfer('n1', min_sample_bytes, 0)
+    assert stats.throughputs['n1'] == pytest.approx(2 * min_sample_bytes)
+
+    assert stats.expected_time('n1', 4 * min_sample_bytes) == pytest.approx(0.025 + 2)
+    assert stats.expected_time('n2', 100) == pytest.approx(default_rtt + 100 / default_throughput)
+
+
+def test_rank_prefers_fast_peers_and_probes_others():
+    stats = PeerStats(probe_rate = 0)
+    stats.record_rtt('slow', 0.5)
+    stats.record_rtt('fast', 0.002)
+    # never measured peers look fast so they get tried
+    assert stats.rank(['slow', 'fast', 'new']) == ['new', 'fast', 'slow']
+
+    stats.probe_rate = 1
+    assert stats.rank(['slow', 'fast'])[0] == 'slow'
+    assert set(stats.snapshot()) == {'slow', 'fast'}
@@ -0,0 +1,43 @@
+import time
+import pytest
+from prefetch import Prefetcher
+
+
+def test_files_come_in_order_and_stay_within_depth():
+    downloaded = []
+    ahead = []
+    def download(name):
+        downloaded.append(name)
+    names = [f'f{i}' for i in range(6)]
+    prefetcher = Prefetcher(names, download, lambda name: 1, depth = 2)
+    for index, name in enumerate(prefetcher.start()):
+        assert name == names[index] and name in downloaded
+        ahead.append(len(downloaded) - index - 1)
+    assert downloaded == names
+    assert max(ahead) <= 2
+
+
+def test_budget_limits_downloads_ahead():
+    downloaded = []
+    prefetcher = Prefetcher(['a', 'b', 'c'], downloaded.append, lambda name: 10, depth = 2, budget = 15).start()
+    iterator = iter(prefetcher)
+    assert next(iterator) == 'a'
+    # 'b' is always fetched, 'c' would take the unprocessed bytes to 20
+    with prefetcher.condition:
+        prefetcher.condition.wait_for(lambda : 1 in prefetcher.ready, timeout = 5)
+    time.sleep(0.2)
+    assert downloaded == ['a', 'b']
+    assert list(iterator) == ['b', 'c']
+
+
+def test_download_error_is_raised_in_order():
+    def download(name):
+        if name == 'b':
+            raise OSError('b is gone')
+    prefetcher = Prefetcher(['a', 'b', 'c'], download, lambda name: None).start()
+    consumed = []
+    with pytest.raises(OSError):
+        for name in prefetcher:
+            consumed.append(name)
+    assert consumed == ['a']
+    prefetcher.join()
@@ -0,0 +1,72 @@
+from relay import relay_subtree, receive_relayed
+
+
+def file_data(tmp_path, relay = None, index = 0, **fields):
+    payload = tmp_path / 'payload'
+    payload.write_bytes(b'data')
+    http_packet = {'task_id': 't1', 'request_type': 'file_data', 'request': 'get', 'sdfs_filename': 'f',
+                   'local_filename': str(tmp_path / 'out_t1'), 'replica_ip': 'replica', 'request_source': 'a',
+                   'payload_path': str(payload), 'payload_bytes': 4, 'payload_seconds': 0.5}
+    if relay is not None:
+        http_packet['relay'] = relay
+        http_packet['relay_index'] = index
+        http_packet['waiters'] = {dest: [[f'{dest}{i}', str(tmp_path / f'out_{dest}{i}')] for i in range(2)] for dest in relay}
+    http_packet.update(fields)
+    return http_packet
+
+
+def store_into(http_packet):
+    def store(path):
+        with open(http_packet.pop('payload_path'), 'rb') as source, open(path, 'wb') as dest:
+            dest.write(source.read())
+    return store
+
+
+def test_relay_subtree():
+    assert sorted(relay_subtree(0, 7)) == [0, 1, 2, 3, 4, 5, 6]
+    assert sorted(relay_subtree(1, 7)) == [1, 3, 4]
+    assert sorted(relay_subtree(2, 6)) == [2, 5]
+    assert relay_subtree(3, 3) == []
+
+
+def test_single_get_is_stored_and_acked(tmp_path):
+    http_packet = file_data(tmp_path)
+    transfers = []
+    ack = receive_relayed(http_packet, 'a', store_into(http_packet), None, lambda *transfer: transfers.append(transfer))
+    assert (tmp_path / 'out_t1').read_bytes() == b'data'
+    assert ack['failed'] is False and ack['relay_failed'] == [] and ack['dest'] == 'a'
+    assert transfers == [('replica', 4, 0.5)]
+
+
+def test_joined_get_serves_all_waiters_and_relays_on(tmp_path):
+    relay = ['a', 'b', 'c', 'd', 'e']
+    http_packet = file_data(tmp_path, relay)
+    forwarded = []
+    def forward(dest, child_packet, path):
+        forwarded.append((dest, child_packet['relay_index'], 'payload_path' in child_packet))
+        return dest != 'b'
+    ack = receive_relayed(http_packet, 'a', store_into(http_packet), forward)
+    assert (tmp_path / 'out_a0').read_bytes() == (tmp_path / 'out_a1').read_bytes() == b'data'
+    assert forwarded == [('b', 1, False), ('c', 2, False)]
+    # b could not be reached, nor can the servers it would have relayed to
+    assert ack['failed'] is False and sorted(ack['relay_failed']) == ['b', 'd', 'e']
+
+    # a relayed copy comes from the parent in the tree
+    http_packet = file_data(tmp_path, relay, index = 4)
+    transfers = []
+    receive_relayed(http_packet, 'e', store_into(http_packet), None, lambda *transfer: transfers.append(transfer))
+    assert transfers == [('b', 4, 0.5)]
+
+
+def test_failed_get_is_acked(tmp_path):
+    http_packet = file_data(tmp_path, ['a', 'b', 'c'], error = 'No such file')
+    del http_packet['payload_path']
+    ack = receive_relayed(http_packet, 'a', store_into(http_packet), None)
+    assert ack['failed'] is True and 'No such file' in ack['error']
+    assert sorted(ack['relay_failed']) == ['b', 'c']
+    assert not (tmp_path / 'out_a0').exists()
+
+    def broken(path):
+        raise OSError('disk full')
+    ack = receive_relayed(file_data(tmp_path), 'a', broken, None)
+    assert ack['failed'] is True and ack['error'] == 'disk full'
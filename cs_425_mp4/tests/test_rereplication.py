@@ -0,0 +1,44 @@
+import time
+import threading
+from rereplication import RereplicationPlanner
+
+
+def test_files_with_least_redundancy_are_repaired_first():
+    repaired, done = [], threading.Event()
+    def repair(sdfs_filename):
+        repaired.append(sdfs_filename)
+        if len(repaired) == 4:
+            done.set()
+    planner = RereplicationPlanner(repair, max_workers = 1)
+    planner.schedule('three', 3)
+    planner.schedule('one', 1)
+    planner.schedule('two', 2)
+    planner.schedule('moved_up', 3)
+    # a file already queued only moves up
+    planner.schedule('moved_up', 0)
+    planner.schedule('moved_up', 2)
+    assert planner.pending() == 4
+
+    planner.start()
+    assert done.wait(5)
+    assert repaired == ['moved_up', 'one', 'two', 'three']
+
+
+def test_transfers_are_capped_per_member():
+    planner = RereplicationPlanner(lambda sdfs_filename: None, max_per_member = 1)
+    assert planner.reserve(['d1'], ['s1']) == ('d1', ['s1'])
+    # busy members are skipped while others are free
+    assert planner.reserve(['d1', 'd2'], ['s1', 's2']) == ('d2', ['s2'])
+    assert planner.reserve([], ['s1']) is None
+    assert planner.reserve(['d3'], ['s3'], source_count = 2) is None
+
+    # all candidates busy: wait for a release
+    reserved = []
+    waiter = threading.Thread(target = lambda: reserved.append(planner.reserve(['d1'], ['s1', 's3'])), daemon = True)
+    waiter.start()
+    time.sleep(0.1)
+    assert reserved == []
+    planner.release(['d1', 's1'])
+    waiter.join(5)
+    assert reserved[0][0] == 'd1' and reserved[0][1] in (['s1'], ['s3'])
+    assert planner.load['d1'] == 1
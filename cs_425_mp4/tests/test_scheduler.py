@@ -0,0 +1,137 @@
+import time
+import threading
+from scheduler import RequestScheduler
+
+
+def request(task_id, request_type, **fields):
+    http_packet = {'task_id': task_id, 'request_type': request_type, 'sdfs_filename': 'f', 'request_source': 'a'}
+    http_packet.update(fields)
+    return http_packet
+
+
+def started(dispatched, count):
+    # the scheduling thread dispatches asynchronously, wait until count requests started
+    deadline = time.time() + 5
+    while len(dispatched) < count and time.time() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    return [http_packet['task_id'] for http_packet in dispatched]
+
+
+def run(scheduler):
+    threading.Thread(target = scheduler.run, daemon = True).start()
+
+
+def test_readers_share_a_file_writers_run_alone():
+    dispatched = []
+    scheduler = RequestScheduler(dispatched.append)
+    for task_id in ['g0', 'g1', 'g2']:
+        scheduler.submit(request(task_id, 'get'))
+    scheduler.submit(request('p0', 'put'))
+    scheduler.submit(dict(request('o0', 'get'), sdfs_filename = 'other'))
+    run(scheduler)
+
+    # max_readers gets at once, other files are not held up
+    assert sorted(started(dispatched, 3)) == ['g0', 'g1', 'o0']
+    scheduler.finish_read('f')
+    assert started(dispatched, 4)[3] == 'g2'
+    scheduler.finish_read('f')
+    time.sleep(0.1)
+    assert len(dispatched) == 4
+    scheduler.finish_read('f')
+    assert started(dispatched, 5)[4] == 'p0'
+    scheduler.submit(request('g3', 'get'))
+    time.sleep(0.1)
+    assert len(dispatched) == 5
+    scheduler.finish_write('f')
+    assert started(dispatched, 6)[5] == 'g3'
+
+
+def test_the_other_type_goes_after_max_consecutive():
+    dispatched = []
+    scheduler = RequestScheduler(dispatched.append, max_readers = 1, max_consecutive = 2)
+    for task_id in ['g0', 'g1', 'g2']:
+        scheduler.submit(request(task_id, 'get'))
+    scheduler.submit(request('p0', 'put'))
+    run(scheduler)
+
+    assert started(dispatched, 1) == ['g0']
+    scheduler.finish_read('f')
+    assert started(dispatched, 2) == ['g0', 'g1']
+    scheduler.finish_read('f')
+    # two reads in a row, the waiting put passes g2
+    assert started(dispatched, 3) == ['g0', 'g1', 'p0']
+    scheduler.finish_write('f')
+    assert started(dispatched, 4) == ['g0', 'g1', 'p0', 'g2']
+
+
+def test_queued_puts_are_superseded_by_the_last_one():
+    dispatched, superseded = [], []
+    scheduler = RequestScheduler(dispatched.append, supersede = superseded.append)
+    for task_id in ['p0', 'p1', 'p2']:
+        scheduler.submit(request(task_id, 'put'))
+    scheduler.submit(request('g0', 'get'))
+    scheduler.submit(request('p3', 'put'))
+    run(scheduler)
+
+    assert started(dispatched, 1) == ['p2']
+    assert [http_packet['task_id'] for http_packet in superseded] == ['p0', 'p1']
+    scheduler.finish_write('f')
+    assert started(dispatched, 2) == ['p2', 'g0']
+    scheduler.finish_read('f')
+    # a put behind a get is not superseded by an earlier one
+    assert started(dispatched, 3) == ['p2', 'g0', 'p3']
+
+
+def test_gets_join_up_to_the_next_write():
+    dispatched = []
+    scheduler = RequestScheduler(dispatched.append, join_reads = lambda http_packet: True)
+    scheduler.submit(request('p0', 'put'))
+    for task_id in ['g0', 'g1', 'g2']:
+        scheduler.submit(request(task_id, 'get'))
+    scheduler.submit(request('r0', 'get', offset = 5, length = 3))
+    scheduler.submit(request('p1', 'put'))
+    scheduler.submit(request('g3', 'get'))
+    run(scheduler)
+
+    assert started(dispatched, 1) == ['p0']
+    scheduler.finish_write('f')
+    assert started(dispatched, 3) == ['p0', 'g0', 'r0']
+    # a byte range is read on its own, the get behind the next put does not join
+    assert [http_packet['task_id'] for http_packet in dispatched[1]['joined']] == ['g1', 'g2']
+    assert dispatched[2]['joined'] == []
+    scheduler.finish_read('f')
+    scheduler.finish_read('f')
+    assert started(dispatched, 4)[3] == 'p1'
+
+
+def test_gets_do_not_join_without_join_reads():
+    dispatched = []
+    scheduler = RequestScheduler(dispatched.append, join_reads = lambda http_packet: False)
+    for task_id in ['g0', 'g1', 'g2']:
+        scheduler.submit(request(task_id, 'get'))
+    run(scheduler)
+    # max_readers gets run at once, each on its own
+    assert started(dispatched, 2) == ['g0', 'g1']
+    assert all('joined' not in http_packet for http_packet in dispatched)
+
+
+def test_higher_classes_are_served_first():
+    dispatched = []
+    scheduler = RequestScheduler(dispatched.append)
+    scheduler.submit(dict(request('j0', 'put', priority = 'job'), sdfs_filename = 'j'))
+    scheduler.submit(dict(request('m0', 'rebalance', priority = 'rereplication'), sdfs_filename = 'm'))
+    scheduler.submit(dict(request('i0', 'put', priority = 'interactive'), sdfs_filename = 'i'))
+    run(scheduler)
+    assert started(dispatched, 3) == ['i0', 'j0', 'm0']
+
+
+def test_background_work_lets_user_requests_of_its_file_pass():
+    dispatched = []
+    scheduler = RequestScheduler(dispatched.append)
+    scheduler.submit(request('m0', 'rebalance', priority = 'rereplication'))
+    scheduler.submit(request('g0', 'get'))
+    run(scheduler)
+    assert started(dispatched, 1) == ['g0']
+    scheduler.finish_read('f')
+    assert started(dispatched, 2) == ['g0', 'm0']